@@ -115,3 +115,9 @@ def show_jupyter_config(session: nox.Session):
 from pyproject_local_kernel.provisioner import PyprojectKernelProvisioner
 print(PyprojectKernelProvisioner.class_config_section())"""
     session.run("uv", "run", "python", "-c", script, external=True)
+
+
+@nox.session(name="bench-tomlscan")
+def bench_tomlscan(session: nox.Session):
+    "benchmark reading large pyproject.toml files; extra args are file sizes in kB"
+    session.run("uv", "run", "python", "tools/bench_tomlscan.py", *session.posargs, external=True)
@@ -81,6 +81,16 @@ class Config(_PostInitTypeCheck):
     python_cmd: t.Optional[t.Union[str, t.List[str]]] = None
     use_venv: t.Optional[str] = None
     sanity_check: t.Optional[bool] = None
+    # true: automatic, false: disabled, int: fixed number of threads
+    thread_budget: t.Optional[t.Union[bool, int]] = None
+    # idle timeout in minutes, 0 to disable
+    idle_timeout: t.Optional[t.Union[int, float]] = None
+    idle_action: t.Optional[str] = None
+    ipykernel_overlay: t.Optional[bool] = None
+    import_profile: t.Optional[bool] = None
+    standby_kernel: t.Optional[bool] = None
+    # name of the pixi environment
+    pixi_environment: t.Optional[str] = None
 
     from_dict = classmethod(_dataclass_from_dict)
 
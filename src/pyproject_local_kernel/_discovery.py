@@ -0,0 +1,132 @@
+"""
+Cached discovery of executables and python interpreters
+
+Looking up tools on PATH and querying interpreters is repeated for every
+kernel launch. Results are cached in process, keyed on PATH and the identity
+of the file found, and revalidated with a single stat call before use.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import logging
+import os
+import shutil
+import subprocess
+import typing as t
+
+
+_logger = logging.getLogger(__name__)
+
+_SCRIPT_INTERPRETER_FACTS = """\
+import json, os, platform, sys, sysconfig
+print(json.dumps({
+    "executable": os.path.realpath(sys.executable),
+    "implementation": sys.implementation.name,
+    "version": list(sys.version_info[:3]),
+    "prefix": sys.prefix,
+    "base_prefix": getattr(sys, "base_prefix", sys.prefix),
+    "soabi": sysconfig.get_config_var("SOABI") or sysconfig.get_config_var("EXT_SUFFIX") or "",
+    "abiflags": getattr(sys, "abiflags", ""),
+    "platform": sysconfig.get_platform(),
+    "machine": platform.machine(),
+}))
+"""
+
+# (st_dev, st_ino, st_size, st_mtime_ns)
+FileIdentity = t.Tuple[int, int, int, int]
+
+
+def file_identity(path: str | os.PathLike) -> FileIdentity | None:
+    "Identity of the file (following symlinks), None if it does not exist"
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+_which_cache: dict[tuple[str, str, str], tuple[str, FileIdentity]] = {}
+
+
+def which(name: str, path: str | None = None) -> str | None:
+    """
+    Like shutil.which, but cached. Tools that are not found are not cached,
+    so that a newly installed tool is picked up.
+    """
+    if path is None:
+        path = os.environ.get("PATH", os.defpath)
+    key = (name, path, os.environ.get("PATHEXT", ""))
+    if cached := _which_cache.get(key):
+        found, identity = cached
+        if file_identity(found) == identity:
+            return found
+        # another thread may have removed it too
+        _which_cache.pop(key, None)
+    found = shutil.which(name, path=path)
+    if found is not None and (identity := file_identity(found)) is not None:
+        _which_cache[key] = (found, identity)
+    return found
+
+
+def resolve_command(cmd: t.Sequence[str], env: t.Mapping[str, str] | None = None) -> list[str]:
+    "Resolve the program name in cmd to its path on PATH (of env), if it is found"
+    cmd = list(cmd)
+    if cmd and os.path.basename(cmd[0]) == cmd[0]:
+        path = (env if env is not None else os.environ).get("PATH", os.defpath)
+        if found := which(cmd[0], path):
+            cmd[0] = found
+    return cmd
+
+
+@dataclasses.dataclass(frozen=True)
+class InterpreterFacts:
+    "Facts about a python interpreter"
+    # real path of sys.executable
+    executable: str
+    implementation: str
+    version: tuple[int, int, int]
+    prefix: str
+    # base installation of the interpreter, differs from prefix in a virtual environment
+    base_prefix: str
+    soabi: str
+    abiflags: str
+    platform: str
+    machine: str
+
+    @property
+    def is_venv(self) -> bool:
+        return self.prefix != self.base_prefix
+
+
+_interpreter_cache: dict[tuple[str, str | None], tuple[InterpreterFacts, FileIdentity]] = {}
+
+
+def interpreter_facts(python: str | os.PathLike, cwd: str | os.PathLike | None = None) -> InterpreterFacts:
+    """
+    Query facts about the python interpreter, cached while the interpreter
+    file is unchanged. cwd matters for shims (like pyenv's) which pick the
+    interpreter by directory.
+
+    Raises OSError, subprocess.SubprocessError or ValueError on failure.
+    """
+    executable = os.path.abspath(python)
+    key = (executable, None if cwd is None else str(cwd))
+    identity = file_identity(executable)
+    if identity is not None and (cached := _interpreter_cache.get(key)) and cached[1] == identity:
+        return cached[0]
+    proc = subprocess.run([executable, "-I", "-c", _SCRIPT_INTERPRETER_FACTS], cwd=cwd,
+                          capture_output=True, check=True, encoding="utf-8", timeout=10)
+    data = json.loads(proc.stdout)
+    data["version"] = tuple(data["version"])
+    facts = InterpreterFacts(**data)
+    _logger.debug("Interpreter %s: %r", executable, facts)
+    if identity is not None:
+        _interpreter_cache[key] = (facts, identity)
+    return facts
+
+
+def clear_cache():
+    _which_cache.clear()
+    _interpreter_cache.clear()
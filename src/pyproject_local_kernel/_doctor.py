@@ -0,0 +1,132 @@
+"""
+Diagnose kernel start for a directory
+
+`pyproject_local_kernel doctor DIR` runs the provisioner's pre-launch for a
+kernel started in DIR and reports the detected project, effective config and
+kernel command. With `--profile` it also starts the kernel and waits until it
+replies to kernel_info, and reports the duration of each launch phase.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+from pathlib import Path
+import time
+import typing as t
+import uuid
+
+from pyproject_local_kernel._identify import KERNEL_SPEC_NAME
+
+
+_logger = logging.getLogger(__name__)
+
+
+async def diagnose(directory: Path, kernel_name: str = KERNEL_SPEC_NAME, profile: bool = False,
+                   timeout: float = 60.) -> dict[str, t.Any]:
+    "Run kernel pre-launch (and with profile, start the kernel) in directory and return a report"
+    from jupyter_client.manager import AsyncKernelManager
+    from jupyter_client.provisioning import KernelProvisionerFactory as KPF  # type: ignore
+    from pyproject_local_kernel.provisioner import PyprojectKernelProvisioner
+
+    directory = directory.absolute()
+    km = AsyncKernelManager(kernel_name=kernel_name)
+    report: dict[str, t.Any] = {"directory": str(directory), "kernelspec": kernel_name}
+    timings: dict[str, float] = {}
+
+    if profile:
+        start = time.perf_counter()
+        await km.start_kernel(cwd=str(directory))
+        timings["start-kernel"] = time.perf_counter() - start
+        prov = km.provisioner
+    else:
+        prov = KPF.instance().create_provisioner_instance(str(uuid.uuid4()), km.kernel_spec, parent=km)
+    if not isinstance(prov, PyprojectKernelProvisioner):
+        raise RuntimeError(f"Kernelspec {kernel_name!r} does not use the pyproject-local-kernel provisioner")
+
+    try:
+        if profile:
+            client = km.client()
+            client.start_channels()
+            try:
+                start = time.perf_counter()
+                await client.wait_for_ready(timeout=timeout)
+                timings["kernel-info"] = time.perf_counter() - start
+                report["kernel_ready"] = True
+            except RuntimeError as exc:
+                report["kernel_ready"] = False
+                report["kernel_error"] = str(exc)
+            finally:
+                client.stop_channels()
+            command = km.format_kernel_cmd()
+        else:
+            kwargs = await prov.pre_launch(cwd=str(directory))
+            command = kwargs["cmd"]
+    finally:
+        if profile:
+            start = time.perf_counter()
+            await km.shutdown_kernel(now=not report.get("kernel_ready"))
+            timings["shutdown"] = time.perf_counter() - start
+        else:
+            await prov.cleanup(restart=False)
+            km.cleanup_connection_file()
+
+    project = prov._pplk_project
+    report["project"] = None if project is None else {
+        "kind": project.kind.name,
+        "pyproject": str(project.path) if project.path else None,
+        "config": dataclasses.asdict(project.config),
+    }
+    report["fallback_reason"] = prov._pplk_error
+    report["command"] = list(command)
+    report["phases"] = {**prov.launch_timings(), **timings}
+    report["ok"] = prov._pplk_error is None and report.get("kernel_ready", True)
+    return report
+
+
+def format_report(report: dict[str, t.Any]) -> str:
+    lines = [
+        f"Directory:  {report['directory']}",
+        f"Kernelspec: {report['kernelspec']}",
+    ]
+    project = report["project"]
+    if project is not None:
+        lines.append(f"Project:    {project['kind']} ({project['pyproject']})")
+        lines.append("Config:")
+        lines.extend(f"  {name.replace('_', '-')} = {value!r}" for name, value in project["config"].items())
+    if report["fallback_reason"] is not None:
+        lines.append("Fallback kernel, because of:")
+        lines.extend("  " + line for line in report["fallback_reason"].splitlines())
+    lines.append(f"Command:    {' '.join(report['command'])}")
+    if "kernel_ready" in report:
+        lines.append(f"Kernel ready: {'yes' if report['kernel_ready'] else 'no, ' + report.get('kernel_error', '')}")
+    if report["phases"]:
+        lines.append("Phases:")
+        width = max(map(len, report["phases"]))
+        lines.extend(f"  {phase:<{width}}  {seconds * 1000:9.1f} ms" for phase, seconds in report["phases"].items())
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="pyproject_local_kernel doctor",
+                                     description="Check how a kernel would start in a directory")
+    parser.add_argument("directory", type=Path, nargs="?", default=Path.cwd(), help="Directory (default: current directory)")
+    parser.add_argument("--profile", action="store_true", help="Also start the kernel and measure each launch phase")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--kernel", default=KERNEL_SPEC_NAME, help=f"Kernelspec name (default: {KERNEL_SPEC_NAME})")
+    parser.add_argument("--timeout", type=float, default=60., help="Seconds to wait for the kernel to be ready")
+    args = parser.parse_args(argv)
+
+    try:
+        report = asyncio.run(diagnose(args.directory, args.kernel, profile=args.profile, timeout=args.timeout))
+    except Exception as exc:
+        _logger.error("%s", exc)
+        return 1
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 0 if report["ok"] else 1
@@ -0,0 +1,290 @@
+"""
+Cached environments shared between projects
+
+The ipykernel overlay is a directory with ipykernel and its dependencies
+installed, built once per python version and ABI. It is added at the end of
+sys.path of the project's interpreter, so that projects without ipykernel in
+their dependencies can start a kernel without uv building an ephemeral
+environment on every start (`uv run --with ipykernel`).
+
+The scratch environment is a read-only virtual environment with a configured
+set of packages, for notebooks outside of any project. It is built once per
+python version, ABI and package set and shared by all such notebooks.
+
+Script environments are built the same way for the dependencies that a
+notebook declares in its inline script metadata (_scriptmeta), so notebooks
+with the same dependencies share one. They are used as the notebooks come and
+go, so the least recently used ones are removed when the cache grows beyond
+its size limit.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+
+from pyproject_local_kernel import _discovery
+from pyproject_local_kernel._identify import get_venv_bin_python
+
+
+_logger = logging.getLogger(__name__)
+
+CACHE_DIR_ENV = "PYPROJECT_LOCAL_KERNEL_CACHE_DIR"
+_COMPLETE_MARKER = "pyproject-local-kernel-complete.json"
+# script environments used this recently are not removed, they are likely used by a running kernel
+# (of another server: the kernels of this one are known)
+_EVICT_MIN_AGE = 3600.
+
+_BOOTSTRAP_OVERLAY = """\
+import runpy, site, sys
+site.addsitedir({overlay!r})
+runpy.run_module("ipykernel_launcher", run_name="__main__", alter_sys=True)
+"""
+
+
+def user_cache_dir() -> Path:
+    "Cache directory for pyproject-local-kernel"
+    if cache_dir := os.environ.get(CACHE_DIR_ENV):
+        return Path(cache_dir)
+    if sys.platform == "win32":
+        base = Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local"))
+        return base / "pyproject-local-kernel" / "Cache"
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "pyproject-local-kernel"
+    base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return base / "pyproject-local-kernel"
+
+
+def interpreter_info(python: Path) -> dict[str, t.Any]:
+    "Query version and ABI of the python interpreter"
+    facts = _discovery.interpreter_facts(python)
+    return {
+        "implementation": facts.implementation,
+        "version": list(facts.version),
+        "soabi": facts.soabi,
+        "abiflags": facts.abiflags,
+        "platform": facts.platform,
+        "machine": facts.machine,
+    }
+
+
+def interpreter_key(info: dict[str, t.Any]) -> str:
+    "Key for environments that are compatible with the interpreter"
+    major, minor = info["version"][:2]
+    digest = hashlib.sha256(json.dumps(info, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{info['implementation']}-{major}.{minor}-{digest}"
+
+
+def uv_project_python(project_dir: Path) -> Path | None:
+    "The python interpreter of a uv project's environment, if it exists"
+    venv_dir = project_dir / os.environ.get("UV_PROJECT_ENVIRONMENT", ".venv")
+    python = get_venv_bin_python(venv_dir)
+    return python if python.exists() else None
+
+
+def ipykernel_overlay(python: Path, uv: str = "uv") -> Path | None:
+    """
+    Get the ipykernel overlay for this interpreter, build it if needed.
+    Return None if it could not be built.
+    """
+    try:
+        info = interpreter_info(python)
+    except (OSError, subprocess.SubprocessError, ValueError) as exc:
+        _logger.warning("Could not query python interpreter %s: %s", python, exc)
+        return None
+
+    overlay = user_cache_dir() / "ipykernel-overlay" / interpreter_key(info)
+    if (overlay / _COMPLETE_MARKER).exists():
+        return overlay
+
+    _logger.info("Building ipykernel overlay in %s", overlay)
+    overlay.parent.mkdir(parents=True, exist_ok=True)
+    build_dir = Path(tempfile.mkdtemp(prefix=".build-", dir=overlay.parent))
+    try:
+        # with bytecode, which the kernel could not write to the shared cache
+        subprocess.run([uv, "pip", "install", "-q", "--compile-bytecode", "--python", str(python), "--target", str(build_dir),
+                        "ipykernel"], check=True, timeout=300)
+        with open(build_dir / _COMPLETE_MARKER, "w", encoding="utf-8") as marker:
+            json.dump(info, marker)
+        try:
+            os.rename(build_dir, overlay)
+        except OSError:
+            # built concurrently by someone else
+            if not (overlay / _COMPLETE_MARKER).exists():
+                raise
+    except (OSError, subprocess.SubprocessError) as exc:
+        _logger.warning("Could not build ipykernel overlay: %s", exc)
+        return None
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return overlay
+
+
+def scratch_env(python: Path, packages: t.Sequence[str], uv: str = "uv") -> Path | None:
+    """
+    Get the scratch environment for this interpreter and package set, build it
+    if needed. Returns the environment's python, None if it could not be built.
+    """
+    try:
+        info = interpreter_info(python)
+    except (OSError, subprocess.SubprocessError, ValueError) as exc:
+        _logger.warning("Could not query python interpreter %s: %s", python, exc)
+        return None
+
+    packages = sorted(set(packages))
+    packages_key = hashlib.sha256(json.dumps(packages).encode("utf-8")).hexdigest()[:12]
+    venv = user_cache_dir() / "scratch" / f"{interpreter_key(info)}-{packages_key}"
+    if (venv / _COMPLETE_MARKER).exists() or _build_env(venv, python, packages, info, "scratch", uv):
+        return get_venv_bin_python(venv)
+    return None
+
+
+def _build_env(venv: Path, python: Path, packages: list[str], info: dict[str, t.Any], kind: str, uv: str = "uv") -> bool:
+    "Build a read-only virtual environment with the packages, return True if it was built"
+    _logger.info("Building %s environment in %s with %s", kind, venv, " ".join(packages))
+    venv.parent.mkdir(parents=True, exist_ok=True)
+    build_dir = Path(tempfile.mkdtemp(prefix=".build-", dir=venv.parent))
+    try:
+        # relocatable, because it is built in build_dir and then renamed
+        subprocess.run([uv, "venv", "-q", "--relocatable", "--python", str(python), str(build_dir)], check=True, timeout=300)
+        if packages:
+            # with bytecode, which the kernel can't write to the read-only environment
+            subprocess.run([uv, "pip", "install", "-q", "--compile-bytecode", "--python", str(get_venv_bin_python(build_dir)),
+                            *packages], check=True, timeout=600)
+        with open(build_dir / _COMPLETE_MARKER, "w", encoding="utf-8") as marker:
+            json.dump({**info, "packages": packages, "size": _disk_usage(build_dir)}, marker)
+        _make_read_only(build_dir)
+        try:
+            os.rename(build_dir, venv)
+        except OSError:
+            # built concurrently by someone else
+            if not (venv / _COMPLETE_MARKER).exists():
+                raise
+    except (OSError, subprocess.SubprocessError) as exc:
+        _logger.warning("Could not build %s environment: %s", kind, exc)
+        return False
+    finally:
+        _remove(build_dir)
+    return True
+
+
+def script_env(python: Path, packages: t.Sequence[str], max_size: int, uv: str = "uv",
+               in_use: t.Collection[Path] = ()) -> Path | None:
+    """
+    Get the script environment for this interpreter and package set. If it is
+    built, the least recently used script environments above max_size bytes
+    are removed, except those of the running kernels' interpreters in_use.
+    Returns the environment's python, None if it could not be built.
+    """
+    try:
+        info = interpreter_info(python)
+    except (OSError, subprocess.SubprocessError, ValueError) as exc:
+        _logger.warning("Could not query python interpreter %s: %s", python, exc)
+        return None
+
+    packages = sorted(set(packages))
+    packages_key = hashlib.sha256(json.dumps(packages).encode("utf-8")).hexdigest()[:12]
+    venv = user_cache_dir() / "script" / f"{interpreter_key(info)}-{packages_key}"
+    if (venv / _COMPLETE_MARKER).exists():
+        # the marker's modification time is the last use
+        try:
+            os.utime(venv / _COMPLETE_MARKER)
+        except OSError as exc:
+            _logger.debug("Could not mark %s as used: %s", venv, exc)
+        return get_venv_bin_python(venv)
+    if not _build_env(venv, python, packages, info, "script", uv):
+        return None
+    # only a new environment grows the cache
+    evict_envs(venv.parent, max_size, keep=venv, in_use=in_use)
+    return get_venv_bin_python(venv)
+
+
+def evict_envs(directory: Path, max_size: int, keep: Path | None = None, in_use: t.Collection[Path] = ()) -> list[Path]:
+    """
+    Remove the least recently used environments in directory until they use at most max_size bytes, return them.
+    Environments of the interpreters in_use are kept.
+    """
+    in_use_envs = {parent for python in in_use for parent in Path(python).parents}
+    envs = []
+    for venv in directory.iterdir():
+        if venv.name.startswith("."):
+            # being built or removed
+            continue
+        marker = venv / _COMPLETE_MARKER
+        try:
+            with open(marker, encoding="utf-8") as f:
+                size = json.load(f).get("size")
+            used = marker.stat().st_mtime
+        except (OSError, ValueError, AttributeError):
+            continue
+        envs.append((used, venv, size if isinstance(size, int) else _disk_usage(venv)))
+    total = sum(size for _used, _venv, size in envs)
+    removed = []
+    now = time.time()
+    for used, venv, size in sorted(envs):
+        if total <= max_size:
+            break
+        if venv == keep or venv in in_use_envs or now - used < _EVICT_MIN_AGE:
+            continue
+        _logger.info("Removing script environment %s, last used %s", venv, time.ctime(used))
+        # renamed first, so that it is never found incomplete
+        try:
+            evicted = Path(tempfile.mkdtemp(prefix=".evict-", dir=directory))
+            os.rename(venv, evicted / venv.name)
+        except OSError as exc:
+            _logger.debug("Could not remove %s: %s", venv, exc)
+            continue
+        _remove(evicted)
+        total -= size
+        removed.append(venv)
+    return removed
+
+
+def _disk_usage(path: Path) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path: Path):
+    if path.exists():
+        _make_writable(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _make_read_only(path: Path):
+    "Remove write permissions, so that packages are not installed into a shared environment by accident"
+    for root, _dirs, files in os.walk(path, topdown=False):
+        for name in [*files, None]:
+            file = os.path.join(root, name) if name is not None else root
+            if not os.path.islink(file):
+                os.chmod(file, os.stat(file).st_mode & ~0o222)
+
+
+def _make_writable(path: Path):
+    for root, _dirs, files in os.walk(path):
+        for name in [None, *files]:
+            file = os.path.join(root, name) if name is not None else root
+            if not os.path.islink(file):
+                os.chmod(file, os.stat(file).st_mode | 0o200)
+
+
+def overlay_kernel_args(kernel_args: list[str], overlay: Path) -> list[str] | None:
+    "Rewrite `-m ipykernel_launcher ...` so that it runs with the overlay, None if not supported"
+    if kernel_args[:2] != ["-m", "ipykernel_launcher"]:
+        return None
+    return ["-c", _BOOTSTRAP_OVERLAY.format(overlay=str(overlay)), *kernel_args[2:]]
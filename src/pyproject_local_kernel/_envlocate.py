@@ -0,0 +1,328 @@
+"""
+Locate project manager environments without running the project manager
+
+Computes where hatch, poetry and pixi put a project's environment,
+following their own rules, so that the kernel can start without a
+`hatch env find`, `poetry run` or `pixi run` call. When the location can not be
+determined, the project manager is used instead.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+import typing as t
+
+try:
+    import tomllib as tomli  # pyright: ignore[reportMissingImports]
+except ImportError:
+    import tomli as tomli    # pyright: ignore[reportMissingImports]
+
+try:
+    import platformdirs
+except ImportError:
+    platformdirs = None
+
+from pyproject_local_kernel import _discovery, _tomlscan
+
+
+_logger = logging.getLogger(__name__)
+
+_HATCH_ENV_VARIABLES = ["HATCH_CONFIG", "HATCH_DATA_DIR", "HATCH_ENV_TYPE_VIRTUAL_PATH"]
+
+
+def _read_toml(path: Path, tables: t.Sequence[str] | None = None) -> dict[str, t.Any] | None:
+    "Read the TOML file, or only the tables of it if given"
+    try:
+        if tables is not None:
+            return _tomlscan.load(path, tables)
+        with open(path, "rb") as f:
+            return tomli.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _normalize_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _expand(path: str) -> Path:
+    return Path(os.path.expanduser(os.path.expandvars(path)))
+
+
+def hatch_project_id(root: Path) -> str:
+    "Hatch's id for the project directory"
+    path = str(root)
+    if sys.platform in ("win32", "darwin"):
+        path = path.casefold()
+    digest = hashlib.sha256(path.encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest).decode("utf-8")[:8]
+
+
+def hatch_config_file() -> Path | None:
+    if config_file := os.environ.get("HATCH_CONFIG"):
+        return Path(config_file)
+    if platformdirs is None:
+        return None
+    return Path(platformdirs.user_config_dir("hatch", appauthor=False)) / "config.toml"
+
+
+def hatch_env_dir(project_root: Path) -> Path | None:
+    """
+    Location of the project's default hatch environment (like `hatch env find`),
+    None if it can not be determined in-process.
+    Note that the path doesn't necessarily exist.
+    """
+    root = project_root.resolve()
+    config_file = hatch_config_file()
+    if config_file is None:
+        return None
+    try:
+        pyproject = _read_toml(root / "pyproject.toml", ["project", "tool.hatch"]) or {}
+        hatch_toml = _read_toml(root / "hatch.toml")
+        config = _read_toml(config_file) or {}
+    except (OSError, tomli.TOMLDecodeError) as exc:
+        _logger.debug("Could not read hatch configuration: %s", exc)
+        return None
+
+    hatch_settings = hatch_toml if hatch_toml is not None else pyproject.get("tool", {}).get("hatch", {})
+    env_config = hatch_settings.get("envs", {}).get("default", {})
+    # environment plugins are left to hatch
+    if env_config.get("type", "virtual") != "virtual":
+        return None
+
+    project_name = pyproject.get("project", {}).get("name")
+    if not isinstance(project_name, str):
+        return None
+    project_name = _normalize_name(project_name)
+    project_id = hatch_project_id(root)
+
+    # explicit path
+    if chosen := os.environ.get("HATCH_ENV_TYPE_VIRTUAL_PATH") or env_config.get("path"):
+        return Path(chosen) if os.path.isabs(chosen) else (root / chosen).resolve()
+
+    dirs = config.get("dirs", {})
+    if env_dir := dirs.get("env", {}).get("virtual"):
+        data_directory = _expand(env_dir)
+        if not data_directory.is_absolute():
+            data_directory = root / data_directory
+    else:
+        data_dir = os.environ.get("HATCH_DATA_DIR") or dirs.get("data")
+        if not data_dir:
+            if platformdirs is None:
+                return None
+            data_dir = platformdirs.user_data_dir("hatch", appauthor=False)
+        data_directory = _expand(data_dir) / "env" / "virtual"
+
+    if data_directory == Path.home() / ".virtualenvs" or root in data_directory.resolve().parents:
+        return data_directory / project_name
+    return data_directory / project_name / project_id / project_name
+
+
+_hatch_find_cache: dict[tuple, str] = {}
+
+
+def hatch_env_find(project_root: Path) -> str | None:
+    "Ask hatch for the environment location (cached while the configuration is unchanged)"
+    config_file = hatch_config_file()
+    key = (
+        str(project_root),
+        tuple(os.environ.get(name) for name in _HATCH_ENV_VARIABLES),
+        *(_discovery.file_identity(path) for path in
+          [project_root / "pyproject.toml", project_root / "hatch.toml", *([config_file] if config_file else [])]),
+    )
+    if (cached := _hatch_find_cache.get(key)) is not None:
+        return cached
+    try:
+        proc = subprocess.run(["hatch", "--no-color", "env", "find"],
+                              cwd=project_root,
+                              timeout=3, capture_output=True, check=True, encoding="utf-8")
+    except (OSError, subprocess.SubprocessError) as exc:
+        _logger.debug("Could not ask hatch for the environment: %s", exc)
+        return None
+    result = proc.stdout.strip()
+    _hatch_find_cache[key] = result
+    return result
+
+
+def _deep_update(target: dict, source: dict):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_update(target[key], value)
+        else:
+            target[key] = value
+
+
+class _PoetryConfig:
+    "Poetry settings from environment variables, poetry.toml and the global config.toml"
+    def __init__(self, project_root: Path):
+        config_dir = os.environ.get("POETRY_CONFIG_DIR") or platformdirs.user_config_dir(  # pyright: ignore
+            "pypoetry", appauthor=False, roaming=True)
+        self.data: dict[str, t.Any] = {
+            "cache-dir": platformdirs.user_cache_dir("pypoetry", appauthor=False),  # pyright: ignore
+            "virtualenvs": {"path": os.path.join("{cache-dir}", "virtualenvs")},
+        }
+        for config_file in (Path(config_dir) / "config.toml", project_root / "poetry.toml"):
+            _deep_update(self.data, _read_toml(config_file) or {})
+
+    def get(self, name: str, default: t.Any = None) -> t.Any:
+        value: t.Any = os.environ.get("POETRY_" + name.upper().replace("-", "_").replace(".", "_"))
+        if value is None:
+            value = self.data
+            for part in name.split("."):
+                if not isinstance(value, dict) or part not in value:
+                    return default
+                value = value[part]
+        if isinstance(value, str):
+            # settings can refer to other settings, like {cache-dir}
+            value = re.sub(r"{(.+?)}", lambda match: str(self.get(match.group(1), "")), value)
+        return value
+
+    def get_bool(self, name: str, default: bool | None = None) -> bool | None:
+        value = self.get(name, default)
+        if isinstance(value, str):
+            return value.lower() in ("true", "1")
+        return value
+
+
+def poetry_env_name(name: str, project_root: Path) -> str:
+    "Poetry's name for the project's environments, without the python version suffix"
+    sanitized_name = re.sub(r'[ $`!*@"\\\r\n\t]', "_", _normalize_name(name))[:42]
+    normalized_cwd = os.path.normcase(os.path.realpath(project_root))
+    digest = hashlib.sha256(normalized_cwd.encode("utf-8")).digest()
+    return f"{sanitized_name}-{base64.urlsafe_b64encode(digest).decode()[:8]}"
+
+
+def poetry_env_dir(project_root: Path) -> Path | None:
+    """
+    Location of the poetry project's virtual environment (like `poetry env info --path`),
+    None if it can not be determined in-process or the environment does not exist.
+    """
+    if platformdirs is None:
+        return None
+    try:
+        pyproject = _read_toml(project_root / "pyproject.toml", ["project", "tool.poetry"]) or {}
+        config = _PoetryConfig(project_root)
+        name = pyproject.get("project", {}).get("name") or pyproject.get("tool", {}).get("poetry", {}).get("name")
+        if not isinstance(name, str):
+            return None
+        base_env_name = poetry_env_name(name, project_root)
+        venvs_path = Path(config.get("virtualenvs.path")).expanduser()
+        env = (_read_toml(venvs_path / "envs.toml") or {}).get(base_env_name)
+    except (OSError, tomli.TOMLDecodeError) as exc:
+        _logger.debug("Could not read poetry configuration: %s", exc)
+        return None
+
+    # poetry uses an activated environment, leave that case to poetry
+    env_prefix = os.environ.get("VIRTUAL_ENV", os.environ.get("CONDA_PREFIX"))
+    if env_prefix and os.environ.get("CONDA_DEFAULT_ENV") != "base" and env is None:
+        return None
+
+    in_project = config.get_bool("virtualenvs.in-project")
+    in_project_venv = project_root / ".venv"
+    if in_project is not False and in_project_venv.is_dir():
+        return in_project_venv
+    # poetry would create the in-project environment
+    if in_project:
+        return None
+    # without a `poetry env use` entry, which python poetry picks is up to poetry
+    if env is None or not config.get_bool("virtualenvs.create", True):
+        return None
+    python_minor = env.get("minor") if isinstance(env, dict) else None
+    if not isinstance(python_minor, (str, int)):
+        _logger.debug("Unexpected poetry envs.toml entry for %s: %r", base_env_name, env)
+        return None
+    venv = venvs_path / f"{base_env_name}-py{str(python_minor).strip()}"
+    return venv if venv.is_dir() else None
+
+
+def pixi_env_dir(project_root: Path, environment: str = "default") -> Path | None:
+    """
+    Location of the pixi project's environment, None if it is not installed or
+    is older than pixi.lock (then `pixi run` has to install it).
+    """
+    env_dir = project_root / ".pixi" / "envs" / environment
+    # pixi records the installation in conda-meta
+    marker = next((path for path in (env_dir / "conda-meta" / "pixi", env_dir / "conda-meta" / "history")
+                   if path.is_file()), None)
+    if marker is None:
+        return None
+    try:
+        if (project_root / "pixi.lock").stat().st_mtime > marker.stat().st_mtime:
+            return None
+    except FileNotFoundError:
+        pass
+    return env_dir
+
+
+_pixi_shell_hook_cache: dict[tuple, dict[str, str]] = {}
+
+
+def pixi_shell_hook(project_root: Path, environment: str) -> dict[str, str] | None:
+    "Ask pixi for the activation variables (cached while the project and environment are unchanged)"
+    env_dir = project_root / ".pixi" / "envs" / environment
+    key = (
+        str(project_root),
+        environment,
+        *(_discovery.file_identity(path) for path in
+          [project_root / "pyproject.toml", project_root / "pixi.lock", env_dir / "conda-meta"]),
+    )
+    if (cached := _pixi_shell_hook_cache.get(key)) is not None:
+        return cached
+    try:
+        proc = subprocess.run(["pixi", "shell-hook", "--json", "--environment", environment],
+                              cwd=project_root, timeout=30, capture_output=True, check=True, encoding="utf-8")
+        result = json.loads(proc.stdout)["environment_variables"]
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError, TypeError) as exc:
+        _logger.debug("Could not get the pixi activation: %s", exc)
+        return None
+    _pixi_shell_hook_cache[key] = result
+    return result
+
+
+def pixi_environment(project_root: Path, environment: str = "default") -> tuple[Path, dict[str, str]] | None:
+    """
+    Python and activation variables of the pixi project's environment (like `pixi run`),
+    None if it can not be used directly.
+    """
+    # conda activation on Windows needs more directories on PATH, leave it to pixi
+    if sys.platform == "win32":
+        return None
+    env_dir = pixi_env_dir(project_root, environment)
+    if env_dir is None:
+        return None
+    python = env_dir / "bin" / "python"
+    if not python.exists():
+        return None
+    activate_d = env_dir / "etc" / "conda" / "activate.d"
+    if activate_d.is_dir() and any(activate_d.iterdir()):
+        # packages with activation scripts, which pixi runs
+        env_vars = pixi_shell_hook(project_root, environment)
+        return None if env_vars is None else (python, env_vars)
+
+    try:
+        pyproject = _read_toml(project_root / "pyproject.toml", ["project", "tool.pixi"]) or {}
+    except (OSError, tomli.TOMLDecodeError) as exc:
+        _logger.debug("Could not read pixi configuration: %s", exc)
+        return None
+    pixi = pyproject.get("tool", {}).get("pixi", {})
+    workspace = pixi.get("workspace") or pixi.get("project") or {}
+    name = workspace.get("name") or pyproject.get("project", {}).get("name") or project_root.name
+    prompt = name if environment == "default" else f"{name}:{environment}"
+    # the variables that `pixi run` sets, besides PATH
+    return python, {
+        "CONDA_PREFIX": str(env_dir),
+        "CONDA_DEFAULT_ENV": prompt,
+        "PIXI_PROJECT_ROOT": str(project_root),
+        "PIXI_PROJECT_NAME": name,
+        "PIXI_PROJECT_MANIFEST": str(project_root / "pyproject.toml"),
+        "PIXI_ENVIRONMENT_NAME": environment,
+        "PIXI_PROMPT": f"({prompt}) ",
+    }
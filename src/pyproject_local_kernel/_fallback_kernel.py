@@ -0,0 +1,281 @@
+"""
+Minimal fallback kernel
+
+Implements the small part of the Jupyter messaging protocol needed to show
+help messages and run shell commands (lines starting with `!`), so that the
+user can fix their project. Only depends on pyzmq, which is already installed
+with jupyter-client, and starts quickly.
+"""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import typing as t
+import uuid
+
+import zmq
+
+
+_logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = "5.3"
+DELIM = b"<IDS|MSG>"
+
+_MESSAGE_ONLY_SHELL = "The fallback kernel can only run shell commands (lines starting with `!`)"
+
+
+class Message(t.NamedTuple):
+    identities: list[bytes]
+    header: dict
+    parent_header: dict
+    metadata: dict
+    content: dict
+
+
+class Session:
+    "Sign, serialize and deserialize messages"
+    def __init__(self, key: bytes, signature_scheme: str):
+        self.key = key
+        self.session_id = str(uuid.uuid4())
+        if not signature_scheme.startswith("hmac-"):
+            raise ValueError(f"Unsupported signature scheme {signature_scheme!r}")
+        self.digestmod = getattr(hashlib, signature_scheme[len("hmac-"):])
+
+    def sign(self, parts: t.Sequence[bytes]) -> bytes:
+        if not self.key:
+            return b""
+        mac = hmac.new(self.key, digestmod=self.digestmod)
+        for part in parts:
+            mac.update(part)
+        return mac.hexdigest().encode("ascii")
+
+    def send(self, socket: zmq.Socket, msg_type: str, content: dict, parent: Message | None = None,
+             identities: t.Sequence[bytes] = ()):
+        header = {
+            "msg_id": str(uuid.uuid4()),
+            "msg_type": msg_type,
+            "session": self.session_id,
+            "username": "kernel",
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "version": PROTOCOL_VERSION,
+        }
+        parts = [json.dumps(elt).encode("utf-8") for elt in
+                 (header, parent.header if parent else {}, {}, content)]
+        socket.send_multipart([*identities, DELIM, self.sign(parts), *parts])
+
+    def recv(self, socket: zmq.Socket) -> Message | None:
+        frames = socket.recv_multipart()
+        try:
+            split = frames.index(DELIM)
+        except ValueError:
+            _logger.warning("Dropping malformed message")
+            return None
+        signature, *parts = frames[split + 1:split + 6]
+        if self.key and not hmac.compare_digest(signature, self.sign(parts)):
+            _logger.warning("Dropping message with invalid signature")
+            return None
+        header, parent_header, metadata, content = (json.loads(part) for part in parts)
+        return Message(frames[:split], header, parent_header, metadata, content)
+
+
+class FallbackKernel:
+    def __init__(self, connection_info: dict, help_messages: list[str]):
+        self.help_messages = help_messages
+        self.session = Session(connection_info.get("key", "").encode("utf-8"),
+                               connection_info.get("signature_scheme", "hmac-sha256"))
+        self.context = zmq.Context()
+        transport = connection_info.get("transport", "tcp")
+        ip = connection_info.get("ip", "127.0.0.1")
+
+        def bind(socket_type: int, port_name: str) -> zmq.Socket:
+            socket = self.context.socket(socket_type)
+            socket.linger = 1000
+            port = connection_info[port_name]
+            if transport == "tcp":
+                socket.bind(f"tcp://{ip}:{port}")
+            else:
+                socket.bind(f"ipc://{ip}-{port}")
+            return socket
+
+        self.shell = bind(zmq.ROUTER, "shell_port")
+        self.control = bind(zmq.ROUTER, "control_port")
+        self.stdin = bind(zmq.ROUTER, "stdin_port")
+        self.iopub = bind(zmq.PUB, "iopub_port")
+        self.heartbeat = bind(zmq.ROUTER, "hb_port")
+        self.execution_count = 0
+        self.running: subprocess.Popen | None = None
+        self.interrupted = False
+        self.shutdown = False
+
+    def start(self):
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, lambda *args: self.interrupt())
+        self.publish_status("starting")
+        poller = zmq.Poller()
+        poller.register(self.shell, zmq.POLLIN)
+        poller.register(self.control, zmq.POLLIN)
+        while not self.shutdown:
+            for socket, _ in poller.poll():
+                self.handle(socket)
+        self.context.destroy(linger=1000)
+
+    def _heartbeat(self):
+        try:
+            zmq.proxy(self.heartbeat, self.heartbeat)
+        except zmq.ZMQError:
+            pass  # context terminated
+
+    def publish_status(self, state: str, parent: Message | None = None):
+        self.session.send(self.iopub, "status", {"execution_state": state}, parent)
+
+    def publish_stream(self, name: str, text: str, parent: Message):
+        self.session.send(self.iopub, "stream", {"name": name, "text": text}, parent)
+
+    def interrupt(self):
+        self.interrupted = True
+        if self.running is not None and self.running.poll() is None:
+            if hasattr(os, "killpg"):
+                try:
+                    os.killpg(self.running.pid, signal.SIGINT)
+                    return
+                except OSError:
+                    pass
+            self.running.terminate()
+
+    def handle(self, socket: zmq.Socket):
+        msg = self.session.recv(socket)
+        if msg is None:
+            return
+        msg_type = msg.header.get("msg_type", "")
+        _logger.debug("Received %s", msg_type)
+        request_name = msg_type[:-len("_request")] if msg_type.endswith("_request") else None
+        handler = request_name and getattr(self, "do_" + request_name, None)
+        if handler is None:
+            _logger.debug("Ignoring unsupported message %r", msg_type)
+            return
+        self.publish_status("busy", msg)
+        try:
+            reply = handler(msg)
+            self.session.send(socket, f"{request_name}_reply", reply, msg, msg.identities)
+        finally:
+            self.publish_status("idle", msg)
+
+    def do_kernel_info(self, msg: Message) -> dict:
+        return {
+            "status": "ok",
+            "protocol_version": PROTOCOL_VERSION,
+            "implementation": "pyproject_local_kernel_fallback",
+            "implementation_version": "1",
+            "language_info": {
+                "name": "python",
+                "version": ".".join(map(str, sys.version_info[:3])),
+                "mimetype": "text/x-python",
+                "file_extension": ".py",
+            },
+            "banner": "\n".join(self.help_messages),
+            "help_links": [],
+        }
+
+    def do_execute(self, msg: Message) -> dict:
+        code = msg.content.get("code", "")
+        silent = msg.content.get("silent", False)
+        if not silent:
+            self.execution_count += 1
+            self.session.send(self.iopub, "execute_input", {"code": code, "execution_count": self.execution_count}, msg)
+        self.publish_stream("stderr", "".join(line + "\n" for line in self.help_messages), msg)
+        self.interrupted = False
+        for line in code.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if not line.startswith("!"):
+                self.publish_stream("stderr", _MESSAGE_ONLY_SHELL + "\n", msg)
+                break
+            returncode = self.run_shell(line[1:], msg)
+            if self.interrupted:
+                self.publish_stream("stderr", "Interrupted\n", msg)
+                break
+            if returncode != 0:
+                self.publish_stream("stderr", f"Command exited with status {returncode}\n", msg)
+        return {"status": "ok", "execution_count": self.execution_count, "user_expressions": {}, "payload": []}
+
+    def run_shell(self, command: str, msg: Message) -> int:
+        "Run shell command, streaming its output"
+        popen_kwargs: dict[str, t.Any] = {}
+        if os.name != "nt":
+            popen_kwargs["start_new_session"] = True
+        try:
+            self.running = subprocess.Popen(command, shell=True, stdin=subprocess.DEVNULL,
+                                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_kwargs)
+        except OSError as exc:
+            self.publish_stream("stderr", f"{exc}\n", msg)
+            return 1
+        output: queue.Queue[tuple[str, bytes]] = queue.Queue()
+        readers = [threading.Thread(target=_read_stream, args=(name, stream, output), daemon=True)
+                   for name, stream in (("stdout", self.running.stdout), ("stderr", self.running.stderr))]
+        for reader in readers:
+            reader.start()
+        poller = zmq.Poller()
+        poller.register(self.control, zmq.POLLIN)
+        while any(reader.is_alive() for reader in readers) or not output.empty():
+            # control messages (interrupt) are handled while the command is running
+            for socket, _ in poller.poll(timeout=20):
+                self.handle(socket)
+            while not output.empty():
+                name, data = output.get()
+                self.publish_stream(name, data.decode("utf-8", errors="replace"), msg)
+        returncode = self.running.wait()
+        self.running = None
+        return returncode
+
+    def do_interrupt(self, msg: Message) -> dict:
+        self.interrupt()
+        return {"status": "ok"}
+
+    def do_shutdown(self, msg: Message) -> dict:
+        self.shutdown = True
+        return {"status": "ok", "restart": msg.content.get("restart", False)}
+
+    def do_is_complete(self, msg: Message) -> dict:
+        return {"status": "complete"}
+
+    def do_complete(self, msg: Message) -> dict:
+        cursor_pos = msg.content.get("cursor_pos", 0)
+        return {"status": "ok", "matches": [], "cursor_start": cursor_pos, "cursor_end": cursor_pos, "metadata": {}}
+
+    def do_inspect(self, msg: Message) -> dict:
+        return {"status": "ok", "found": False, "data": {}, "metadata": {}}
+
+    def do_history(self, msg: Message) -> dict:
+        return {"status": "ok", "history": []}
+
+    def do_comm_info(self, msg: Message) -> dict:
+        return {"status": "ok", "comms": {}}
+
+
+def _read_stream(name: str, stream: t.IO[bytes], output: queue.Queue):
+    while data := stream.read1(4096):  # type: ignore
+        output.put((name, data))
+
+
+def run(connection_file: str, help_messages: list[str]) -> int:
+    try:
+        with open(connection_file, encoding="utf-8") as cf:
+            connection_info = json.load(cf)
+    except (OSError, ValueError) as exc:
+        _logger.error("Could not read connection file: %s", exc)
+        return 1
+    kernel = FallbackKernel(connection_info, help_messages)
+    kernel.start()
+    return 0
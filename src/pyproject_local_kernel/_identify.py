@@ -10,8 +10,6 @@ import dataclasses
 import enum
 import logging
 import os
-import shutil
-import subprocess
 import sys
 from pathlib import Path
 import typing as t
@@ -22,6 +20,7 @@ except ImportError:
     import tomli as tomli    # pyright: ignore[reportMissingImports]
 
 
+from pyproject_local_kernel import _discovery, _envlocate, _tomlscan
 from pyproject_local_kernel._configdata import Config
 
 
@@ -29,9 +28,21 @@ _logger = logging.getLogger(__name__)
 
 MY_TOOL_NAME = "pyproject-local-kernel"  # name of tool section in pyproject.toml for this tool
 ENABLE_DEBUG_ENV = "PYPROJECT_LOCAL_KERNEL_DEBUG"
+IMPORT_PROFILE_ENV = "PYPROJECT_LOCAL_KERNEL_IMPORT_PROFILE"
 KERNEL_SPEC_NAME = "pyproject_local_kernel"
 KERNEL_SPECS = [KERNEL_SPEC_NAME, KERNEL_SPEC_NAME + "_use_venv"]
 
+# thread pool size variables for OpenMP, BLAS and numexpr
+THREAD_BUDGET_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMEXPR_MAX_THREADS",
+]
+
 
 class ProjectKind(enum.Enum):
     "detected project type"
@@ -42,6 +53,7 @@ class ProjectKind(enum.Enum):
     Pdm = enum.auto()
     Hatch = enum.auto()
     Uv = enum.auto()
+    Pixi = enum.auto()
     Unknown = enum.auto()
     NoProject = enum.auto()
     InvalidData = enum.auto()
@@ -57,6 +69,8 @@ class ProjectKind(enum.Enum):
             return ['hatch', 'run', 'python']
         if self == ProjectKind.Uv:
             return ['uv', 'run', '--with', 'ipykernel', 'python']
+        if self == ProjectKind.Pixi:
+            return ['pixi', 'run', 'python']
         return None
 
 
@@ -68,13 +82,16 @@ class ProjectDetection:
     config: Config = dataclasses.field(default_factory=Config)
     error_context: str | None = None
 
-    def get_python_cmd(self, allow_fallback=True, allow_hatch_workaround=False) -> t.Sequence[Path | str] | None:
-        penv = self.resolve(allow_fallback, allow_hatch_workaround)
+    def get_python_cmd(self, allow_fallback=True, allow_hatch_workaround=False,
+                       locate_venv=False) -> t.Sequence[Path | str] | None:
+        penv = self.resolve(allow_fallback, allow_hatch_workaround, locate_venv)
         return penv and penv.python_cmd
 
-    def resolve(self, allow_fallback=True, allow_hatch_workaround=False) -> PythonEnvironment | None:
+    def resolve(self, allow_fallback=True, allow_hatch_workaround=False, locate_venv=False) -> PythonEnvironment | None:
         """
         allow_hatch_workaround: call out to `hatch env find`
+        locate_venv: use the poetry virtualenv or pixi environment directly instead of `poetry run`
+            or `pixi run`, if it can be found
         """
         # hatch quirk
         use_venv = self.config.use_venv
@@ -97,6 +114,24 @@ class ProjectDetection:
             return PythonEnvironment(python_cmd)
 
         # project detection
+        if self.kind == ProjectKind.Poetry and locate_venv:
+            assert self.path is not None
+            if (venv := _envlocate.poetry_env_dir(self.path.parent)) is not None:
+                python = get_venv_bin_python(venv)
+                if python.exists():
+                    # like `poetry run`
+                    return PythonEnvironment([python], python.parent, extra_env={"VIRTUAL_ENV": str(venv)})
+
+        if self.kind == ProjectKind.Pixi:
+            assert self.path is not None
+            pixi_env = self.config.pixi_environment
+            if locate_venv and (env := _envlocate.pixi_environment(self.path.parent, pixi_env or "default")) is not None:
+                python, extra_env = env
+                # like `pixi run`, without checking the lock file and installing
+                return PythonEnvironment([python], python.parent, extra_env=extra_env)
+            if pixi_env is not None:
+                return PythonEnvironment(["pixi", "run", "--environment", pixi_env, "python"])
+
         result = self.kind.python_cmd()
 
         if result is not None:
@@ -111,9 +146,9 @@ class ProjectDetection:
 
     @classmethod
     def _fallback_project_kind(cls) -> ProjectKind:
-        if shutil.which("uv") is not None:
+        if _discovery.which("uv") is not None:
             return ProjectKind.Uv
-        if shutil.which("rye") is not None:
+        if _discovery.which("rye") is not None:
             return ProjectKind.Rye
         return ProjectKind.Unknown
 
@@ -123,9 +158,21 @@ class PythonEnvironment:
     "A project's python environment"
     python_cmd: t.Sequence[str | Path]
     venv_bin_dir: Path | None = None
+    thread_budget: int | None = None
+    # variables set by the project manager's activation
+    extra_env: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    def needs_environment(self) -> bool:
+        "True if update_environment has anything to update"
+        return self.venv_bin_dir is not None or self.thread_budget is not None or bool(self.extra_env)
 
     def update_environment(self, env: dict[str, t.Any]):
         "Update environment variables in dict env"
+        env.update(self.extra_env)
+        if self.thread_budget is not None:
+            # variables that are already set take precedence
+            for name in THREAD_BUDGET_VARIABLES:
+                env.setdefault(name, str(self.thread_budget))
         if self.venv_bin_dir is None:
             return
         path_env = env.get("PATH", os.defpath)
@@ -175,6 +222,9 @@ def is_hatch(data: dict):
     return has_project_table(data) and (get_dotkey(data, 'tool.hatch.version', None) is not None or
             get_dotkey(data, 'tool.hatch.envs', None) is not None)
 
+def is_pixi(data: dict):
+    return get_dotkey(data, 'tool.pixi', None) is not None
+
 def is_uv(data: dict):
     return has_project_table(data) and get_dotkey(data, 'tool.uv', None) is not None
 
@@ -186,8 +236,22 @@ def has_project_table(data: dict):
         has_dotkey(data, "project.dynamic"))
 
 
+# the tables of pyproject.toml used for identification
+IDENTIFY_TABLES = [
+    "project",
+    "tool.rye",
+    "tool.poetry",
+    "tool.pdm",
+    "tool.hatch",
+    "tool.uv",
+    "tool.pixi",
+    f"tool.{MY_TOOL_NAME}",
+]
+
+
 IDENTIFY_FUNCTIONS = {
     ProjectKind.Rye: is_rye,
+    ProjectKind.Pixi: is_pixi,
     ProjectKind.Pdm: is_pdm,
     ProjectKind.Poetry: is_poetry,
     ProjectKind.Hatch: is_hatch,
@@ -217,19 +281,22 @@ def _identify_toml(data) -> t.Tuple[ProjectKind, t.Optional[Config], t.Optional[
 
 
 def identify(file):
-    pyproj = find_pyproject_file_from(file)
+    return identify_file(find_pyproject_file_from(file))
+
+
+def identify_file(pyproj: Path | None) -> ProjectDetection:
+    "Identify project from its pyproject.toml file (None: no project)"
     extra_vars = {}
     if pyproj is None:
         identity = ProjectKind.NoProject
     else:
         try:
-            with open(pyproj, "rb") as tf:
-                toml_structure = tomli.load(tf)
-                identity, config, error_context = _identify_toml(toml_structure)
-                if config:
-                    extra_vars['config'] = config
-                if error_context:
-                    extra_vars['error_context'] = error_context
+            toml_structure = _tomlscan.load(pyproj, IDENTIFY_TABLES)
+            identity, config, error_context = _identify_toml(toml_structure)
+            if config:
+                extra_vars['config'] = config
+            if error_context:
+                extra_vars['error_context'] = error_context
         except (IOError, tomli.TOMLDecodeError) as exc:
             print("Error: ", exc, file=sys.stderr)
             kind = ProjectKind.InvalidData
@@ -247,14 +314,13 @@ def get_venv_bin_python(base_venv: Path) -> Path:
 
 def get_hatch_venv(pyproject_toml: Path):
     """
-    query hatch to get environment location.
+    Get the hatch environment location: computed in-process when its python
+    exists there, otherwise by asking hatch (`hatch env find`).
     Note that the path doesn't necessarily exist.
     """
-    try:
-        proc = subprocess.run(["hatch", "--no-color", "env", "find"],
-                              cwd=pyproject_toml.parent,
-                              timeout=3, capture_output=True, check=True, encoding="utf-8")
-        return proc.stdout.strip()
-    except OSError as exc:
-        _logger.exception("Error calling hatch: %s", exc)
-        return None
+    project_root = pyproject_toml.parent
+    env_dir = _envlocate.hatch_env_dir(project_root)
+    if env_dir is not None and get_venv_bin_python(env_dir).exists():
+        return str(env_dir)
+    _logger.debug("Asking hatch for the environment of %s (computed: %s)", project_root, env_dir)
+    return _envlocate.hatch_env_find(project_root)
@@ -0,0 +1,124 @@
+"""
+Reports from python's import time profile (`-X importtime`)
+
+With import profiling enabled, the kernel is started with `-X importtime` and
+the import time lines of its stderr are written to a file, until the report
+is written; the rest of its stderr goes to the server's stderr as usual. The
+profile lists every import during kernel startup with its own and cumulative
+time; the report sums it up per package and lists the slowest imports.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import logging
+import os
+from pathlib import Path
+import re
+import threading
+import typing as t
+
+
+_logger = logging.getLogger(__name__)
+
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+
+@dataclasses.dataclass
+class ImportRecord:
+    "One imported module"
+    name: str
+    self_us: int
+    cumulative_us: int
+    # nesting level, 0 for imports that are not part of another import
+    level: int
+
+    @property
+    def package(self) -> str:
+        return self.name.split(".")[0]
+
+
+def parse(lines: t.Iterable[str]) -> list[ImportRecord]:
+    "Parse import time lines, other lines (like other output on stderr) are ignored"
+    records = []
+    for line in lines:
+        if match := _LINE.match(line):
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append(ImportRecord(name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return records
+
+
+def package_times(records: t.Iterable[ImportRecord]) -> list[tuple[str, int]]:
+    "Import time of each top-level package (sum of the own time of its modules), slowest first"
+    packages: dict[str, int] = {}
+    for record in records:
+        packages[record.package] = packages.get(record.package, 0) + record.self_us
+    return sorted(packages.items(), key=lambda item: -item[1])
+
+
+def format_report(records: t.Sequence[ImportRecord], top: int = 25) -> str:
+    "Text report of the import profile, the times in ms"
+    total_us = sum(record.cumulative_us for record in records if record.level == 0)
+    lines = [f"Imported {len(records)} modules in {total_us / 1000:.1f} ms", ""]
+    lines.append(f"Top {top} packages by import time (sum of own time of their modules):")
+    for package, self_us in package_times(records)[:top]:
+        lines.append(f"  {self_us / 1000:9.1f} ms  {package}")
+    lines.append("")
+    lines.append(f"Top {top} imports by cumulative time (including the imports they trigger):")
+    for record in sorted(records, key=lambda record: -record.cumulative_us)[:top]:
+        lines.append(f"  {record.cumulative_us / 1000:9.1f} ms  {record.name}")
+    lines.append("")
+    lines.append(f"Top {top} imports by own time:")
+    for record in sorted(records, key=lambda record: -record.self_us)[:top]:
+        lines.append(f"  {record.self_us / 1000:9.1f} ms  {record.name}")
+    return "\n".join(lines) + "\n"
+
+
+class StderrTee:
+    """
+    Reads the kernel's stderr from a pipe: import time lines are written to the
+    profile log until stop(), other lines are forwarded to the original stderr
+    """
+
+    def __init__(self, log_path: Path, forward_fd: int):
+        read_fd, self._write_fd = os.pipe()
+        # owned by the reader thread, so that the original can be closed
+        self._forward_fd = os.dup(forward_fd)
+        self._log: t.BinaryIO | None = open(log_path, "wb", buffering=0)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, args=(read_fd,), name="pplk-importtime", daemon=True)
+        self._thread.start()
+
+    @property
+    def fd(self) -> int:
+        "File descriptor for the kernel's stderr"
+        return self._write_fd
+
+    def close_writer(self):
+        "Close the write end in this process, after the kernel has been started"
+        os.close(self._write_fd)
+
+    def stop(self):
+        "Stop writing the profile log; later import time lines are dropped"
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _run(self, read_fd: int):
+        try:
+            with open(read_fd, "rb") as pipe:
+                for line in pipe:
+                    if line.startswith(b"import time:"):
+                        with self._lock:
+                            if self._log is not None:
+                                self._log.write(line)
+                        continue
+                    while line:
+                        line = line[os.write(self._forward_fd, line):]
+        except OSError as exc:
+            _logger.debug("could not forward kernel stderr: %s", exc)
+        finally:
+            os.close(self._forward_fd)
+            self.stop()
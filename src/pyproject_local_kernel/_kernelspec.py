@@ -0,0 +1,192 @@
+"""
+Per-project kernelspecs with the project resolved in advance
+
+`pyproject_local_kernel kernelspec install --project DIR` identifies and
+resolves the project once and installs a kernelspec for it, which starts the
+project's python interpreter directly. At launch the provisioner only checks
+fingerprints of the project files (a few stat calls). If any of them changed,
+the project is identified and resolved again as usual.
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+import tempfile
+import typing as t
+
+from pyproject_local_kernel import _discovery
+from pyproject_local_kernel._configdata import Config
+from pyproject_local_kernel._identify import KERNEL_SPEC_NAME, ProjectDetection, ProjectKind, PythonEnvironment, identify
+
+
+_logger = logging.getLogger(__name__)
+
+# files which, when changed, added or removed, mean the project must be resolved again
+FINGERPRINT_FILES = [
+    "pyproject.toml",
+    "uv.lock",
+    "poetry.lock",
+    "poetry.toml",
+    "pdm.lock",
+    "pixi.lock",
+    "hatch.toml",
+    "requirements.lock",
+    "requirements-dev.lock",
+]
+
+_SCRIPT_QUERY_ENVIRONMENT = """\
+import importlib.util, json, sys
+print(json.dumps({
+    "executable": sys.executable,
+    "venv": sys.prefix != getattr(sys, "base_prefix", sys.prefix),
+    "ipykernel": importlib.util.find_spec("ipykernel") is not None,
+}))
+"""
+
+
+def _fingerprint(path: Path) -> list[int] | None:
+    identity = _discovery.file_identity(path)
+    return list(identity) if identity is not None else None
+
+
+def fingerprints(project_dir: Path, *paths: str | os.PathLike) -> dict[str, list[int] | None]:
+    "Fingerprints of the project files in project_dir and the other paths"
+    files = [project_dir / name for name in FINGERPRINT_FILES] + [Path(path) for path in paths]
+    return {str(path): _fingerprint(path) for path in files}
+
+
+def changed_file(recorded: dict[str, t.Any]) -> str | None:
+    "The first file that changed since the fingerprints were recorded, None if none did"
+    for path, fingerprint in recorded.items():
+        if _fingerprint(Path(path)) != fingerprint:
+            return path
+    return None
+
+
+def compile_project(project_dir: str | os.PathLike) -> dict[str, t.Any]:
+    """
+    Identify and resolve the project and return the data for the kernelspec's
+    provisioner config `compiled_project`.
+
+    Raises RuntimeError if the project can not be used.
+    """
+    project = identify(project_dir)
+    if project.path is None:
+        raise RuntimeError(f"No pyproject.toml found in {project_dir}")
+    if project.kind == ProjectKind.InvalidData:
+        raise RuntimeError(f"Could not use {project.path}: {project.error_context}")
+    environment = project.resolve(allow_hatch_workaround=True, locate_venv=True)
+    if environment is None:
+        raise RuntimeError(f"Could not find a python environment for {project.path} (project kind {project.kind.name})")
+
+    python_cmd = list(map(str, environment.python_cmd))
+    if python_cmd == ProjectKind.Uv.python_cmd():
+        # the project's own environment, which must have ipykernel
+        python_cmd = ["uv", "run", "python"]
+    env = dict(os.environ)
+    environment.update_environment(env)
+    query_cmd = _discovery.resolve_command(python_cmd, env) + ["-c", _SCRIPT_QUERY_ENVIRONMENT]
+    _logger.debug("Running %r", query_cmd)
+    try:
+        proc = subprocess.run(query_cmd, cwd=project.path.parent, env=env, stdout=subprocess.PIPE,
+                              check=True, encoding="utf-8", timeout=300)
+        # the last line, in case the project manager printed something too
+        info = json.loads(proc.stdout.strip().splitlines()[-1])
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError) as exc:
+        raise RuntimeError(f"Could not run python with {python_cmd!r}: {exc}")
+    if not info["ipykernel"]:
+        raise RuntimeError(f"Could not find `ipykernel` in the environment of {info['executable']}.\n"
+                           "Add `ipykernel` as a dependency in your project and update the virtual environment.")
+
+    python = Path(info["executable"])
+    if project.kind == ProjectKind.Pixi and environment.venv_bin_dir is None:
+        # `pixi run` has installed the environment, record its activation
+        environment = project.resolve(locate_venv=True) or environment
+    return {
+        "kind": project.kind.name,
+        "pyproject": str(project.path),
+        "config": dataclasses.asdict(project.config),
+        "python_cmd": [str(python)],
+        "venv_bin_dir": str(python.parent) if info["venv"] or environment.venv_bin_dir is not None else None,
+        "extra_env": environment.extra_env,
+        "fingerprints": fingerprints(project.path.parent, python),
+    }
+
+
+def load_compiled(data: dict[str, t.Any]) -> tuple[ProjectDetection, PythonEnvironment] | None:
+    "Project and environment from compiled data, None if it is stale or invalid"
+    try:
+        if (changed := changed_file(data["fingerprints"])) is not None:
+            _logger.debug("Compiled project is stale: %s changed", changed)
+            return None
+        project = ProjectDetection(Path(data["pyproject"]), ProjectKind[data["kind"]], Config.from_dict(data["config"]))
+        venv_bin_dir = data.get("venv_bin_dir")
+        environment = PythonEnvironment(list(data["python_cmd"]), Path(venv_bin_dir) if venv_bin_dir else None,
+                                        extra_env=dict(data.get("extra_env", {})))
+    except (KeyError, TypeError, AttributeError) as exc:
+        _logger.warning("Ignoring invalid compiled project: %r", exc)
+        return None
+    return project, environment
+
+
+def kernelspec_name(project_dir: Path) -> str:
+    "Default kernelspec name for the project"
+    name = re.sub(r"[^a-z0-9._-]+", "_", project_dir.name.lower()).strip("_") or "project"
+    return f"{KERNEL_SPEC_NAME}_{name}"
+
+
+def install(project_dir: Path, name: str | None = None, display_name: str | None = None,
+            user: bool = False, prefix: str | None = None) -> str:
+    "Compile the project and install its kernelspec, return the installed path"
+    import jupyter_client.kernelspec
+
+    compiled = compile_project(project_dir)
+    project_dir = Path(compiled["pyproject"]).parent
+    try:
+        base_spec = jupyter_client.kernelspec.get_kernel_spec(KERNEL_SPEC_NAME)
+    except jupyter_client.kernelspec.NoSuchKernel:
+        raise RuntimeError(f"Could not find kernelspec {KERNEL_SPEC_NAME!r}, is {KERNEL_SPEC_NAME} installed?")
+    spec = base_spec.to_dict()
+    spec["display_name"] = display_name or f"{base_spec.display_name} ({project_dir.name})"
+    provisioner_config = spec["metadata"]["kernel_provisioner"]["config"]
+    provisioner_config["compiled_project"] = compiled
+    # also usable without the provisioner
+    spec["argv"] = compiled["python_cmd"] + provisioner_config["python_kernel_args"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(Path(tmp_dir) / "kernel.json", "w", encoding="utf-8") as f:
+            json.dump(spec, f, indent=2)
+        return jupyter_client.kernelspec.KernelSpecManager().install_kernel_spec(
+            tmp_dir, kernel_name=name or kernelspec_name(project_dir), user=user, prefix=prefix)
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="pyproject_local_kernel kernelspec")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    install_parser = subparsers.add_parser(
+        "install", help="Install a kernelspec for a project, which starts the project's python interpreter directly")
+    install_parser.add_argument("--project", type=Path, default=Path.cwd(), help="Project directory (default: current directory)")
+    install_parser.add_argument("--name", help="Kernelspec name (default: from the project directory name)")
+    install_parser.add_argument("--display-name", help="Display name of the kernel")
+    location = install_parser.add_mutually_exclusive_group()
+    location.add_argument("--user", action="store_true", help="Install for the current user")
+    location.add_argument("--sys-prefix", action="store_true", help=f"Install in {sys.prefix} (default)")
+    location.add_argument("--prefix", help="Install in this prefix")
+    args = parser.parse_args(argv)
+
+    prefix = args.prefix if args.prefix is not None else (None if args.user else sys.prefix)
+    try:
+        path = install(args.project, name=args.name, display_name=args.display_name, user=args.user, prefix=prefix)
+    except RuntimeError as exc:
+        _logger.error("%s", exc)
+        return 1
+    print(f"Installed kernelspec {Path(path).name} in {path}")
+    return 0
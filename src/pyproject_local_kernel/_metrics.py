@@ -0,0 +1,152 @@
+"""
+Kernel launch metrics in Prometheus text format
+
+Metrics are kept in process and written periodically to a file, to be
+picked up by for example node_exporter's textfile collector.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import os
+from pathlib import Path
+import threading
+import typing as t
+
+
+_logger = logging.getLogger(__name__)
+
+_PREFIX = "pyproject_local_kernel_"
+
+
+def _format_labels(names: t.Sequence[str], values: t.Sequence[str], extra: str = "") -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+class Counter:
+    "Counter, optionally with labels"
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: t.Sequence[str] = ()):
+        self.name = _PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with REGISTRY.lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+            REGISTRY.changed()
+
+    def get(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self) -> t.Iterator[str]:
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value:g}"
+
+
+class Histogram:
+    "Histogram without labels"
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: t.Sequence[float]):
+        self.name = _PREFIX + name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.
+        self._count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with REGISTRY.lock:
+            if index < len(self._counts):
+                self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+            REGISTRY.changed()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def samples(self) -> t.Iterator[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self._counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}'
+        yield f'{self.name}_bucket{{le="+Inf"}} {self._count}'
+        yield f"{self.name}_sum {self._sum:g}"
+        yield f"{self.name}_count {self._count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Counter | Histogram] = []
+        self.version = 0
+        # metrics are updated from the event loop and from executor threads
+        self.lock = threading.Lock()
+        self._writer: asyncio.Future | None = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def changed(self):
+        self.version += 1
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str | os.PathLike):
+        "Write metrics file, atomically replacing the old file"
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(self.render(), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def start_writer(self, path: str, interval: float):
+        "Start writing the metrics file periodically (if not already started)"
+        if self._writer is not None and not self._writer.done():
+            return
+        self._writer = asyncio.ensure_future(self._write_periodically(path, interval))
+
+    async def _write_periodically(self, path: str, interval: float):
+        written_version = None
+        while True:
+            if written_version != self.version:
+                written_version = self.version
+                try:
+                    self.write(path)
+                except OSError as exc:
+                    _logger.error("Could not write metrics to %s: %s", path, exc)
+            await asyncio.sleep(interval)
+
+
+REGISTRY = Registry()
+
+kernel_starts = REGISTRY.register(Counter("kernel_starts_total", "Kernel starts by project kind", ["kind"]))
+kernel_restarts = REGISTRY.register(Counter("kernel_restarts_total", "Kernel restarts"))
+fallback_kernels = REGISTRY.register(Counter("fallback_kernels_total", "Fallback kernel starts"))
+sanity_check_failures = REGISTRY.register(Counter("sanity_check_failures_total", "Failed sanity checks"))
+kernel_adoptions = REGISTRY.register(Counter("kernel_adoptions_total", "Running kernels adopted after a restart, by project kind", ["kind"]))
+port_pool_exhausted = REGISTRY.register(Counter("port_pool_exhausted_total", "Launches that needed more ports than the port pool had"))
+start_seconds = REGISTRY.register(Histogram(
+    "start_duration_seconds", "Time from pre-launch until the kernel process is started",
+    [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]))
@@ -0,0 +1,161 @@
+"""
+Bounded capture of the kernel's output
+
+The kernel's stdout and stderr, including the output of wrappers like `uv run`
+or `poetry run` that start it, are read through pipes and forwarded to the
+Jupyter server's stdout and stderr like before. The latest output is also kept
+in a fixed size ring buffer, so that it can be logged with timestamps when the
+kernel fails to start, starts slowly or the fallback kernel is used.
+
+The pipes are read directly into the ring buffer (os.readv) and forwarded
+from there, so the output is not copied on its way through. Only supported
+on posix.
+"""
+
+from __future__ import annotations
+
+import collections
+import logging
+import os
+import select
+import selectors
+import threading
+import time
+import typing as t
+
+
+_logger = logging.getLogger(__name__)
+
+# maximum number of reads with timestamps that are remembered
+_MAX_CHUNKS = 4096
+
+
+def supported() -> bool:
+    return hasattr(os, "readv")
+
+
+class OutputBuffer:
+    "Ring buffer of the output of a kernel launch, fed by a reader thread"
+
+    def __init__(self, size: int):
+        self._ring = bytearray(size)
+        self._view = memoryview(self._ring)
+        # bytes read in total
+        self._total = 0
+        # (time, stream, start, end) of each read, start and end counted in total bytes read
+        self._chunks: collections.deque[tuple[float, str, int, int]] = collections.deque(maxlen=_MAX_CHUNKS)
+        self._lock = threading.Lock()
+        self.start_time = time.monotonic()
+        # read end -> (stream name, file descriptor to forward to)
+        self._readers: dict[int, tuple[str, int]] = {}
+        self._writers: dict[str, int] = {}
+        for name, forward in (("stdout", 1), ("stderr", 2)):
+            read_fd, write_fd = os.pipe()
+            self._readers[read_fd] = (name, forward)
+            self._writers[name] = write_fd
+        self._thread = threading.Thread(target=self._run, name="pplk-output", daemon=True)
+
+    @classmethod
+    def start(cls, size: int) -> OutputBuffer:
+        "Create the pipes and start reading them"
+        buffer = cls(size)
+        buffer._thread.start()
+        return buffer
+
+    @property
+    def stdout(self) -> int:
+        "File descriptor for the kernel's stdout"
+        return self._writers["stdout"]
+
+    @property
+    def stderr(self) -> int:
+        "File descriptor for the kernel's stderr"
+        return self._writers["stderr"]
+
+    def close_writers(self):
+        """
+        Close the write ends in this process, after the kernel has been started.
+        The reader thread exits when the kernel's processes have closed them too.
+        """
+        for fd in self._writers.values():
+            os.close(fd)
+        self._writers.clear()
+
+    def _run(self):
+        with selectors.DefaultSelector() as selector:
+            for fd, data in self._readers.items():
+                selector.register(fd, selectors.EVENT_READ, data)
+            while selector.get_map():
+                for key, _events in selector.select():
+                    if not self._read(key.fd, *key.data):
+                        selector.unregister(key.fd)
+                        os.close(key.fd)
+
+    def _read(self, fd: int, name: str, forward: int) -> bool:
+        "Read from the pipe into the ring buffer and forward it, False at end of file"
+        size = len(self._ring)
+        with self._lock:
+            pos = self._total % size
+            try:
+                count = os.readv(fd, [self._view[pos:], self._view[:pos]])
+            except OSError:
+                count = 0
+            if count == 0:
+                return False
+            self._chunks.append((time.monotonic(), name, self._total, self._total + count))
+            self._total += count
+        # only this thread writes to the ring, so the data can be forwarded outside the lock
+        end = pos + count
+        self._forward(forward, self._view[pos:min(end, size)])
+        if end > size:
+            self._forward(forward, self._view[:end - size])
+        return True
+
+    def _forward(self, fd: int, data: memoryview):
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        except OSError as exc:
+            _logger.debug("could not forward kernel output: %s", exc)
+
+    def wait_idle(self, timeout: float = 0.5):
+        "Wait until the output that is already written to the pipes has been read, or for timeout"
+        deadline = time.monotonic() + timeout
+        fds = list(self._readers)
+        while time.monotonic() < deadline:
+            try:
+                readable, _, _ = select.select(fds, [], [], 0)
+            except (OSError, ValueError):
+                # closed by the reader thread
+                return
+            if not readable:
+                break
+            time.sleep(0.01)
+        # wait for a read in progress
+        with self._lock:
+            pass
+
+    def dump(self) -> str:
+        "The buffered output, each line with the seconds since the start and the stream name"
+        with self._lock:
+            size = len(self._ring)
+            total = self._total
+            pos = total % size
+            data = bytes(self._view[pos:]) + bytes(self._view[:pos]) if total >= size else bytes(self._view[:total])
+            chunks = list(self._chunks)
+        oldest = total - len(data)
+        # join reads that are part of the same line
+        parts: list[list[t.Any]] = []
+        for timestamp, name, start, end in chunks:
+            if end <= oldest:
+                continue
+            text = data[max(start, oldest) - oldest:end - oldest].decode("utf-8", errors="replace")
+            if parts and parts[-1][1] == name and not parts[-1][2].endswith("\n"):
+                parts[-1][2] += text
+            else:
+                parts.append([timestamp, name, text])
+        lines = []
+        for timestamp, name, text in parts:
+            for line in text.splitlines():
+                lines.append(f"{timestamp - self.start_time:8.3f} s {name}: {line}")
+        return "\n".join(lines)
@@ -0,0 +1,119 @@
+"""
+Port reservation pool for kernel launches
+
+jupyter-client picks each kernel port by binding to port 0 and closing the
+socket again, so the port is free for anyone until the kernel binds it. When
+many kernels start at once, another process (or an outgoing connection) can
+take the port in the meantime and the kernel fails with "address already in
+use".
+
+The pool hands out ports from a configured range, which should be outside the
+operating system's ephemeral port range so that the OS never assigns them on
+its own. Ports are unique among running kernels, checked to be free before
+they are handed out, and recycled when the kernel is cleaned up.
+"""
+
+from __future__ import annotations
+
+import collections
+import logging
+import socket
+import threading
+import typing as t
+
+from jupyter_client.connect import LocalPortCache
+
+from pyproject_local_kernel import _metrics
+
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_port_range(spec: str) -> tuple[int, int]:
+    "Parse a port range like '50000-50999', raise ValueError if invalid"
+    try:
+        first, last = (int(part) for part in spec.split("-"))
+    except ValueError:
+        raise ValueError(f"Invalid port range {spec!r}, expected a range like '50000-50999'")
+    if not 0 < first <= last < 65536:
+        raise ValueError(f"Invalid port range {spec!r}, expected ports from 1 to 65535 with the first not after the last")
+    return first, last
+
+
+def _is_free(ip: str, port: int) -> bool:
+    family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind((ip, port))
+        except OSError:
+            return False
+    return True
+
+
+class PortPool:
+    "Pool of ports in a range, shared by the kernels of this process"
+
+    def __init__(self, first: int, last: int):
+        self._free: collections.deque[int] = collections.deque(range(first, last + 1))
+        self._in_use: set[int] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def free(self) -> int:
+        return len(self._free)
+
+    def acquire(self, ip: str, count: int) -> list[int]:
+        """
+        Get count ports which are free on ip. When the pool runs out, the rest
+        are picked by jupyter-client's LocalPortCache instead.
+        """
+        ports = []
+        with self._lock:
+            # ports taken by other processes are kept in the pool but moved to the back
+            for _ in range(len(self._free)):
+                if len(ports) == count:
+                    break
+                port = self._free.popleft()
+                if _is_free(ip, port):
+                    ports.append(port)
+                    self._in_use.add(port)
+                else:
+                    self._free.append(port)
+        if len(ports) < count:
+            _metrics.port_pool_exhausted.inc()
+            _logger.warning("Port pool exhausted, allocating %d ports outside the pool", count - len(ports))
+            lpc = LocalPortCache.instance()
+            ports.extend(lpc.find_available_port(ip) for _ in range(count - len(ports)))
+        return ports
+
+    def claim(self, ports: t.Iterable[int]):
+        "Mark ports as in use, for a running kernel that was adopted"
+        with self._lock:
+            for port in ports:
+                if port in self._free:
+                    self._free.remove(port)
+                    self._in_use.add(port)
+
+    def release(self, ports: t.Iterable[int]):
+        "Return ports to the pool"
+        with self._lock:
+            for port in ports:
+                if port in self._in_use:
+                    self._in_use.remove(port)
+                    # reused last, after the other free ports
+                    self._free.append(port)
+                else:
+                    LocalPortCache.instance().return_port(port)
+
+
+_pools: dict[tuple[int, int], PortPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(spec: str) -> PortPool:
+    "The pool for the port range, shared in this process"
+    port_range = parse_port_range(spec)
+    with _pools_lock:
+        if port_range not in _pools:
+            _pools[port_range] = PortPool(*port_range)
+        return _pools[port_range]
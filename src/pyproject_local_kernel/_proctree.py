@@ -0,0 +1,325 @@
+"""
+Inspect the kernel's process tree
+
+The kernel process that jupyter-client starts is often a wrapper like `uv run`,
+the python interpreter is further down in the tree. Uses psutil if it is
+installed, otherwise process tree functions return nothing.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import errno
+import logging
+import os
+import time
+import typing as t
+
+try:
+    import psutil  # pyright: ignore[reportMissingModuleSource]
+except ImportError:
+    psutil = None
+
+
+_logger = logging.getLogger(__name__)
+
+
+def available() -> bool:
+    "True if process tree inspection is supported"
+    return psutil is not None
+
+
+def process_tree(pid: int | None) -> list[t.Any]:
+    "Get the process and all its descendants (as psutil.Process)"
+    if psutil is None or pid is None:
+        return []
+    try:
+        root = psutil.Process(pid)
+        return [root, *root.children(recursive=True)]
+    except psutil.Error:
+        return []
+
+
+@dataclasses.dataclass
+class TreeUsage:
+    "Resource usage summed over a process tree"
+    nprocs: int = 0
+    rss: int = 0
+    cpu_time: float = 0.
+
+    @property
+    def rss_mib(self) -> float:
+        return self.rss / 2**20
+
+
+def tree_usage(procs: t.Iterable[t.Any]) -> TreeUsage:
+    usage = TreeUsage()
+    if psutil is None:
+        return usage
+    for proc in procs:
+        try:
+            with proc.oneshot():
+                rss = proc.memory_info().rss
+                cpu = proc.cpu_times()
+        except psutil.Error:
+            continue
+        usage.nprocs += 1
+        usage.rss += rss
+        usage.cpu_time += cpu.user + cpu.system
+    return usage
+
+
+@dataclasses.dataclass
+class ProcessSample:
+    "Resource usage of one process"
+    pid: int
+    name: str
+    rss: int
+    uss: int | None
+    cpu_percent: float
+    num_threads: int
+    num_fds: int | None
+
+
+@dataclasses.dataclass
+class TreeSample:
+    "Resource usage of a process tree at one point in time"
+    timestamp: float
+    processes: list[ProcessSample]
+
+    @property
+    def rss(self) -> int:
+        return sum(p.rss for p in self.processes)
+
+    @property
+    def uss(self) -> int:
+        return sum(p.uss or 0 for p in self.processes)
+
+    @property
+    def cpu_percent(self) -> float:
+        return sum(p.cpu_percent for p in self.processes)
+
+    @property
+    def num_threads(self) -> int:
+        return sum(p.num_threads for p in self.processes)
+
+    @property
+    def num_fds(self) -> int:
+        return sum(p.num_fds or 0 for p in self.processes)
+
+    def as_dict(self) -> dict[str, t.Any]:
+        return {
+            "timestamp": self.timestamp,
+            "rss": self.rss,
+            "uss": self.uss,
+            "cpu_percent": self.cpu_percent,
+            "num_threads": self.num_threads,
+            "num_fds": self.num_fds,
+            "processes": [dataclasses.asdict(p) for p in self.processes],
+        }
+
+
+class TreeSampler:
+    """
+    Sample resource usage of a process tree
+
+    Process objects are kept between samples, which is needed to measure
+    CPU usage since the previous sample.
+    """
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._procs: dict[int, t.Any] = {}
+
+    def sample(self) -> TreeSample:
+        procs = {}
+        for proc in process_tree(self.pid):
+            known = self._procs.get(proc.pid)
+            procs[proc.pid] = known if known is not None and known.is_running() else proc
+        self._procs = procs
+        samples = []
+        for proc in procs.values():
+            try:
+                samples.append(_sample_process(proc))
+            except psutil.Error:  # pyright: ignore[reportOptionalMemberAccess]
+                pass
+        return TreeSample(time.time(), samples)
+
+
+def _sample_process(proc) -> ProcessSample:
+    with proc.oneshot():
+        try:
+            memory = proc.memory_full_info()
+            uss = getattr(memory, "uss", None)
+        except psutil.AccessDenied:  # pyright: ignore[reportOptionalMemberAccess]
+            memory = proc.memory_info()
+            uss = None
+        if hasattr(proc, "num_fds"):
+            num_fds = proc.num_fds()
+        else:
+            num_fds = proc.num_handles()  # windows
+        return ProcessSample(
+            pid=proc.pid,
+            name=proc.name(),
+            rss=memory.rss,
+            uss=uss,
+            cpu_percent=proc.cpu_percent(),
+            num_threads=proc.num_threads(),
+            num_fds=num_fds,
+        )
+
+
+def find_kernel_process(pid: int | None, marker: str) -> t.Any:
+    """
+    Find the kernel process: the innermost process in the tree that has marker
+    (the connection file) in its command line, below wrappers like `uv run`.
+    Processes forked by the kernel (multiprocessing) have the same command
+    line as their parent and are skipped. Returns psutil.Process or None.
+    """
+    cmdlines = {}
+    for proc in process_tree(pid):
+        try:
+            cmdline = proc.cmdline()
+        except psutil.Error:  # pyright: ignore[reportOptionalMemberAccess]
+            continue
+        if marker in cmdline:
+            cmdlines[proc.pid] = (proc, cmdline)
+    candidates = []
+    for proc, cmdline in cmdlines.values():
+        try:
+            parents = proc.parents()
+        except psutil.Error:  # pyright: ignore[reportOptionalMemberAccess]
+            continue
+        parent = cmdlines.get(parents[0].pid) if parents else None
+        if parent is None or parent[1] != cmdline:
+            candidates.append((len(parents), proc))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda elt: elt[0])[1]
+
+
+def group_descendants(proc) -> list[t.Any]:
+    """
+    Descendants of the process in its process group, like subprocesses and
+    multiprocessing workers of the kernel, which a signal to the group reaches
+    """
+    try:
+        pgid = os.getpgid(proc.pid)
+        children = proc.children(recursive=True)
+    except (OSError, psutil.Error):  # pyright: ignore[reportOptionalMemberAccess]
+        return []
+    result = []
+    for child in children:
+        try:
+            if os.getpgid(child.pid) == pgid:
+                result.append(child)
+        except OSError:
+            pass
+    return result
+
+
+def is_running(proc) -> bool:
+    try:
+        return proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE  # pyright: ignore[reportOptionalMemberAccess]
+    except psutil.Error:  # pyright: ignore[reportOptionalMemberAccess]
+        return False
+
+
+def signal_all(procs: t.Iterable[t.Any], signum: int):
+    "Send signal to all processes, ignoring those that have exited"
+    for proc in procs:
+        try:
+            proc.send_signal(signum)
+        except psutil.Error:  # pyright: ignore[reportOptionalMemberAccess]
+            pass
+
+
+def kill_all(procs: t.Iterable[t.Any]):
+    for proc in procs:
+        try:
+            proc.kill()
+        except psutil.Error:  # pyright: ignore[reportOptionalMemberAccess]
+            pass
+
+
+def wait_all(procs: t.Sequence[t.Any], timeout: float) -> list[t.Any]:
+    "Wait for processes to exit, return the processes still running after timeout"
+    if not procs:
+        return []
+    _gone, alive = psutil.wait_procs(procs, timeout=timeout)  # pyright: ignore[reportOptionalMemberAccess]
+    return [proc for proc in alive if is_running(proc)]
+
+
+def create_time(pid: int | None) -> float | None:
+    "Creation time of the process, which tells it apart from a later process with the same pid"
+    if psutil is None or pid is None:
+        return None
+    try:
+        return psutil.Process(pid).create_time()
+    except psutil.Error:
+        return None
+
+
+class AdoptedProcess:
+    """
+    A running process started by another (earlier) process, with the parts of
+    the subprocess.Popen interface that LocalProvisioner uses. The exit status
+    of a process that is not our child is not known, it is reported as 0.
+    """
+    stdin = stdout = stderr = None
+
+    def __init__(self, proc):
+        self._proc = proc
+        self.pid: int = proc.pid
+        self.returncode: int | None = None
+
+    def poll(self) -> int | None:
+        if self.returncode is None and not is_running(self._proc):
+            try:
+                code = self._proc.wait(timeout=0)
+            except psutil.Error:  # pyright: ignore[reportOptionalMemberAccess]
+                code = None
+            self.returncode = code if isinstance(code, int) else 0
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise psutil.TimeoutExpired(timeout, self.pid)  # pyright: ignore[reportOptionalMemberAccess]
+            time.sleep(0.05)
+        return t.cast(int, self.returncode)
+
+    def send_signal(self, signum: int):
+        self._call("send_signal", signum)
+
+    def terminate(self):
+        self._call("terminate")
+
+    def kill(self):
+        self._call("kill")
+
+    def _call(self, method: str, *args):
+        # errors like Popen's, which LocalProvisioner knows how to handle
+        try:
+            getattr(self._proc, method)(*args)
+        except psutil.NoSuchProcess:  # pyright: ignore[reportOptionalMemberAccess]
+            raise ProcessLookupError(errno.ESRCH, "No such process")
+
+
+def adopt_process(pid: int, started: float | None, marker: str | None) -> AdoptedProcess | None:
+    """
+    Adopt a running kernel process, if it is the same process that was started
+    (same creation time) and the kernel in its tree has marker (the connection
+    file) in its command line. None if it is gone or can't be verified.
+    """
+    if psutil is None or started is None:
+        return None
+    try:
+        proc = psutil.Process(pid)
+        if abs(proc.create_time() - started) > 0.01 or not is_running(proc):
+            return None
+    except psutil.Error:
+        return None
+    if marker is not None and find_kernel_process(pid, marker) is None:
+        return None
+    return AdoptedProcess(proc)
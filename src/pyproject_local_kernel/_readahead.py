@@ -0,0 +1,138 @@
+"""
+Read the kernel's files into the OS page cache ahead of the kernel start
+
+When the environment is on network storage, a cold kernel start is dominated
+by reading thousands of small .py/.pyc/.so files one at a time during the
+imports. The readahead asks the OS to read all of them at once, with many
+files in flight (posix_fadvise WILLNEED, or reading the file where that is not
+available), while the kernel is prepared and started, so that the imports
+find them in memory.
+
+The files are listed in a configured manifest, or learned: after a kernel
+has started in a directory, the project's python lists the files of the
+modules that the kernel start imports, and the list is used for the next
+start in that directory until the project files change.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import glob
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import subprocess
+import typing as t
+
+from pyproject_local_kernel import _envcache
+
+
+_logger = logging.getLogger(__name__)
+
+# parallel reads, to overlap the latency of network storage
+_WORKERS = 16
+
+# prints the files of the modules imported by the kernel start, as JSON
+_SCRIPT_LIST_IMPORTS = """\
+import json, sys
+try:
+    import ipykernel.kernelapp
+except ImportError:
+    pass
+files = set()
+for module in list(sys.modules.values()):
+    for name in ("__file__", "__cached__"):
+        path = getattr(module, name, None)
+        if isinstance(path, str):
+            files.add(path)
+print(json.dumps(sorted(files)))
+"""
+
+
+def read_manifest(path: str | os.PathLike) -> list[str]:
+    "Paths in the manifest, one per line: glob patterns are expanded, # starts a comment"
+    files = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            pattern = os.path.expanduser(line)
+            files.extend(glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern])
+    return files
+
+
+def _learned_file(key: str) -> Path:
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return _envcache.user_cache_dir() / "readahead" / f"{digest}.json"
+
+
+def load_learned(key: str) -> dict[str, t.Any] | None:
+    "The learned manifest for key (like the kernel's directory): files and fingerprints of the project files"
+    try:
+        data = json.loads(_learned_file(key).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("key") != key:
+        return None
+    return data
+
+
+def save_learned(key: str, files: list[str], fingerprints: dict[str, t.Any]):
+    path = _learned_file(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps({"key": key, "files": files, "fingerprints": fingerprints}), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def list_imports(python_cmd: list[str], cwd: str | os.PathLike, env: dict[str, str] | None, timeout: float = 60.) -> list[str]:
+    "Files of the modules imported by the kernel start (blocking); raises OSError or subprocess errors"
+    proc = subprocess.run([*python_cmd, "-c", _SCRIPT_LIST_IMPORTS], cwd=cwd, env=env, timeout=timeout,
+                          check=True, capture_output=True, encoding="utf-8")
+    # the last line, in case a wrapper command prints something
+    files = json.loads(proc.stdout.strip().splitlines()[-1])
+    return [str(Path(cwd, file)) for file in files]
+
+
+def _advise(path: str, buffer: bytearray) -> int:
+    "Start reading the file into the page cache, return its size (0 if it can't be read)"
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        size = os.fstat(fd).st_size
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            with open(fd, "rb", buffering=0, closefd=False) as f:
+                while f.readinto(buffer):
+                    pass
+        return size
+    except OSError:
+        return 0
+    finally:
+        os.close(fd)
+
+
+def readahead(files: t.Iterable[str]) -> tuple[int, int]:
+    "Read ahead the files (blocking), return the number of files and bytes"
+    paths = list(dict.fromkeys(files))
+    if not paths:
+        return 0, 0
+    count = total = 0
+    with concurrent.futures.ThreadPoolExecutor(_WORKERS, thread_name_prefix="pplk-readahead") as executor:
+        # one buffer per chunk of files, for reading where fadvise is not available
+        chunks = [paths[i::_WORKERS] for i in range(_WORKERS)]
+        for sizes in executor.map(_advise_all, chunks):
+            count += sum(1 for size in sizes if size)
+            total += sum(sizes)
+    return count, total
+
+
+def _advise_all(paths: list[str]) -> list[int]:
+    buffer = bytearray(2**16)
+    return [_advise(path, buffer) for path in paths]
@@ -0,0 +1,108 @@
+"""
+Inline script metadata (PEP 723) of notebooks
+
+A notebook outside of any project can declare its dependencies in a
+`# /// script` block, in one of its code cells (like juv does) or in a
+sidecar script with the same name (`analysis.py` for `analysis.ipynb`,
+like a jupytext pair):
+
+    # /// script
+    # requires-python = ">=3.11"
+    # dependencies = ["pandas", "matplotlib"]
+    # ///
+
+The kernel finds its notebook through the JPY_SESSION_NAME variable that
+the Jupyter server sets.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+from pathlib import Path
+import re
+import typing as t
+
+try:
+    import tomllib as tomli  # pyright: ignore[reportMissingImports]
+except ImportError:
+    import tomli as tomli    # pyright: ignore[reportMissingImports]
+
+
+# the reference implementation's regex
+_BLOCK = re.compile(r"(?m)^# /// (?P<type>[a-zA-Z0-9-]+)$\s(?P<content>(^#(| .*)$\s)+)^# ///$")
+
+
+@dataclasses.dataclass
+class ScriptMetadata:
+    dependencies: list[str]
+    requires_python: t.Optional[str]
+    # the notebook or sidecar script it was read from
+    source: Path
+
+
+def parse(text: str, source: Path) -> ScriptMetadata | None:
+    "The script metadata in text, None if there is none; raises ValueError if it is invalid"
+    blocks = [match for match in _BLOCK.finditer(text if text.endswith("\n") else text + "\n")
+              if match.group("type") == "script"]
+    if not blocks:
+        return None
+    if len(blocks) > 1:
+        raise ValueError(f"{source}: multiple `# /// script` blocks")
+    content = "".join(line[2:] if line.startswith("# ") else line[1:]
+                      for line in blocks[0].group("content").splitlines(keepends=True))
+    try:
+        data = tomli.loads(content)
+    except tomli.TOMLDecodeError as exc:
+        raise ValueError(f"{source}: invalid `# /// script` block: {exc}")
+    dependencies = data.get("dependencies", [])
+    requires_python = data.get("requires-python")
+    if not isinstance(dependencies, list) or not all(isinstance(dep, str) for dep in dependencies):
+        raise ValueError(f"{source}: `dependencies` must be a list of strings")
+    if requires_python is not None and not isinstance(requires_python, str):
+        raise ValueError(f"{source}: `requires-python` must be a string")
+    return ScriptMetadata(dependencies, requires_python, source)
+
+
+def _notebook_code(path: Path) -> str:
+    "Source of the code cells, one after the other"
+    with open(path, encoding="utf-8") as f:
+        notebook = json.load(f)
+    sources = []
+    for cell in notebook.get("cells", []):
+        if cell.get("cell_type") == "code":
+            source = cell.get("source", "")
+            source = "".join(source) if isinstance(source, list) else source
+            sources.append(source if source.endswith("\n") else source + "\n")
+    return "".join(sources)
+
+
+def notebook_path(env: t.Mapping[str, str], cwd: Path) -> Path | None:
+    "The kernel's notebook from JPY_SESSION_NAME, None if it is not known"
+    session_name = env.get("JPY_SESSION_NAME")
+    if not session_name:
+        return None
+    # an absolute path, or relative to the server's root, whose notebooks start in their own directory
+    for path in (cwd / session_name, cwd / os.path.basename(session_name)):
+        if path.is_file():
+            return path
+    return None
+
+
+def find(notebook: Path) -> ScriptMetadata | None:
+    """
+    The script metadata of the notebook, or else of its sidecar script.
+    Raises ValueError if it is invalid, OSError if it can't be read.
+    """
+    try:
+        # other notebooks, like jupytext's, are scripts
+        text = _notebook_code(notebook) if notebook.suffix == ".ipynb" else notebook.read_text(encoding="utf-8")
+    except (ValueError, AttributeError) as exc:
+        raise ValueError(f"{notebook}: could not read the notebook: {exc}")
+    if (metadata := parse(text, notebook)) is not None:
+        return metadata
+    sidecar = notebook.with_suffix(".py")
+    if sidecar != notebook and sidecar.is_file():
+        return parse(sidecar.read_text(encoding="utf-8"), sidecar)
+    return None
@@ -0,0 +1,84 @@
+"""
+Jupyter server extension to warm projects before their kernels are started
+
+Enable with `jupyter server extension enable pyproject_local_kernel`.
+
+- `POST /pyproject-local-kernel/warm` with a JSON body `{"path": "dir/notebook.ipynb"}`
+  (a path relative to the server's root directory, like in the contents API,
+  and optionally "kernel_name") warms the project and returns the report.
+- When a notebook is opened, its project is warmed in the background
+  (PyprojectKernelWarmup.warm_on_open).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+import typing as t
+
+from jupyter_server.auth.decorator import authorized
+from jupyter_server.base.handlers import APIHandler
+from jupyter_server.utils import url_path_join
+from tornado import web
+
+from pyproject_local_kernel._warmup import PyprojectKernelWarmup
+
+
+_CONTENTS_EVENT_SCHEMA = "https://events.jupyter.org/jupyter_server/contents_service/v1"
+
+
+def _directory(root_dir: str, path: str) -> Path:
+    "Directory of the kernel for an API path, raise ValueError if it is outside of root_dir"
+    parts = [part for part in path.split("/") if part]
+    if ".." in parts:
+        raise ValueError(f"Invalid path {path!r}")
+    directory = Path(root_dir, *parts)
+    return directory if directory.is_dir() else directory.parent
+
+
+class WarmHandler(APIHandler):
+    auth_resource = "kernels"
+
+    def initialize(self, warmup: PyprojectKernelWarmup):
+        self.warmup = warmup
+
+    @web.authenticated
+    @authorized
+    async def post(self):
+        body = self.get_json_body() or {}
+        try:
+            directory = _directory(self.contents_manager.root_dir, body.get("path", ""))
+        except ValueError as exc:
+            raise web.HTTPError(400, str(exc))
+        report = await self.warmup.warm(directory, body.get("kernel_name"))
+        self.finish(json.dumps(report))
+
+
+def _warm_on_open(warmup: PyprojectKernelWarmup, root_dir: str) -> t.Callable[..., t.Awaitable[None]]:
+    "Listener for contents events, which warms the project of notebooks that are opened"
+    async def listener(logger: t.Any, schema_id: str, data: dict[str, t.Any]):
+        path = data.get("path") or ""
+        if data.get("action") != "get" or not path.endswith(".ipynb"):
+            return
+        try:
+            directory = _directory(root_dir, path)
+        except ValueError:
+            return
+        # not awaited, so that opening the notebook does not wait
+        asyncio.ensure_future(warmup.warm(directory))
+    return listener
+
+
+def _load_jupyter_server_extension(serverapp: t.Any):
+    warmup = PyprojectKernelWarmup(parent=serverapp, kernel_spec_manager=serverapp.kernel_spec_manager)
+    web_app = serverapp.web_app
+    route = url_path_join(web_app.settings["base_url"], "pyproject-local-kernel", "warm")
+    web_app.add_handlers(".*$", [(route, WarmHandler, {"warmup": warmup})])
+    root_dir = getattr(serverapp.contents_manager, "root_dir", None)
+    if warmup.warm_on_open and root_dir is not None:
+        if hasattr(serverapp, "event_logger"):
+            serverapp.event_logger.add_listener(schema_id=_CONTENTS_EVENT_SCHEMA, listener=_warm_on_open(warmup, root_dir))
+        else:
+            serverapp.log.info("pyproject-local-kernel: warming notebooks on open requires jupyter-server 2")
+    serverapp.log.info("pyproject-local-kernel: warm-up extension loaded at %s", route)
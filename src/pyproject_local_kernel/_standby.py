@@ -0,0 +1,124 @@
+"""
+Standby kernels, started in the background to replace a running kernel
+
+When the project's files change, a standby process is started with the updated
+environment (including the project manager's sync, like for `uv run`). It
+imports ipykernel and then waits. On the next restart of the kernel it is told
+to start the kernel, so that the restart does not wait for the project manager
+and the imports.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+import signal
+import subprocess
+import tempfile
+import time
+import typing as t
+
+if t.TYPE_CHECKING:
+    from pyproject_local_kernel._identify import ProjectDetection
+
+
+_logger = logging.getLogger(__name__)
+
+# argv: ready file, then the kernel arguments (which are only used when the kernel is started)
+_SCRIPT_STANDBY = """\
+import importlib.util, json, os, runpy, sys
+ready_file = sys.argv[1]
+module = sys.argv[3] if sys.argv[2:3] == ["-m"] else None
+try:
+    # the slow part of the kernel start
+    if module == "ipykernel_launcher":
+        import ipykernel.kernelapp
+    elif module is None or importlib.util.find_spec(module) is None:
+        raise ImportError(f"can not run {sys.argv[2:]}")
+    status = "ready"
+except ImportError as exc:
+    status = f"error: {exc}"
+with open(ready_file + ".tmp", "w") as f:
+    f.write(status)
+os.replace(ready_file + ".tmp", ready_file)
+if status != "ready":
+    raise SystemExit(1)
+line = sys.stdin.readline()
+if not line:
+    raise SystemExit(0)
+args = json.loads(line)
+sys.argv = [args[1], *args[2:]]
+runpy.run_module(args[1], run_name="__main__", alter_sys=True)
+"""
+
+
+def supported(kernel_args: t.Sequence[str]) -> bool:
+    "True if the kernel command can be started from a standby process"
+    return os.name == "posix" and len(kernel_args) >= 2 and kernel_args[0] == "-m"
+
+
+class StandbyKernel:
+    "A process waiting to become the kernel"
+
+    def __init__(self, process: subprocess.Popen, python_cmd: list[str], project: ProjectDetection,
+                 fingerprints: dict[str, t.Any]):
+        self.process = process
+        self.python_cmd = python_cmd
+        self.project = project
+        # fingerprints of the project files when the standby was started
+        self.fingerprints = fingerprints
+
+    @classmethod
+    def start(cls, python_cmd: list[str], kernel_args: list[str], cwd: str | os.PathLike, env: dict[str, str],
+              project: ProjectDetection, fingerprints: dict[str, t.Any], timeout: float) -> StandbyKernel:
+        """
+        Start the standby process and wait until it is ready (blocking).
+        Raises RuntimeError if it fails.
+        """
+        with tempfile.TemporaryDirectory(prefix="pplk-standby-") as tmp_dir:
+            ready_file = Path(tmp_dir) / "ready"
+            # like jupyter-client's kernel launcher
+            env = {**env, "JPY_PARENT_PID": str(os.getpid())}
+            try:
+                process = subprocess.Popen([*python_cmd, "-c", _SCRIPT_STANDBY, str(ready_file), *kernel_args],
+                                           stdin=subprocess.PIPE, cwd=cwd, env=env, start_new_session=True)
+            except OSError as exc:
+                raise RuntimeError(f"Could not start standby kernel: {exc}")
+            standby = cls(process, python_cmd, project, fingerprints)
+            deadline = time.monotonic() + timeout
+            while not ready_file.exists():
+                if process.poll() is not None or time.monotonic() > deadline:
+                    standby.discard()
+                    raise RuntimeError(f"Standby kernel did not start (exit status {process.returncode})")
+                time.sleep(0.05)
+            status = ready_file.read_text()
+        if status != "ready":
+            standby.discard()
+            raise RuntimeError(f"Standby kernel failed: {status}")
+        return standby
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def activate(self, kernel_args: list[str]) -> subprocess.Popen:
+        "Start the kernel, return the kernel process"
+        stdin = t.cast(t.IO[bytes], self.process.stdin)
+        stdin.write(json.dumps(kernel_args).encode("utf-8") + b"\n")
+        stdin.close()
+        return self.process
+
+    def discard(self, timeout: float = 1.):
+        "Stop the standby process (blocking)"
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+            except OSError:
+                pass
+        if self.process.stdin is not None:
+            self.process.stdin.close()
@@ -0,0 +1,104 @@
+"""
+Run launch steps as a dependency graph
+
+Each step starts as soon as the steps it depends on are done, so independent
+steps overlap. Blocking steps run in the default executor. The graph records
+when each step ran and finds the critical path, the chain of steps that
+determined the total duration.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import inspect
+import time
+import typing as t
+
+
+@dataclasses.dataclass
+class Step:
+    name: str
+    # called without arguments, may return an awaitable
+    func: t.Callable[[], t.Any]
+    deps: tuple[str, ...] = ()
+    blocking: bool = False
+    start: float = 0.
+    end: float = 0.
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class TaskGraph:
+    "Steps and the steps they depend on"
+
+    def __init__(self):
+        self.steps: dict[str, Step] = {}
+        self._results: dict[str, t.Any] = {}
+
+    def add(self, name: str, func: t.Callable[[], t.Any], deps: t.Sequence[str] = (), blocking: bool = False):
+        "Add a step, after the steps it depends on"
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError(f"Unknown step {dep!r}")
+        self.steps[name] = Step(name, func, tuple(deps), blocking)
+
+    def result(self, name: str) -> t.Any:
+        "Result of a step that is done"
+        return self._results[name]
+
+    async def run(self, target: str) -> t.Any:
+        """
+        Run target and the steps it depends on, return its result.
+        If a step raises, the exception is raised after the other running steps are done.
+        """
+        tasks: dict[str, asyncio.Future] = {}
+
+        def schedule(name: str) -> asyncio.Future:
+            if name not in tasks:
+                step = self.steps[name]
+                deps = [schedule(dep) for dep in step.deps]
+                tasks[name] = asyncio.ensure_future(self._run_step(step, deps))
+            return tasks[name]
+
+        schedule(target)
+        try:
+            return await tasks[target]
+        finally:
+            # don't leave steps running in the background
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def _run_step(self, step: Step, deps: list[asyncio.Future]) -> t.Any:
+        await asyncio.gather(*deps)
+        step.start = time.perf_counter()
+        try:
+            if step.blocking:
+                result = await asyncio.get_event_loop().run_in_executor(None, step.func)
+            else:
+                result = step.func()
+            if inspect.isawaitable(result):
+                result = await result
+        finally:
+            step.end = time.perf_counter()
+        self._results[step.name] = result
+        return result
+
+    def critical_path(self, target: str) -> list[Step]:
+        "The chain of steps that ended last, from the first step to target"
+        path = [self.steps[target]]
+        while path[-1].deps:
+            path.append(max((self.steps[dep] for dep in path[-1].deps), key=lambda step: step.end))
+        return path[::-1]
+
+    def format_critical_path(self, target: str) -> str:
+        "Critical path and the steps that overlapped with it, with durations"
+        path = self.critical_path(target)
+        on_path = {step.name for step in path}
+        text = " > ".join(f"{step.name} {step.duration:.3f} s" for step in path)
+        text += f" (total {path[-1].end - path[0].start:.3f} s)"
+        overlapped = [step for step in self.steps.values() if step.name not in on_path and step.end]
+        if overlapped:
+            text += ", overlapped: " + ", ".join(f"{step.name} {step.duration:.3f} s" for step in overlapped)
+        return text
@@ -0,0 +1,219 @@
+"""
+Read selected tables of a large TOML file without parsing all of it
+
+pyproject.toml files can be large because of tool tables (linters, type
+checkers, code generators) that are irrelevant here, and tomllib is pure
+python. The scan finds the table headers with a minimal lexer that only
+follows strings, comments and brackets, and parses only the root table and
+the selected tables (and their parent tables, which can define them with
+dotted keys). When the scan is not certain about the file's structure, the
+whole file is parsed instead.
+
+Note that errors in the tables that are not parsed are not detected.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import typing as t
+
+try:
+    import tomllib as tomli  # pyright: ignore[reportMissingImports]
+except ImportError:
+    import tomli as tomli    # pyright: ignore[reportMissingImports]
+
+
+_logger = logging.getLogger(__name__)
+
+# smaller files are parsed in full, which is as fast as the scan
+MIN_SCAN_SIZE = 16 * 1024
+
+_BARE_KEY = r"[A-Za-z0-9_-]+"
+_QUOTED_KEY = r'"(?:[^"\\\n]|\\.)*"|' + r"'[^'\n]*'"
+_KEY_PART = re.compile(r"\s*(" + _BARE_KEY + "|" + _QUOTED_KEY + r")\s*")
+_HEADER = re.compile(r"\s*(\[\[?)([^\]\[]*)(\]\]?)\s*(?:#.*)?$")
+_LINE_START_BRACKET = re.compile(r"^[ \t]*\[", re.MULTILINE)
+_STRING_OR_COMMENT = r'"(?:[^"\\\n]|\\.)*"|' + r"'[^'\n]*'|#.*"
+_STRINGS_AND_COMMENTS = re.compile(_STRING_OR_COMMENT)
+_TOKEN = re.compile(r'"""|' + r"'''|" + _STRING_OR_COMMENT + r"|[\[\]{}]|[\"']")
+
+
+class Ambiguous(Exception):
+    "The scan can not tell the structure of the file"
+
+
+def _header_key(text: str) -> tuple[str, ...]:
+    "Key of a table header like `tool . \"my-tool\"`, raises Ambiguous if invalid"
+    parts = []
+    for part in text.split(".") if '"' not in text and "'" not in text else _split_quoted(text):
+        match = _KEY_PART.fullmatch(part)
+        if match is None:
+            raise Ambiguous(f"table header [{text}]")
+        key = match.group(1)
+        if key[0] == "'":
+            key = key[1:-1]
+        elif key[0] == '"':
+            if "\\" in key:
+                # unusual, leave escapes to the parser
+                raise Ambiguous(f"table header [{text}]")
+            key = key[1:-1]
+        parts.append(key)
+    return tuple(parts)
+
+
+def _split_quoted(text: str) -> list[str]:
+    "Split at dots outside quoted keys"
+    parts = []
+    start = 0
+    for match in re.finditer(r"(" + _QUOTED_KEY + r")|\.", text):
+        if match.group(1) is None:
+            parts.append(text[start:match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+def scan(text: str) -> list[tuple[tuple[str, ...] | None, int]]:
+    """
+    Find the tables of a TOML document, in order. Returns (key, offset) of
+    each table, where the root table has key None.
+    Raises Ambiguous if the structure of the document is not certain.
+    """
+    tables: list[tuple[tuple[str, ...] | None, int]] = [(None, 0)]
+    state = _LexState()
+    pos = 0
+    # lines starting with [ are headers, unless they are in an array or string
+    for candidate in _LINE_START_BRACKET.finditer(text):
+        start = candidate.start()
+        state.skip(text, pos, start)
+        pos = start
+        if state.depth == 0 and state.in_string is None:
+            line_end = text.find("\n", start) + 1 or len(text)
+            match = _HEADER.match(text, start, line_end)
+            if match is None or len(match.group(1)) != len(match.group(3)):
+                raise Ambiguous(f"line {text[start:line_end].strip()!r}")
+            tables.append((_header_key(match.group(2)), start))
+            pos = line_end
+    state.skip(text, pos, len(text))
+    if state.in_string is not None or state.depth != 0:
+        raise Ambiguous("unterminated string or array at end of file")
+    return tables
+
+
+class _LexState:
+    "Follows strings and brackets through the document"
+    def __init__(self):
+        # nesting of arrays and inline tables
+        self.depth = 0
+        # delimiter of the multi-line string we're in, if any
+        self.in_string: str | None = None
+
+    def skip(self, text: str, start: int, end: int):
+        "Lex text[start:end], which ends at the start of a line"
+        pos = start
+        while pos < end:
+            if self.in_string is None:
+                # fast path up to the next line with a multi-line string:
+                # count the brackets outside of strings and comments
+                quotes = min((index for index in (text.find('"""', pos, end), text.find("'''", pos, end))
+                              if index >= 0), default=end)
+                line_start = text.rfind("\n", pos, quotes) + 1 or pos
+                rest = _STRINGS_AND_COMMENTS.sub("", text[pos:line_start])
+                if '"' in rest or "'" in rest:
+                    raise Ambiguous("unterminated string")
+                self._count_brackets(rest)
+                pos = line_start
+                if pos >= end:
+                    break
+            line_end = text.find("\n", pos, end) + 1 or end
+            self._lex_line(text[pos:line_end])
+            pos = line_end
+
+    def _count_brackets(self, text: str):
+        self.depth += text.count("[") + text.count("{") - text.count("]") - text.count("}")
+        if self.depth < 0:
+            raise Ambiguous("unbalanced brackets")
+
+    def _lex_line(self, line: str):
+        pos = 0
+        if self.in_string is not None:
+            pos = _string_end(line, 0, self.in_string)
+            if pos < 0:
+                return
+            self.in_string = None
+        while (token := _TOKEN.search(line, pos)) is not None:
+            value = token.group()
+            pos = token.end()
+            if value in ('"""', "'''"):
+                pos = _string_end(line, pos, value)
+                if pos < 0:
+                    self.in_string = value
+                    return
+            elif value in ('"', "'"):
+                raise Ambiguous(f"unterminated string in {line.strip()!r}")
+            elif value[0] != "#" and value[0] not in "\"'":
+                self._count_brackets(value)
+
+
+def _string_end(line: str, pos: int, delimiter: str) -> int:
+    "Position after the end of the multi-line string, which continues at pos; -1 if it does not end on this line"
+    end = line.find(delimiter, pos)
+    while end >= 0 and delimiter == '"""' and _escaped(line, end):
+        end = line.find(delimiter, end + 1)
+    if end < 0:
+        return -1
+    # a string may end with up to two more quotes, like """a"""""
+    end += 3
+    for _ in range(2):
+        if line.startswith(delimiter[0], end):
+            end += 1
+    return end
+
+
+def _escaped(line: str, pos: int) -> bool:
+    "True if the character at pos is escaped by a backslash"
+    count = 0
+    while pos > 0 and line[pos - 1] == "\\":
+        count += 1
+        pos -= 1
+    return count % 2 == 1
+
+
+def _selected(key: tuple[str, ...] | None, tables: t.Sequence[tuple[str, ...]]) -> bool:
+    "True for the root table, the selected tables, their subtables and parent tables"
+    if key is None:
+        return True
+    return any(key[:len(table)] == table or table[:len(key)] == key for table in tables)
+
+
+def loads(text: str, tables: t.Sequence[str]) -> dict[str, t.Any]:
+    """
+    Parse the tables (dotted keys like "tool.uv") of the TOML document. The
+    result has at least these tables, and may have others.
+    Raises tomllib.TOMLDecodeError like tomllib.loads.
+    """
+    if len(text) < MIN_SCAN_SIZE:
+        return tomli.loads(text)
+    selected = [tuple(table.split(".")) for table in tables]
+    try:
+        found = scan(text)
+    except Ambiguous as exc:
+        _logger.debug("Parsing all of the file, scan was ambiguous: %s", exc)
+        return tomli.loads(text)
+    ends = [offset for _key, offset in found[1:]] + [len(text)]
+    parts = [text[offset:end] for (key, offset), end in zip(found, ends) if _selected(key, selected)]
+    try:
+        return tomli.loads("".join(parts))
+    except tomli.TOMLDecodeError:
+        # report errors for the whole file
+        return tomli.loads(text)
+
+
+def load(path: str | os.PathLike, tables: t.Sequence[str]) -> dict[str, t.Any]:
+    "Like loads, for a file"
+    with open(path, "rb") as f:
+        data = f.read()
+    # like tomllib.load
+    return loads(data.decode(), tables)
@@ -0,0 +1,128 @@
+"""
+Warm a project's environment before a kernel is started
+
+Runs the provisioner's pre-launch for a directory (identify and resolve the
+project, sanity check) and then the project's python command with an import
+of ipykernel, which syncs the environment for project managers like uv and
+writes and caches the bytecode of the kernel's imports. The next kernel start
+in the project then finds everything ready.
+
+Warm-ups are deduplicated per project: concurrent requests share one warm-up,
+and a project is not warmed again within min_interval unless its files changed.
+Used by the server extension (_serverext).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from pathlib import Path
+import subprocess
+import time
+import typing as t
+import uuid
+
+from traitlets import Any, Bool, Float, Int, Unicode
+from traitlets.config import LoggingConfigurable
+
+from pyproject_local_kernel import _kernelspec
+from pyproject_local_kernel._identify import KERNEL_SPEC_NAME, find_pyproject_file_from
+
+
+# imports like the kernel start; ipykernel can be missing when it is added at launch (ipykernel overlay)
+_SCRIPT_WARM = """\
+try:
+    import ipykernel.kernelapp
+except ImportError:
+    pass
+"""
+
+
+class PyprojectKernelWarmup(LoggingConfigurable):
+    "Warm-up of project environments, shared by the server extension's endpoint and notebook open hook"
+
+    kernel_name = Unicode(default_value=KERNEL_SPEC_NAME, help="Kernelspec whose provisioner settings are used").tag(config=True)
+    warm_on_open = Bool(default_value=True, help="Warm the project of a notebook when it is opened").tag(config=True)
+    min_interval = Float(default_value=300., help="Seconds before the same project is warmed again, "
+                         "unless its files changed").tag(config=True)
+    max_concurrent = Int(default_value=2, help="Number of projects that are warmed at the same time").tag(config=True)
+    timeout = Float(default_value=300., help="Seconds to wait for the project manager's sync and the imports").tag(config=True)
+
+    kernel_spec_manager = Any(default_value=None, allow_none=True, help="The server's kernelspec manager")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # warm-ups in progress, by project
+        self._tasks: dict[str, asyncio.Future] = {}
+        # finished warm-ups: time, fingerprints of the project files before the warm-up and the report
+        self._warmed: dict[str, tuple[float, dict[str, t.Any], dict[str, t.Any]]] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def warm(self, directory: Path, kernel_name: str | None = None) -> dict[str, t.Any]:
+        "Warm the project for a kernel started in directory, return a report"
+        directory = directory.absolute()
+        pyproject = find_pyproject_file_from(directory)
+        # kernels without a project share the scratch environment
+        key = str(pyproject) if pyproject is not None else ""
+        if (warmed := self._warmed.get(key)) is not None:
+            warmed_time, fingerprints, report = warmed
+            if time.monotonic() - warmed_time < self.min_interval and _kernelspec.changed_file(fingerprints) is None:
+                return {**report, "cached": True}
+        if (task := self._tasks.get(key)) is None:
+            fingerprints = _kernelspec.fingerprints(pyproject.parent) if pyproject is not None else {}
+            task = asyncio.ensure_future(self._warm(key, directory, kernel_name or self.kernel_name, fingerprints))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # a cancelled request does not cancel the warm-up for the others
+        return await asyncio.shield(task)
+
+    async def _warm(self, key: str, directory: Path, kernel_name: str, fingerprints: dict[str, t.Any]) -> dict[str, t.Any]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.max_concurrent))
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            report = await loop.run_in_executor(None, self._warm_blocking, directory, kernel_name)
+        now = time.monotonic()
+        # only warm-ups within min_interval are used, the others are forgotten
+        for stale in [key for key, (warmed_time, _, _) in self._warmed.items() if now - warmed_time >= self.min_interval]:
+            del self._warmed[stale]
+        self._warmed[key] = (now, fingerprints, report)
+        if report["ok"]:
+            self.log.info("pyproject-local-kernel: warmed %s in %.1f s", key or directory, report["seconds"])
+        else:
+            self.log.info("pyproject-local-kernel: could not warm %s: %s", key or directory, report["error"])
+        return report
+
+    def _warm_blocking(self, directory: Path, kernel_name: str) -> dict[str, t.Any]:
+        from jupyter_client.manager import KernelManager
+        from jupyter_client.provisioning import KernelProvisionerFactory as KPF  # type: ignore
+        from pyproject_local_kernel.provisioner import PyprojectKernelProvisioner
+
+        start = time.perf_counter()
+        report: dict[str, t.Any] = {"directory": str(directory), "kernelspec": kernel_name, "ok": False, "cached": False}
+        # configured like the server's kernels
+        km_kwargs = {"kernel_spec_manager": self.kernel_spec_manager} if self.kernel_spec_manager is not None else {}
+        km = KernelManager(kernel_name=kernel_name, parent=self, **km_kwargs)
+        prov = KPF.instance().create_provisioner_instance(str(uuid.uuid4()), km.kernel_spec, parent=km)
+        if not isinstance(prov, PyprojectKernelProvisioner):
+            report["error"] = f"Kernelspec {kernel_name!r} does not use the pyproject-local-kernel provisioner"
+            return report
+        try:
+            kwargs = prov._pplk_pre_launch(cwd=str(directory), env=os.environ.copy())
+            project = prov._pplk_project
+            report["project"] = None if project is None else {
+                "kind": project.kind.name,
+                "pyproject": str(project.path) if project.path else None,
+            }
+            proc = subprocess.run([*prov._pplk_python_cmd, "-c", _SCRIPT_WARM], cwd=directory, env=kwargs.get("env"),
+                                  timeout=self.timeout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                  encoding="utf-8", errors="replace")
+            prov._pplk_timer.lap("warm-import")
+            if proc.returncode != 0:
+                raise RuntimeError(f"{prov._pplk_python_cmd[0]} exited with status {proc.returncode}: {proc.stderr.strip()}")
+            report["ok"] = True
+        except (OSError, RuntimeError, subprocess.SubprocessError) as exc:
+            report["error"] = str(exc)
+        report["phases"] = prov.launch_timings()
+        report["seconds"] = time.perf_counter() - start
+        return report
@@ -26,15 +26,15 @@ import os
 from pathlib import Path
 import signal
 import sys
+import typing as t
 import uuid
 
-from jupyter_client import KernelProvisionerBase  # type: ignore
-from jupyter_client.provisioning import KernelProvisionerFactory as KPF  # type: ignore
-import jupyter_client.kernelspec
-
 from pyproject_local_kernel._identify import KERNEL_SPECS, MY_TOOL_NAME, ENABLE_DEBUG_ENV
 from pyproject_local_kernel._identify import ProjectKind, find_pyproject_file_from, identify
 
+if t.TYPE_CHECKING:
+    from jupyter_client import KernelProvisionerBase  # type: ignore
+
 
 _logger = logging.getLogger(__name__)
 
@@ -88,12 +88,20 @@ async def _async_kernel_loop(prov: KernelProvisionerBase, args: argparse.Namespa
 def main() -> int:
     _setup_logging()
     _logger.debug("Started with argv=%s", sys.argv)
+    if sys.argv[1:2] == ["kernelspec"]:
+        from pyproject_local_kernel import _kernelspec
+        return _kernelspec.main(sys.argv[2:])
+    if sys.argv[1:2] == ["doctor"]:
+        from pyproject_local_kernel import _doctor
+        return _doctor.main(sys.argv[2:])
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", type=str, dest="connection_file")
     parser.add_argument("--use-venv", action="store_true", help=argparse.SUPPRESS)
     parser.add_argument("--test-interrupt", action="store_true", help=argparse.SUPPRESS)
     parser.add_argument("--test-quit", action="store_true", help=argparse.SUPPRESS)
     parser.add_argument("--fallback-kernel", default=None, type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--fallback-kind", default=None, type=str, help=argparse.SUPPRESS)
 
     args, extra_args = parser.parse_known_args()
     _logger.debug("args=%r rest=%r", args, extra_args)
@@ -104,6 +112,10 @@ def main() -> int:
     _logger.warning("Unsupported: direct launch of %s - but will attempt to work with this", MY_TOOL_NAME)
     _logger.warning("Must use jupyter-client to launch kernel with kernel provisioning")
 
+    # imported here so that the fallback kernel starts faster
+    from jupyter_client.provisioning import KernelProvisionerFactory as KPF  # type: ignore
+    import jupyter_client.kernelspec
+
     spec_name = KERNEL_SPECS[1] if args.use_venv else KERNEL_SPECS[0]
     try:
         kernel_spec = jupyter_client.kernelspec.get_kernel_spec(spec_name)
@@ -128,14 +140,18 @@ def _start_fallback_kernel(args: argparse.Namespace, failure_to_start_msg: str):
     Start a fallback kernel - for the purpose having a good interface for the user
     to fix their environment.
     """
-    pyproject_file = find_pyproject_file_from(Path.cwd())
-
-    try:
-        project = identify(pyproject_file)
-    except Exception:
-        project = None
-
-    project_kind = project and project.kind
+    project_kind: ProjectKind | None
+    if args.fallback_kind in ProjectKind.__members__:
+        # the provisioner already identified the project
+        project_kind = ProjectKind[args.fallback_kind]
+        has_pyproject_file = project_kind != ProjectKind.NoProject
+    else:
+        pyproject_file = find_pyproject_file_from(Path.cwd())
+        has_pyproject_file = pyproject_file is not None
+        try:
+            project_kind = identify(pyproject_file).kind
+        except Exception:
+            project_kind = None
 
     help_messages = []
 
@@ -155,7 +171,7 @@ def _start_fallback_kernel(args: argparse.Namespace, failure_to_start_msg: str):
         "in that case, set up your project separately.",
     ]
 
-    if pyproject_file is None:
+    if not has_pyproject_file:
         help_messages += init_messages
 
     if project_kind is not None:
@@ -192,28 +208,9 @@ def _start_fallback_kernel(args: argparse.Namespace, failure_to_start_msg: str):
     for msg in help_messages:
         _logger.info(msg)
 
-    try:
-        import ipykernel.ipkernel
-        from ipykernel.kernelapp import IPKernelApp
-    except ImportError:
-        _logger.error("Fallback kernel requires `ipykernel` to be installed")
+    if not args.connection_file:
+        _logger.error("Fallback kernel requires a connection file")
         return 1
 
-    class FallbackMessageKernel(ipykernel.ipkernel.IPythonKernel):
-        def do_execute(self, *args, **kwargs):
-            for msg in help_messages:
-                print(msg, file=sys.stderr)
-            return super().do_execute(*args, **kwargs)
-
-    argv = _ipykernel_argv(args)
-    _logger.debug("IPKernelApp launch argv=%r", argv)
-
-    IPKernelApp.launch_instance(argv, kernel_class=FallbackMessageKernel)
-    return 0
-
-
-def _ipykernel_argv(args: argparse.Namespace) -> list[str]:
-    argv = []
-    if args.connection_file:
-        argv += ["-f", args.connection_file]
-    return argv
+    from pyproject_local_kernel import _fallback_kernel
+    return _fallback_kernel.run(args.connection_file, help_messages)
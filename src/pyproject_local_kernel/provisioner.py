@@ -1,21 +1,29 @@
 from __future__ import annotations
 
+import asyncio
+import dataclasses
+import inspect
 import logging
 from pathlib import Path
 import os
+import signal
 import subprocess
 import sys
 import time
 import typing as t
+import weakref
 
 
 from jupyter_client import KernelConnectionInfo
+from jupyter_client.connect import LocalPortCache
 from jupyter_client.kernelspec import KernelSpec
 from jupyter_client.provisioning.local_provisioner import LocalProvisioner
-from traitlets import Bool, List, Unicode
+from traitlets import Bool, Dict, Float, Int, List, TraitError, Unicode, Union, validate
 
-from pyproject_local_kernel._identify import ProjectDetection, ProjectKind, identify, MY_TOOL_NAME, ENABLE_DEBUG_ENV
+from pyproject_local_kernel._identify import ProjectDetection, ProjectKind, PythonEnvironment, find_pyproject_file_from, identify_file
+from pyproject_local_kernel._identify import MY_TOOL_NAME, ENABLE_DEBUG_ENV, IMPORT_PROFILE_ENV
 from pyproject_local_kernel._configdata import Config
+from pyproject_local_kernel import _discovery, _envcache, _importtime, _kernelspec, _metrics, _outputbuffer, _ports, _proctree, _readahead, _scriptmeta, _standby, _taskgraph
 
 
 _SCRIPT_CHECK_HAS_KERNEL = """import importlib.util; raise SystemExit(not importlib.util.find_spec("ipykernel"))"""
@@ -24,6 +32,14 @@ _MESSAGE_SANITY = """Sanity check: Could not find `ipykernel` in environment"""
 _MESSAGE_SANITY_NO_IPYKERNEL = _MESSAGE_SANITY + """
 Add `ipykernel` as a dependency in your project and update the virtual environment."""
 
+# key of the launch state in the provisioner info
+_PROVISIONER_INFO_KEY = "pyproject_local_kernel"
+# seconds to wait for the heartbeat of a kernel that is adopted
+_ADOPT_HEARTBEAT_TIMEOUT = 5.
+# seconds between checks for changes of the project files, for standby kernels
+_STANDBY_POLL_INTERVAL = 2.
+# seconds after the kernel start before the files for readahead are listed, so that it doesn't compete with the kernel
+_READAHEAD_LEARN_DELAY = 10.
 
 
 class PyprojectKernelProvisioner(LocalProvisioner):
@@ -33,9 +49,142 @@ class PyprojectKernelProvisioner(LocalProvisioner):
     sanity_check = Bool(default_value=True, help="Enable sanity check for 'ipykernel' package in environment").tag(config=True)
     python_kernel_args = List[str](allow_none=False, help="Arguments for kernel process")
     is_use_venv_kernel = Bool(default_value=False, allow_none=False, help="This is the use-venv kernelspec")
+    compiled_project = Dict(default_value=None, allow_none=True,
+                            help="Project resolved in advance, written by `pyproject_local_kernel kernelspec install`")
+    thread_budget = Union([Int(), Bool()], default_value=False,
+                          help="Number of threads for OpenMP/BLAS in each kernel. True: share the CPUs between running kernels, "
+                               "False: disabled").tag(config=True)
+    idle_timeout = Float(default_value=0., help="Minutes without activity before an idle kernel is culled, 0: disabled").tag(config=True)
+    idle_action = Unicode(default_value="shutdown",
+                          help="What to do with an idle kernel: 'shutdown' or the name of a signal to send, like 'SIGUSR1'").tag(config=True)
+    idle_cpu_percent = Float(default_value=1., help="CPU usage (percent) below which the kernel is idle").tag(config=True)
+
+    telemetry_interval = Float(default_value=0., help="Seconds between resource usage samples of the kernel's process tree, "
+                               "0: disabled. Requires psutil.").tag(config=True)
+
+    metrics_file = Unicode(default_value=None, allow_none=True,
+                           help="Write launch metrics in Prometheus text format to this file, for example "
+                                "in node_exporter's textfile collector directory").tag(config=True)
+    metrics_interval = Float(default_value=15., help="Seconds between updates of the metrics file").tag(config=True)
+
+    shutdown_deadline = Float(default_value=1., help="Seconds to wait for the kernel's processes to exit after SIGTERM, "
+                              "before they are killed").tag(config=True)
+
+    port_range = Unicode(default_value=None, allow_none=True,
+                         help="Allocate kernel ports from this range, like '50000-50999', shared between kernels without "
+                              "collisions. Should be outside the OS's ephemeral port range. None: ports picked by jupyter-client"
+                         ).tag(config=True)
+
+    @validate("port_range")
+    def _validate_port_range(self, proposal):
+        # fail with the configuration, instead of starting the fallback kernel on every launch
+        if proposal["value"] is not None:
+            try:
+                _ports.parse_port_range(proposal["value"])
+            except ValueError as exc:
+                raise TraitError(f"PyprojectKernelProvisioner.port_range: {exc}") from exc
+        return proposal["value"]
+
+    ipykernel_overlay = Bool(default_value=False,
+                             help="For uv projects, use a cached ipykernel installation when the project does not have ipykernel, "
+                                  "instead of `uv run --with ipykernel`").tag(config=True)
+    standby_kernel = Bool(default_value=False,
+                          help="When the project's files change, start a replacement kernel in the background which "
+                               "is used on the next restart").tag(config=True)
+    standby_timeout = Float(default_value=300., help="Seconds to wait for a standby kernel to start, including "
+                            "the project manager's sync").tag(config=True)
+    scratch_env = Bool(default_value=False,
+                       help="Start kernels outside of any project in a shared, cached environment with scratch_packages, "
+                            "instead of the fallback kernel. Requires uv.").tag(config=True)
+    scratch_packages = List(Unicode(), default_value=["ipykernel"],
+                            help="Packages (requirement specifiers) in the scratch environment").tag(config=True)
+    scratch_python = Unicode(default_value=None, allow_none=True,
+                             help="Python interpreter for the scratch environment (path or name on PATH). "
+                                  "None: the Jupyter server's python").tag(config=True)
+    script_metadata = Bool(default_value=False,
+                           help="Start kernels outside of any project in a cached environment with the dependencies of the "
+                                "notebook's inline script metadata (PEP 723), from its code cells or a .py file with the same "
+                                "name. Requires uv.").tag(config=True)
+    script_packages = List(Unicode(), default_value=["ipykernel"],
+                           help="Packages (requirement specifiers) added to the dependencies of the script metadata"
+                           ).tag(config=True)
+    script_env_max_size = Int(default_value=10 * 2**30,
+                              help="Bytes of disk used by cached script environments, above which the least recently "
+                                   "used are removed").tag(config=True)
+    import_profile = Bool(default_value=False,
+                          help="Start kernels with `-X importtime` and write a report of the slowest imports next to "
+                               "the connection file").tag(config=True)
+    output_buffer_size = Int(default_value=0,
+                             help="Keep the latest output (bytes) of each kernel and the project manager that starts it, "
+                                  "and log it when the kernel fails to start, starts slowly or the fallback kernel is used. "
+                                  "0: disabled. Not on Windows.").tag(config=True)
+    readahead = Bool(default_value=False,
+                     help="During pre-launch, read the files that the kernel imports into the OS page cache in the background. "
+                          "The files are learned from the previous kernel start in the same directory, and read from "
+                          "readahead_manifest").tag(config=True)
+    readahead_manifest = Unicode(default_value=None, allow_none=True,
+                                 help="File that lists files (or glob patterns), one per line, to read ahead for every kernel "
+                                      "when readahead is enabled").tag(config=True)
+    slow_start_seconds = Float(default_value=30., help="Seconds after which a kernel that does not answer heartbeats is "
+                               "reported as slow to start, with its output").tag(config=True)
+
+    # the project of the running kernel, None for the fallback kernel
+    _pplk_project: ProjectDetection | None = None
+    _idle_task: asyncio.Future | None = None
+    _telemetry_task: asyncio.Future | None = None
+    _telemetry_sample: _proctree.TreeSample | None = None
+    # detected project kind for metrics
+    _pplk_kind: str = "None"
+    _pplk_start_time: float | None = None
+    _pplk_timer: _PhaseTimer
+    # reason for starting the fallback kernel
+    _pplk_error: str | None = None
+    # connection file in the kernel command line, used to find the kernel process
+    _kernel_marker: str | None = None
+    _kernel_process: t.Any = None
+    # known descendants of the kernel process (psutil.Process)
+    _descendants: t.List[t.Any] = []
+
+    # import time profile of the kernel start, if enabled
+    _import_profile: bool = False
+    _import_profile_task: asyncio.Future | None = None
+    _import_profile_log: Path | None = None
+    _import_profile_tee: _importtime.StderrTee | None = None
+
+    # output of the kernel launch and the task that reports it on a failed or slow start
+    _output: _outputbuffer.OutputBuffer | None = None
+    _start_watch_task: asyncio.Future | None = None
+
+    # readahead of the kernel's files: the directory it is learned for and the task that learns it
+    _readahead_key: str | None = None
+    _readahead_learn_task: asyncio.Future | None = None
+
+    # replacement kernel for the next restart and the task that maintains it
+    _standby: _standby.StandbyKernel | None = None
+    _standby_task: asyncio.Future | None = None
+    _use_standby: bool = False
+    # launch environment before the project's changes, for the standby kernel
+    _pplk_base_env: t.Dict[str, str] | None = None
+
+    # ports allocated from the port pool
+    _pool_ports: t.List[int] = []
+
+    # python command of the latest pre-launch, without the kernel arguments
+    _pplk_python_cmd: t.List[str] = []
+    # interpreters of the other running kernels when pre-launch started, their script environments are kept
+    _pplk_live_pythons: t.List[Path] = []
+
+    # launch state, persisted in the provisioner info
+    _pplk_cmd: t.List[str] = []
+    _pplk_create_time: float | None = None
+    _pplk_fingerprints: t.Dict[str, t.Any] = {}
+
+    # kernels launched by this process which are still running
+    _live_kernels: t.ClassVar[weakref.WeakSet[PyprojectKernelProvisioner]] = weakref.WeakSet()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._pplk_timer = _PhaseTimer()
 
     def _log_info(self, message, *args):
         self.__log(logging.INFO, message, *args)
@@ -49,59 +198,292 @@ class PyprojectKernelProvisioner(LocalProvisioner):
         logger = t.cast(logging.Logger, self.log)
         logger.log(level, MY_TOOL_NAME + ": " + message, *args)
 
-    def _pplk_pre_launch(self, **kwargs):
-        """prepare kernel launch"""
+    def _pplk_pre_launch(self, other_kernels: int = 0, **kwargs):
+        """prepare kernel launch, other_kernels: number of other running kernels for the thread budget"""
         kernel_spec = t.cast(KernelSpec, self.kernel_spec)
         cwd = Path(kwargs.get("cwd", Path.cwd()))
 
-        for tname in ["config", "use_venv", "sanity_check"]:
+        for tname in ["config", "use_venv", "sanity_check", "thread_budget", "idle_timeout", "idle_action", "ipykernel_overlay",
+                      "import_profile", "standby_kernel"]:
             self._log_debug("%s=%r", tname, getattr(self, tname, None))
 
-        spec_use_venv = self.use_venv if self.is_use_venv_kernel else None
-        spec_config = Config(use_venv=spec_use_venv, sanity_check=self.sanity_check)
+        spec_config = self._spec_config()
+        self._pplk_project = None
+        timer = self._pplk_timer
 
         if not self.python_kernel_args:
             raise RuntimeError("pyproject_local_kernel config missing from kernelspec")
 
-        find_project = identify(cwd)
+        compiled = None
+        if self.compiled_project:
+            # kernelspec for one project, see `pyproject_local_kernel kernelspec install`
+            compiled = _kernelspec.load_compiled(self.compiled_project)
+            if compiled is None:
+                self._log_info("project changed since its kernelspec was installed, resolving it again")
+                cwd = Path(self.compiled_project.get("pyproject", cwd)).parent
+            timer.lap("compiled-check")
+
+        if compiled is not None:
+            find_project, python_environment = compiled
+        else:
+            pyproject_file = find_pyproject_file_from(cwd)
+            timer.lap("discover")
+            find_project = identify_file(pyproject_file)
+            timer.lap("parse")
         find_project.config = find_project.config.merge_with(spec_config)
+        timer.lap("config")
         self._log_debug("Found project %s in %s", find_project.kind, find_project.path)
         self._log_debug("with effective config %r", find_project.config)
+        self._pplk_project = find_project
+        self._pplk_kind = find_project.kind.name
 
-        if find_project.path is None:
-            raise RuntimeError(_MESSAGE_NO_PYPROJECT)
+        if compiled is None:
+            if find_project.path is None:
+                python_environment = None
+                if self.script_metadata:
+                    python_environment = self._script_environment(cwd, kwargs.get("env") or os.environ)
+                    timer.lap("script-env")
+                if python_environment is None:
+                    if not self.scratch_env:
+                        raise RuntimeError(_MESSAGE_NO_PYPROJECT)
+                    python_environment = self._scratch_environment()
+                    timer.lap("scratch-env")
 
-        if find_project.kind == ProjectKind.InvalidData:
-            raise RuntimeError("\n".join([_MESSAGE_NO_PYPROJECT, f"Reason: {find_project.error_context}"]))
+            elif find_project.kind == ProjectKind.InvalidData:
+                raise RuntimeError("\n".join([_MESSAGE_NO_PYPROJECT, f"Reason: {find_project.error_context}"]))
 
-        python_environment = find_project.resolve(allow_hatch_workaround=True)
-        if python_environment is None:
-            raise RuntimeError(_MESSAGE_NO_PYPROJECT)
+            else:
+                # includes `hatch env find` for hatch projects
+                python_environment = find_project.resolve(allow_hatch_workaround=True, locate_venv=True)
+                timer.lap("resolve")
+                if python_environment is None:
+                    raise RuntimeError(_MESSAGE_NO_PYPROJECT)
 
-        if python_environment.venv_bin_dir:
+        python_environment.thread_budget = self._thread_budget(find_project.config.thread_budget, other_kernels)
+        if python_environment.needs_environment():
             kwargs["env"] = _get_environment(kwargs.get("env"), copy=False)
             python_environment.update_environment(kwargs["env"])
+        timer.lap("environment")
 
         # convert path to string and update kernel spec argv
         python_cmd = list(map(str, python_environment.python_cmd))
-        kernel_spec.argv[:] = python_cmd + self.python_kernel_args
+        kernel_args = list(self.python_kernel_args)
+        use_overlay = False
+        if find_project.config.ipykernel_overlay and python_cmd == ProjectKind.Uv.python_cmd():
+            if overlay_args := self._uv_ipykernel_overlay(find_project, kernel_args):
+                python_cmd = ["uv", "run", "python"]
+                kernel_args = overlay_args
+                use_overlay = True
+            timer.lap("ipykernel-overlay")
+        python_args = []
+        launch_env = kwargs["env"] if kwargs.get("env") is not None else os.environ
+        if find_project.config.import_profile or launch_env.get(IMPORT_PROFILE_ENV, "") not in ("0", ""):
+            python_args = ["-X", "importtime"]
+            self._import_profile = True
+        # resolve the program on PATH here, where the lookup is cached
+        self._pplk_python_cmd = _discovery.resolve_command(python_cmd, kwargs.get("env"))
+        kernel_spec.argv[:] = self._pplk_python_cmd + python_args + kernel_args
+        timer.lap("command")
 
-        if find_project.config.sanity_check:
+        # a compiled project was checked when its kernelspec was installed
+        if find_project.config.sanity_check and not use_overlay and compiled is None:
             self._python_environment_sanity_check(find_project, python_cmd, cwd, env=kwargs.get("env"))
+            timer.lap("sanity-check")
         return kwargs
 
+    def _spec_config(self) -> Config:
+        "Project config defaults from the kernelspec and the provisioner's settings"
+        spec_use_venv = self.use_venv if self.is_use_venv_kernel else None
+        return Config(use_venv=spec_use_venv, sanity_check=self.sanity_check, thread_budget=self.thread_budget,
+                      idle_timeout=self.idle_timeout, idle_action=self.idle_action,
+                      ipykernel_overlay=self.ipykernel_overlay, import_profile=self.import_profile,
+                      standby_kernel=self.standby_kernel)
+
+    def _scratch_environment(self) -> PythonEnvironment:
+        "The shared scratch environment for kernels outside of any project"
+        python = _discovery.which(self.scratch_python) if self.scratch_python else sys.executable
+        if python is None:
+            raise RuntimeError(_MESSAGE_NO_PYPROJECT + f"\nCould not find python {self.scratch_python!r} for the scratch environment")
+        scratch_python = _envcache.scratch_env(Path(python), self.scratch_packages)
+        if scratch_python is None:
+            raise RuntimeError(_MESSAGE_NO_PYPROJECT + "\nCould not build the scratch environment")
+        self._log_debug("using scratch environment %s", scratch_python.parent.parent)
+        return PythonEnvironment([scratch_python], scratch_python.parent)
+
+    def _script_environment(self, cwd: Path, env: t.Mapping[str, str]) -> PythonEnvironment | None:
+        "The cached environment for the notebook's inline script metadata, None if it has none"
+        notebook = _scriptmeta.notebook_path(env, cwd)
+        if notebook is None:
+            self._log_debug("notebook of the kernel is not known, no script metadata")
+            return None
+        try:
+            metadata = _scriptmeta.find(notebook)
+        except (OSError, ValueError) as exc:
+            raise RuntimeError(f"Could not read the script metadata: {exc}")
+        if metadata is None:
+            return None
+        python = self._script_python(metadata.requires_python)
+        packages = [*metadata.dependencies, *self.script_packages]
+        script_python = _envcache.script_env(python, packages, self.script_env_max_size, in_use=self._pplk_live_pythons)
+        if script_python is None:
+            raise RuntimeError(f"Could not build the environment for the dependencies in {metadata.source}")
+        self._log_debug("using script environment %s for %s", script_python.parent.parent, metadata.source)
+        return PythonEnvironment([script_python], script_python.parent)
+
+    def _script_python(self, requires_python: str | None) -> Path:
+        "Interpreter for a script environment: scratch_python, or one that uv finds for requires-python"
+        if requires_python is None:
+            python = _discovery.which(self.scratch_python) if self.scratch_python else sys.executable
+            if python is None:
+                raise RuntimeError(f"Could not find python {self.scratch_python!r} for the script environment")
+            return Path(python)
+        try:
+            proc = subprocess.run(["uv", "python", "find", "--system", requires_python], capture_output=True, check=True,
+                                  encoding="utf-8", timeout=30)
+        except (OSError, subprocess.SubprocessError) as exc:
+            raise RuntimeError(f"Could not find python for requires-python {requires_python!r}: {exc}")
+        return Path(proc.stdout.strip())
+
+    def _uv_ipykernel_overlay(self, project: ProjectDetection, kernel_args: list[str]) -> list[str] | None:
+        "Get kernel arguments for running with the ipykernel overlay, None if not possible"
+        assert project.path is not None
+        python = _envcache.uv_project_python(project.path.parent)
+        if python is None:
+            self._log_debug("no virtual environment yet, not using ipykernel overlay")
+            return None
+        overlay = _envcache.ipykernel_overlay(python)
+        if overlay is None:
+            return None
+        self._log_debug("using ipykernel overlay %s", overlay)
+        return _envcache.overlay_kernel_args(kernel_args, overlay)
+
+    def _other_kernels(self) -> int:
+        "Number of other running kernels; only on the event loop's thread, where kernels are added and removed"
+        return sum(1 for prov in list(self._live_kernels) if prov is not self)
+
+    def _live_pythons(self) -> t.List[Path]:
+        "Interpreters of the other running kernels; only on the event loop's thread, like _other_kernels"
+        return [Path(prov._pplk_python_cmd[0]) for prov in list(self._live_kernels)
+                if prov is not self and prov._pplk_python_cmd]
+
+    def _thread_budget(self, setting: bool | int | None, other_kernels: int) -> int | None:
+        "Compute number of threads for the kernel from the thread-budget setting"
+        if setting is None or setting is False:
+            return None
+        if setting is True:
+            budget = max(1, _available_cpus() // (other_kernels + 1))
+            self._log_debug("thread budget %d (%d other running kernels)", budget, other_kernels)
+            return budget
+        return max(1, setting)
+
     async def pre_launch(self, **kwargs) -> t.Dict[str, t.Any]:
         # note: we could raise an exception here and JupyterLab will show the message
+        self._pplk_start_time = time.monotonic()
+        self._pplk_timer = _PhaseTimer()
+        self._pplk_kind = "None"
+        self._pplk_error = None
+        self._import_profile = False
+        self._use_standby = False
+        self._pplk_base_env = dict(kwargs["env"]) if kwargs.get("env") is not None else None
+        if self.metrics_file:
+            _metrics.REGISTRY.start_writer(self.metrics_file, self.metrics_interval)
+        if self._output is not None:
+            # of a pre-launch that was not followed by a launch
+            self._output.close_writers()
+        self._output = None
+        if self.output_buffer_size > 0:
+            if _outputbuffer.supported():
+                self._output = _outputbuffer.OutputBuffer.start(self.output_buffer_size)
+            else:
+                self._log_debug("output_buffer_size is not supported on this platform")
+        self._log_debug("Launching kernel from process pid=%d", os.getpid())
+        self._readahead_key = None
+        if self.readahead:
+            # not awaited: it only needs to be ahead of the kernel's imports
+            self._readahead_key = str(Path(kwargs.get("cwd") or Path.cwd()).resolve())
+            asyncio.get_event_loop().run_in_executor(None, self._readahead, self._readahead_key)
+        # like LocalProvisioner.pre_launch
+        session_name = (kwargs["env"] or {}).get("JPY_SESSION_NAME", "") if "env" in kwargs else None
+
+        # the ports and the connection file are prepared while the project is resolved
+        graph = _taskgraph.TaskGraph()
+        # counted here, the resolve step runs in another thread
+        other_kernels = self._other_kernels()
+        self._pplk_live_pythons = self._live_pythons()
+        graph.add("resolve", lambda: self._resolve_launch(other_kernels, **kwargs), blocking=True)
+        graph.add("reserve-ports", self._reserve_ports)
+        graph.add("connection-file", lambda: self._write_connection_file(session_name, kwargs), deps=["reserve-ports"])
+        graph.add("command", lambda: self._launch_command(graph.result("resolve")), deps=["resolve", "connection-file"])
         try:
-            new_kwargs = self._pplk_pre_launch(**kwargs)
+            new_kwargs = await graph.run("command")
+        except BaseException:
+            # the write ends are otherwise closed by launch_kernel, and then the reader thread exits
+            if self._output is not None:
+                self._output.close_writers()
+            raise
+        for name in ("reserve-ports", "connection-file", "command"):
+            self._pplk_timer.add(name, graph.steps[name].duration)
+        self._pplk_timer.mark()
+        self._log_debug("pre-launch critical path: %s", graph.format_critical_path("command"))
+        return new_kwargs
+
+    def _resolve_launch(self, other_kernels: int, **kwargs) -> t.Dict[str, t.Any]:
+        "Resolve the project and the kernel command, or prepare the fallback kernel (blocking)"
+        try:
+            if self._standby_ready():
+                return self._standby_pre_launch(**kwargs)
+            return self._pplk_pre_launch(other_kernels, **kwargs)
         except (OSError, RuntimeError) as exc:
             # an error was encountered, run the fallback kernel instead to present the error
-            self.kernel_spec.argv[:] = [sys.executable, "-m", "pyproject_local_kernel", f"--fallback-kernel={exc}"] + self.python_kernel_args
-            new_kwargs = kwargs
-        except Exception:
-            raise  # show to user
-        self._log_debug("Launching kernel from process pid=%d", os.getpid())
-        return await super().pre_launch(**new_kwargs)
+            self._pplk_project = None
+            self._pplk_error = str(exc)
+            self._pplk_timer.lap("failed")
+            _metrics.fallback_kernels.inc()
+            self._log_output(f"starting the fallback kernel: {exc}")
+            self.kernel_spec.argv[:] = [sys.executable, "-m", "pyproject_local_kernel", f"--fallback-kernel={exc}",
+                                        f"--fallback-kind={self._pplk_kind}"] + self.python_kernel_args
+            return kwargs
+
+    def _write_connection_file(self, session_name: str | None, kwargs: t.Dict[str, t.Any]):
+        """
+        Write the connection file with the reserved ports ahead of
+        LocalProvisioner.pre_launch, which then uses it.
+        """
+        km = self.parent
+        if km is None or not hasattr(km, "write_connection_file"):
+            return
+        # ports that are not reserved yet would be replaced after the file is written
+        if not self.ports_cached:
+            return
+        # with encryption, LocalProvisioner.pre_launch adds the keys before writing the file
+        if kwargs.get("transport_encryption", getattr(km, "transport_encryption", "disabled")) not in ("disabled", None, False):
+            return
+        if session_name is not None:
+            km.write_connection_file(jupyter_session=session_name)
+        else:
+            km.write_connection_file()
+
+    async def _launch_command(self, kwargs: t.Dict[str, t.Any]) -> t.Dict[str, t.Any]:
+        "LocalProvisioner.pre_launch, which builds the kernel command"
+        return await super().pre_launch(**kwargs)
+
+    def _reserve_ports(self):
+        """
+        Allocate the kernel's ports from the port pool, or from jupyter-client's port cache
+        like LocalProvisioner.pre_launch, before the connection file is written
+        """
+        km = self.parent
+        if km is None or not getattr(km, "cache_ports", False) or self.ports_cached:
+            return
+        if self.port_range:
+            ports = _ports.get_pool(self.port_range).acquire(km.ip, 5)
+            self._pool_ports = ports
+        else:
+            lpc = LocalPortCache.instance()
+            ports = [lpc.find_available_port(km.ip) for _ in range(5)]
+        km.shell_port, km.iopub_port, km.stdin_port, km.hb_port, km.control_port = ports
+        self.ports_cached = True
+        self._log_debug("reserved ports %r", ports)
 
     def _python_environment_sanity_check(self, project: ProjectDetection, python_cmd: list[str], cwd: Path, env: dict | None):
         # skip sanity for uv because it will install ipykernel
@@ -111,17 +493,21 @@ class PyprojectKernelProvisioner(LocalProvisioner):
 
         st = time.time()
         try:
-            sanity_cmd = python_cmd + ["-c", _SCRIPT_CHECK_HAS_KERNEL]
-            self._log_debug("Running sanity check: %r", sanity_cmd)
             sanity_env = _get_environment(env, copy=True)
+            sanity_cmd = _discovery.resolve_command(python_cmd, sanity_env) + ["-c", _SCRIPT_CHECK_HAS_KERNEL]
+            self._log_debug("Running sanity check: %r", sanity_cmd)
             sanity_env["PYPROJECT_LOCAL_KERNEL_SANITY_CHECK"] = "1"
+            output = self._output
             try:
-                subprocess.run(sanity_cmd, check=True, cwd=cwd, env=sanity_env)
+                subprocess.run(sanity_cmd, check=True, cwd=cwd, env=sanity_env,
+                               stdout=output and output.stdout, stderr=output and output.stderr)
             except OSError as exc:
                 self.__log(logging.ERROR, "failed sanity check: %s", exc)
+                _metrics.sanity_check_failures.inc()
                 raise RuntimeError(_MESSAGE_SANITY + f"\nError: {exc}")
             except (subprocess.CalledProcessError, OSError) as exc:
                 self.__log(logging.ERROR, "failed sanity check: %s", exc)
+                _metrics.sanity_check_failures.inc()
                 raise RuntimeError(_MESSAGE_SANITY_NO_IPYKERNEL)
         finally:
             self._log_debug("used %.3f s on sanity check", (time.time() - st))
@@ -129,23 +515,664 @@ class PyprojectKernelProvisioner(LocalProvisioner):
     async def launch_kernel(self, cmd: t.List[str], **kwargs: t.Any) -> KernelConnectionInfo:
         self._log_info("Launching %r in cwd=%r", cmd, kwargs.get("cwd", None))
 
+        tee = None
+        marker = _connection_file_argument(cmd)
+        output = self._output
+        if self._import_profile and marker is not None and self._pplk_error is None and not self._use_standby:
+            # the profile is written to stderr, the rest of stderr is forwarded
+            self._import_profile_log = Path(marker).with_name(Path(marker).stem + "-importtime.log")
+            tee = _importtime.StderrTee(self._import_profile_log, output.stderr if output is not None else 2)
+            kwargs["stderr"] = tee.fd
+        self._import_profile_tee = tee
+        if output is not None:
+            kwargs.setdefault("stdout", output.stdout)
+            kwargs.setdefault("stderr", output.stderr)
         try:
-            return await super().launch_kernel(cmd, **kwargs)
+            if self._use_standby:
+                connection_info = self._activate_standby(cmd, **kwargs)
+            else:
+                connection_info = await super().launch_kernel(cmd, **kwargs)
         except OSError as exc:
             raise RuntimeError(f"Could not start kernel: {exc}") from exc
+        finally:
+            if tee is not None:
+                tee.close_writer()
+            if output is not None:
+                output.close_writers()
+        self._pplk_timer.lap("spawn")
+        self._log_debug("launch phases: %s", ", ".join(f"{phase} {seconds:.3f} s" for phase, seconds in self.launch_timings().items()))
+        self._live_kernels.add(self)
+        self._kernel_marker = _connection_file_argument(cmd)
+        self._kernel_process = None
+        self._descendants = []
+        self._pplk_cmd = list(cmd)
+        self._pplk_create_time = _proctree.create_time(self.pid)
+        project = self._pplk_project
+        self._pplk_fingerprints = _kernelspec.fingerprints(project.path.parent, *cmd[:1]) if project and project.path else {}
+        _metrics.kernel_starts.inc(self._pplk_kind)
+        if self._pplk_start_time is not None:
+            _metrics.start_seconds.observe(time.monotonic() - self._pplk_start_time)
+            self._pplk_start_time = None
+        self._start_idle_watch()
+        self._start_telemetry()
+        if tee is not None:
+            self._import_profile_task = asyncio.ensure_future(self._import_profile_report())
+        if output is not None and not self._use_standby:
+            self._start_watch_task = asyncio.ensure_future(self._start_watch(time.monotonic()))
+        if self._readahead_key is not None and project is not None and not self._use_standby:
+            self._readahead_learn_task = asyncio.ensure_future(self._learn_readahead(
+                self._readahead_key, self._pplk_python_cmd, kwargs.get("env"), self._pplk_fingerprints))
+        self._start_standby_watch()
+        return connection_info
+
+    async def get_provisioner_info(self) -> t.Dict[str, t.Any]:
+        provisioner_info = await super().get_provisioner_info()
+        project = self._pplk_project
+        provisioner_info[_PROVISIONER_INFO_KEY] = {
+            "cmd": self._pplk_cmd,
+            "create_time": self._pplk_create_time,
+            "kind": self._pplk_kind,
+            "project": None if project is None else {
+                "kind": project.kind.name,
+                "pyproject": str(project.path) if project.path else None,
+                "config": dataclasses.asdict(project.config),
+            },
+            "fingerprints": self._pplk_fingerprints,
+            "pool_ports": self._pool_ports,
+        }
+        return provisioner_info
+
+    async def load_provisioner_info(self, provisioner_info: t.Dict) -> None:
+        """
+        Adopt the running kernel described by provisioner_info, for example after
+        a restart of the Jupyter server. The kernel is only adopted if it is
+        still the same process and answers heartbeats, otherwise has_process
+        is False and the kernel must be started again.
+        """
+        await super().load_provisioner_info(provisioner_info)
+        self.process = None
+        state = provisioner_info.get(_PROVISIONER_INFO_KEY)
+        if not state or self.pid is None:
+            return
+        if sys.platform == "win32" or not _proctree.available():
+            self._log_info("adopting running kernels requires psutil and is not supported on Windows")
+            return
+        marker = _connection_file_argument(state.get("cmd") or [])
+        process = _proctree.adopt_process(self.pid, state.get("create_time"), marker)
+        if process is None:
+            self._log_info("kernel pid=%r is no longer running", self.pid)
+            return
+        if not await _heartbeat(self.connection_info, _ADOPT_HEARTBEAT_TIMEOUT):
+            self._log_info("kernel pid=%r does not answer heartbeats, stopping it", self.pid)
+            await self._shutdown_processes(_proctree.process_tree(self.pid), signal.SIGTERM)
+            return
+
+        self.process = process
+        self._pplk_cmd = list(state["cmd"])
+        self._pplk_create_time = state["create_time"]
+        self._pplk_kind = state.get("kind", "None")
+        self._pplk_project = _load_project(state.get("project"))
+        self._pplk_fingerprints = state.get("fingerprints") or {}
+        if (changed := _kernelspec.changed_file(self._pplk_fingerprints)) is not None:
+            self._log_info("%s changed since kernel pid=%r was started, restart the kernel to use the changes", changed, self.pid)
+        if (pool_ports := state.get("pool_ports")) and self.port_range:
+            _ports.get_pool(self.port_range).claim(pool_ports)
+            self._pool_ports = list(pool_ports)
+            self.ports_cached = True
+        self._kernel_marker = marker
+        self._kernel_process = None
+        self._descendants = []
+        self._live_kernels.add(self)
+        _metrics.kernel_adoptions.inc(self._pplk_kind)
+        self._log_info("adopted running kernel pid=%r", self.pid)
+        self._start_idle_watch()
+        self._start_telemetry()
 
     async def send_signal(self, signum: int) -> None:
         self._log_debug("send signal=%r", signum)
+        if signum not in _GROUP_SIGNALS and self._send_signal_to_kernel(signum):
+            return
         await super().send_signal(signum)
 
+    def _find_kernel_process(self) -> t.Any:
+        "Find the python kernel process below any wrapper commands (psutil.Process or None)"
+        proc = self._kernel_process
+        if proc is not None and proc.is_running():
+            return proc
+        if self._kernel_marker is None or self.process is None:
+            return None
+        self._kernel_process = _proctree.find_kernel_process(self.pid, self._kernel_marker)
+        return self._kernel_process
+
+    def _send_signal_to_kernel(self, signum: int) -> bool:
+        """
+        Send signal directly to the kernel process and its descendants in its process group,
+        so that it does not depend on wrappers like `uv run` forwarding it. Return True if successful.
+        """
+        if sys.platform == "win32" or not _proctree.available():
+            return False
+        st = time.monotonic()
+        kernel_process = self._find_kernel_process()
+        lookup_time = time.monotonic() - st
+        if kernel_process is None:
+            self._log_debug("kernel process not found in %.3f ms, signalling process group", lookup_time * 1000)
+            return False
+        try:
+            kernel_process.send_signal(signum)
+        except Exception as exc:
+            self._log_debug("failed to signal kernel process %r: %s", kernel_process.pid, exc)
+            return False
+        # like the signal to the process group, without the wrappers: subprocesses (`!cmd`) and workers
+        descendants = _proctree.group_descendants(kernel_process)
+        _proctree.signal_all(descendants, signum)
+        self._log_debug("sent signal=%r to kernel process pid=%r and %d descendants in %.3f ms (lookup %.3f ms)",
+                        signum, kernel_process.pid, len(descendants), (time.monotonic() - st) * 1000, lookup_time * 1000)
+        if signum == signal.SIGINT and getattr(self.parent, "execution_state", None) == "busy":
+            asyncio.ensure_future(self._measure_interrupt(st))
+        return True
+
+    async def _measure_interrupt(self, start_time: float, timeout: float = 10.):
+        "Log time until the kernel manager sees the kernel going idle after an interrupt"
+        while time.monotonic() - start_time < timeout:
+            if getattr(self.parent, "execution_state", None) != "busy":
+                self._log_debug("interrupt round-trip %.3f s", time.monotonic() - start_time)
+                return
+            await asyncio.sleep(0.01)
+        self._log_debug("kernel still busy %.1f s after interrupt", timeout)
+
+    def get_shutdown_wait_time(self, recommended: float = 5.0) -> float:
+        # called when the kernel manager starts shutting down the kernel
+        self._update_descendants()
+        return super().get_shutdown_wait_time(recommended)
+
+    def _update_descendants(self) -> list[t.Any]:
+        """
+        Update the list of known descendants of the kernel process.
+        Descendants are remembered, so that they can be found even after their parent exited.
+        """
+        known = {proc.pid: proc for proc in self._descendants if _proctree.is_running(proc)}
+        for proc in _proctree.process_tree(self.pid)[1:]:
+            known.setdefault(proc.pid, proc)
+        self._descendants = list(known.values())
+        return self._descendants
+
     async def terminate(self, restart: bool = False) -> None:
         self._log_debug("terminate")
+        descendants = self._update_descendants()
         await super().terminate(restart=restart)
+        await self._shutdown_processes(descendants, signal.SIGTERM)
+
+    async def kill(self, restart: bool = False) -> None:
+        self._log_debug("kill")
+        descendants = self._update_descendants()
+        await super().kill(restart=restart)
+        _proctree.kill_all(descendants)
+
+    async def _shutdown_processes(self, procs: list[t.Any], signum: int):
+        """
+        Signal all processes at once, kill the processes that are still running
+        after shutdown_deadline and report the time it took.
+        """
+        if not procs:
+            return
+        st = time.monotonic()
+        _proctree.signal_all(procs, signum)
+        loop = asyncio.get_event_loop()
+        alive = await loop.run_in_executor(None, _proctree.wait_all, procs, self.shutdown_deadline)
+        if alive:
+            self._log_info("killing %d processes still running after %.1f s: %r",
+                           len(alive), self.shutdown_deadline, [proc.pid for proc in alive])
+            _proctree.kill_all(alive)
+            alive = await loop.run_in_executor(None, _proctree.wait_all, alive, 1.)
+        self._log_debug("shutdown of %d processes took %.3f s", len(procs), time.monotonic() - st)
+        if alive:
+            self.__log(logging.WARNING, "processes survived shutdown: %r", [proc.pid for proc in alive])
 
     async def cleanup(self, restart: bool = False) -> None:
         self._log_debug("cleanup")
+        # orphaned processes, for example multiprocessing workers of the kernel
+        orphans = [proc for proc in self._descendants if _proctree.is_running(proc)]
+        self._descendants = []
+        if orphans:
+            self._log_info("stopping %d orphaned processes: %r", len(orphans), [proc.pid for proc in orphans])
+            await self._shutdown_processes(orphans, signal.SIGTERM)
+        self._live_kernels.discard(self)
+        if restart:
+            _metrics.kernel_restarts.inc()
+        if self._idle_task is not None:
+            # don't cancel the idle watch if it is the one shutting down the kernel
+            if self._idle_task is not asyncio.current_task():
+                self._idle_task.cancel()
+            self._idle_task = None
+        if self._telemetry_task is not None:
+            self._telemetry_task.cancel()
+            self._telemetry_task = None
+        if self._standby_task is not None:
+            self._standby_task.cancel()
+            self._standby_task = None
+        if self._start_watch_task is not None:
+            self._start_watch_task.cancel()
+            self._start_watch_task = None
+        if self._readahead_learn_task is not None:
+            self._readahead_learn_task.cancel()
+            self._readahead_learn_task = None
+        if self._standby is not None and not restart:
+            self._standby.discard()
+            self._standby = None
+        if self._import_profile_task is not None:
+            if not self._import_profile_task.done():
+                self._import_profile_task.cancel()
+                self._write_import_profile_report()
+            self._import_profile_task = None
+        if self._output is not None:
+            # if the kernel was not launched after pre-launch
+            self._output.close_writers()
+        if self._pool_ports and not restart:
+            # the kernel keeps its ports over restarts
+            _ports.get_pool(self.port_range).release(self._pool_ports)
+            self._pool_ports = []
+            self.ports_cached = False
         await super().cleanup(restart=restart)
 
+    def _start_idle_watch(self):
+        config = self._pplk_project and self._pplk_project.config
+        if config is None or not config.idle_timeout:
+            return
+        action = config.idle_action or "shutdown"
+        if action != "shutdown" and _parse_signal(action) is None:
+            self.__log(logging.ERROR, "invalid idle-action %r, idle culling is disabled", action)
+            return
+        if not _proctree.available():
+            self._log_info("psutil is not installed, idle culling only considers kernel activity and not CPU usage")
+        self._idle_task = asyncio.ensure_future(self._idle_watch(config.idle_timeout * 60, action))
+
+    def _kernel_activity(self) -> t.Any:
+        "Activity marker set on the kernel manager by jupyter-server, None if not available"
+        km = self.parent
+        if getattr(km, "execution_state", None) == "busy":
+            return object()  # always counts as new activity
+        return getattr(km, "last_activity", None)
+
+    async def _idle_watch(self, timeout: float, action: str):
+        "Cull the kernel when it has been idle for timeout seconds"
+        interval = min(60., timeout / 4)
+        idle_time = 0.
+        culled = False
+        last_activity = self._kernel_activity()
+        last_cpu_time = _proctree.tree_usage(_proctree.process_tree(self.pid)).cpu_time
+        while True:
+            await asyncio.sleep(interval)
+            if self.process is None or self.process.poll() is not None:
+                return
+            procs = _proctree.process_tree(self.pid)
+            usage = _proctree.tree_usage(procs)
+            activity = self._kernel_activity()
+            cpu_percent = 100 * (usage.cpu_time - last_cpu_time) / interval
+            last_cpu_time = usage.cpu_time
+            if activity is not last_activity or cpu_percent > self.idle_cpu_percent:
+                last_activity = activity
+                idle_time = 0.
+                culled = False
+                continue
+            idle_time += interval
+            if idle_time < timeout or culled:
+                continue
+            culled = True
+            self._log_info("kernel pid=%r has been idle for %.1f minutes, using %.1f MiB (%d processes): %s",
+                           self.pid, idle_time / 60, usage.rss_mib, usage.nprocs, action)
+            if action == "shutdown":
+                await self._shutdown_idle_kernel()
+            else:
+                await self.send_signal(t.cast(int, _parse_signal(action)))
+                await asyncio.sleep(1.)
+            remaining = _proctree.tree_usage(procs)
+            self._log_info("culled idle kernel, reclaimed %.1f MiB of memory", usage.rss_mib - remaining.rss_mib)
+            if action == "shutdown":
+                return
+
+    async def _shutdown_idle_kernel(self):
+        "Shut down through the kernel manager if possible, so that it is not restarted"
+        km = self.parent
+        kernel_manager_owner = getattr(km, "parent", None)
+        kernel_id = getattr(km, "kernel_id", None)
+        try:
+            if (kernel_id is not None and inspect.iscoroutinefunction(getattr(kernel_manager_owner, "shutdown_kernel", None))
+                    and kernel_id in t.cast(t.Any, kernel_manager_owner)):
+                await t.cast(t.Any, kernel_manager_owner).shutdown_kernel(kernel_id)
+            elif inspect.iscoroutinefunction(getattr(km, "shutdown_kernel", None)):
+                await t.cast(t.Any, km).shutdown_kernel()
+            else:
+                await self.terminate()
+        except Exception as exc:
+            self.__log(logging.ERROR, "failed to shut down idle kernel: %s", exc)
+
+    def _start_telemetry(self):
+        self._telemetry_sample = None
+        if self.telemetry_interval <= 0 or self.pid is None:
+            return
+        if not _proctree.available():
+            self._log_info("psutil is not installed, telemetry is disabled")
+            return
+        self._telemetry_task = asyncio.ensure_future(self._telemetry(_proctree.TreeSampler(self.pid)))
+
+    async def _telemetry(self, sampler: _proctree.TreeSampler):
+        loop = asyncio.get_event_loop()
+        while self.process is not None:
+            sample = await loop.run_in_executor(None, sampler.sample)
+            self._telemetry_sample = sample
+            self._log_debug("resources pid=%r procs=%d rss=%.1f MiB uss=%.1f MiB cpu=%.1f%% threads=%d fds=%d",
+                            self.pid, len(sample.processes), sample.rss / 2**20, sample.uss / 2**20,
+                            sample.cpu_percent, sample.num_threads, sample.num_fds)
+            await asyncio.sleep(self.telemetry_interval)
+
+    async def _start_watch(self, start_time: float):
+        "Log the kernel's output if it exits before answering heartbeats, or is slow to answer them"
+        slow = False
+        while self.process is not None:
+            if (status := self.process.poll()) is not None:
+                self._log_output(f"kernel pid={self.pid!r} exited with status {status} before it started")
+                break
+            if not slow and time.monotonic() - start_time > self.slow_start_seconds:
+                slow = True
+                self._log_output(f"kernel pid={self.pid!r} has not started after {self.slow_start_seconds:g} s")
+            if await _heartbeat(self.connection_info, 1.):
+                if slow:
+                    self._log_info("kernel pid=%r started after %.1f s", self.pid, time.monotonic() - start_time)
+                break
+        self._start_watch_task = None
+
+    def _log_output(self, reason: str):
+        "Log the buffered output of the launch, if enabled"
+        output = self._output
+        if output is None:
+            return
+        output.wait_idle()
+        self.__log(logging.WARNING, "%s\nOutput of the launch (latest %d bytes, seconds since the launch):\n%s",
+                   reason, self.output_buffer_size, output.dump() or "(no output)")
+
+    def _readahead(self, key: str):
+        "Read ahead the files from the manifest and the files learned for key (blocking)"
+        st = time.monotonic()
+        files = []
+        if self.readahead_manifest:
+            try:
+                files.extend(_readahead.read_manifest(self.readahead_manifest))
+            except OSError as exc:
+                self.__log(logging.ERROR, "could not read readahead_manifest: %s", exc)
+        if (learned := _readahead.load_learned(key)) is not None:
+            files.extend(learned["files"])
+        count, size = _readahead.readahead(files)
+        self._log_debug("readahead of %d files (%.1f MiB) took %.3f s", count, size / 2**20, time.monotonic() - st)
+
+    async def _learn_readahead(self, key: str, python_cmd: list[str], env: dict[str, str] | None, fingerprints: dict[str, t.Any]):
+        "List the files that the kernel start imports, for the readahead of the next start in the directory"
+        learned = _readahead.load_learned(key)
+        if learned is not None and _kernelspec.changed_file(learned.get("fingerprints") or {}) is None:
+            return
+        await asyncio.sleep(_READAHEAD_LEARN_DELAY)
+        loop = asyncio.get_event_loop()
+        try:
+            files = await loop.run_in_executor(None, _readahead.list_imports, python_cmd, key, env)
+            await loop.run_in_executor(None, _readahead.save_learned, key, files, fingerprints)
+        except (OSError, ValueError, IndexError, subprocess.SubprocessError) as exc:
+            self._log_info("could not list the kernel's files for readahead: %s", exc)
+            return
+        finally:
+            self._readahead_learn_task = None
+        self._log_debug("learned %d files for readahead in %s", len(files), key)
+
+    def _standby_ready(self) -> bool:
+        "True if there is a standby kernel for the current state of the project"
+        standby = self._standby
+        if standby is None:
+            return False
+        if standby.is_alive() and _kernelspec.changed_file(standby.fingerprints) is None:
+            return True
+        self._log_info("discarding outdated standby kernel pid=%r", standby.process.pid)
+        standby.discard()
+        self._standby = None
+        return False
+
+    def _standby_pre_launch(self, **kwargs):
+        "Prepare launch of the standby kernel, which has already resolved the project"
+        standby = t.cast(_standby.StandbyKernel, self._standby)
+        self._pplk_project = standby.project
+        self._pplk_kind = standby.project.kind.name
+        t.cast(KernelSpec, self.kernel_spec).argv[:] = standby.python_cmd + list(self.python_kernel_args)
+        self._use_standby = True
+        self._pplk_timer.lap("standby")
+        return kwargs
+
+    def _activate_standby(self, cmd: t.List[str], **kwargs) -> KernelConnectionInfo:
+        "Start the kernel in the standby process, instead of LocalProvisioner.launch_kernel"
+        standby = t.cast(_standby.StandbyKernel, self._standby)
+        self._standby = None
+        self.process = standby.activate(cmd[len(standby.python_cmd):])
+        self.pid = self.process.pid
+        try:
+            self.pgid = os.getpgid(self.pid)
+        except OSError:
+            self.pgid = None
+        self.cwd = kwargs.get("cwd", Path.cwd())
+        self._log_info("started kernel in standby process pid=%r", self.pid)
+        return self.connection_info
+
+    def _start_standby_watch(self):
+        project = self._pplk_project
+        if project is None or project.path is None or not project.config.standby_kernel:
+            return
+        if not _standby.supported(self.python_kernel_args):
+            self._log_info("standby kernels are not supported for this kernel (or on Windows)")
+            return
+        self._standby_task = asyncio.ensure_future(self._standby_watch())
+
+    async def _standby_watch(self):
+        "Start a standby kernel when the project files change"
+        loop = asyncio.get_event_loop()
+        recorded = self._pplk_fingerprints
+        while self.process is not None:
+            await asyncio.sleep(_STANDBY_POLL_INTERVAL)
+            if self._standby is not None:
+                recorded = self._standby.fingerprints
+            if (changed := _kernelspec.changed_file(recorded)) is None:
+                continue
+            self._log_info("%s changed, starting a standby kernel for the next restart", changed)
+            if self._standby is not None:
+                await loop.run_in_executor(None, self._standby.discard)
+                self._standby = None
+            thread_budget = self._thread_budget(t.cast(ProjectDetection, self._pplk_project).config.thread_budget,
+                                                self._other_kernels())
+            future = loop.run_in_executor(None, self._start_standby, thread_budget)
+            try:
+                standby = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                future.add_done_callback(_discard_standby)
+                raise
+            except (OSError, RuntimeError) as exc:
+                self._log_info("could not start standby kernel: %s", exc)
+                standby = None
+            if standby is None:
+                # try again on the next change
+                recorded = _kernelspec.fingerprints(t.cast(Path, t.cast(ProjectDetection, self._pplk_project).path).parent)
+                continue
+            if self.process is None:
+                standby.discard()
+                return
+            self._standby = standby
+            self._log_info("standby kernel pid=%r is ready, restart the kernel to use it", standby.process.pid)
+
+    def _start_standby(self, thread_budget: int | None) -> _standby.StandbyKernel | None:
+        "Identify and resolve the project again and start a standby kernel for it (blocking)"
+        cwd = Path(self.cwd or Path.cwd())
+        pyproject_file = find_pyproject_file_from(cwd)
+        if pyproject_file is None:
+            return None
+        # fingerprints before resolving, so that later changes are noticed
+        fingerprints = _kernelspec.fingerprints(pyproject_file.parent)
+        project = identify_file(pyproject_file)
+        if project.kind == ProjectKind.InvalidData:
+            raise RuntimeError(f"Could not use {project.path}: {project.error_context}")
+        project.config = project.config.merge_with(self._spec_config())
+        environment = project.resolve(allow_hatch_workaround=True, locate_venv=True)
+        if environment is None:
+            return None
+        environment.thread_budget = thread_budget
+        env = _get_environment(self._pplk_base_env, copy=True)
+        environment.update_environment(env)
+        python_cmd = _discovery.resolve_command(list(map(str, environment.python_cmd)), env)
+        kernel_args = [arg.replace("{connection_file}", self._kernel_marker or "") for arg in self.python_kernel_args]
+        return _standby.StandbyKernel.start(python_cmd, kernel_args, cwd, env, project, fingerprints, self.standby_timeout)
+
+    async def _import_profile_report(self, settle: float = 1., timeout: float = 120.):
+        "Write the import profile report when the kernel has finished importing (the profile stopped growing)"
+        log_file = t.cast(Path, self._import_profile_log)
+        start = time.monotonic()
+        size, unchanged = -1, 0.
+        interval = 0.1
+        while unchanged < settle and time.monotonic() - start < timeout:
+            await asyncio.sleep(interval)
+            if self.process is None or self.process.poll() is not None:
+                break
+            new_size = _file_size(log_file)
+            unchanged = unchanged + interval if new_size == size else 0.
+            size = new_size
+        self._write_import_profile_report()
+
+    def _write_import_profile_report(self):
+        log_file = self._import_profile_log
+        if log_file is None:
+            return
+        if self._import_profile_tee is not None:
+            # the startup is profiled, later imports are not logged
+            self._import_profile_tee.stop()
+        report_file = log_file.with_name(log_file.stem + "-report.txt")
+        try:
+            with open(log_file, encoding="utf-8", errors="replace") as f:
+                records = _importtime.parse(f)
+            report_file.write_text(_importtime.format_report(records), encoding="utf-8")
+        except OSError as exc:
+            self.__log(logging.ERROR, "could not write import profile report: %s", exc)
+            return
+        finally:
+            self._import_profile_log = None
+        self._log_info("import profile of kernel pid=%r written to %s, slowest packages: %s", self.pid, report_file,
+                       ", ".join(f"{package} {self_us / 1000:.0f} ms" for package, self_us in _importtime.package_times(records)[:5]))
+
+    def launch_timings(self) -> dict[str, float]:
+        "Duration in seconds of each phase of the latest launch, in order"
+        return dict(self._pplk_timer.timings)
+
+    def resource_snapshot(self) -> dict[str, t.Any] | None:
+        """
+        Latest resource usage sample of the kernel's process tree, None if not available.
+        Requires telemetry_interval to be set.
+        """
+        sample = self._telemetry_sample
+        if sample is None or self.process is None:
+            return None
+        project = self._pplk_project
+        return {
+            "kernel_id": self.kernel_id,
+            "pid": self.pid,
+            "project": str(project.path) if project and project.path else None,
+            "kind": project.kind.name if project else None,
+            **sample.as_dict(),
+        }
+
+    @classmethod
+    def resource_snapshots(cls) -> list[dict[str, t.Any]]:
+        "Latest resource usage samples for all running kernels in this process"
+        snapshots = (prov.resource_snapshot() for prov in list(cls._live_kernels))
+        return [snap for snap in snapshots if snap is not None]
+
+
+# signals for the whole process group
+_GROUP_SIGNALS = {getattr(signal, name) for name in ("SIGTERM", "SIGKILL") if hasattr(signal, name)}
+
+
+class _PhaseTimer:
+    "Durations of the launch phases"
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str):
+        "Record the time since the previous phase as the duration of phase"
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.) + now - self._last
+        self._last = now
+
+    def add(self, phase: str, seconds: float):
+        "Record the duration of a phase that ran concurrently with the others"
+        self.timings[phase] = self.timings.get(phase, 0.) + seconds
+
+    def mark(self):
+        "Start the next phase now"
+        self._last = time.perf_counter()
+
+
+def _load_project(data: dict[str, t.Any] | None) -> ProjectDetection | None:
+    "Project from the provisioner info, None for the fallback kernel or if invalid"
+    if data is None:
+        return None
+    try:
+        pyproject = data["pyproject"]
+        return ProjectDetection(Path(pyproject) if pyproject else None, ProjectKind[data["kind"]], Config.from_dict(data["config"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+async def _heartbeat(connection_info: KernelConnectionInfo, timeout: float) -> bool:
+    "True if the kernel answers a heartbeat within timeout"
+    import zmq
+    import zmq.asyncio
+
+    transport = connection_info.get("transport", "tcp")
+    ip, port = connection_info["ip"], connection_info["hb_port"]
+    url = f"ipc://{ip}-{port}" if transport == "ipc" else f"{transport}://{ip}:{port}"
+    context = zmq.asyncio.Context()
+    socket = context.socket(zmq.REQ)
+    socket.linger = 0
+    try:
+        socket.connect(url)
+        await socket.send(b"ping")
+        return bool(await socket.poll(timeout * 1000))
+    except zmq.ZMQError:
+        return False
+    finally:
+        socket.close()
+        context.term()
+
+
+def _connection_file_argument(cmd: t.Sequence[str]) -> str | None:
+    "Find the connection file argument in the kernel command"
+    for flag, value in zip(cmd, cmd[1:]):
+        if flag == "-f":
+            return value
+    return None
+
+
+def _discard_standby(future: asyncio.Future):
+    "Discard the standby kernel that a cancelled task was starting"
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        future.result().discard()
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return -1
+
+
+def _parse_signal(name: str) -> int | None:
+    "Parse signal name like SIGUSR1 or USR1"
+    name = name.upper()
+    if not name.startswith("SIG"):
+        name = "SIG" + name
+    signum = getattr(signal, name, None)
+    return signum if isinstance(signum, int) else None
+
 
 def _get_environment(env: dict[str, str] | None, *, copy) -> dict[str, str]:
     """Get environment from env or os.environ
@@ -156,3 +1183,10 @@ def _get_environment(env: dict[str, str] | None, *, copy) -> dict[str, str]:
         return os.environ.copy()
     else:
         return env.copy() if copy else env
+
+
+def _available_cpus() -> int:
+    "Number of CPUs this process can use"
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import pytest
+from jupyter_client import BlockingKernelClient
+from jupyter_client.connect import write_connection_file
+
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.fixture
+def fallback_kernel(tmp_path: Path):
+    connection_file, _ = write_connection_file(str(tmp_path / "kernel.json"))
+    proc = subprocess.Popen([sys.executable, "-m", "pyproject_local_kernel", "--fallback-kernel=Something failed",
+                             "--fallback-kind=Uv", "-f", connection_file], cwd=tmp_path)
+    client = BlockingKernelClient()
+    client.load_connection_file(connection_file)
+    client.start_channels()
+    try:
+        client.wait_for_ready(timeout=10)
+        yield client
+    finally:
+        client.shutdown()
+        client.stop_channels()
+        try:
+            assert proc.wait(timeout=5) == 0
+        finally:
+            proc.kill()
+
+
+def _execute(client: BlockingKernelClient, code: str) -> tuple[dict, dict[str, str]]:
+    "Execute code and return the reply and the stream output"
+    outputs = {"stdout": "", "stderr": ""}
+
+    def output_hook(msg):
+        if msg["msg_type"] == "stream":
+            outputs[msg["content"]["name"]] += msg["content"]["text"]
+
+    reply = client.execute_interactive(code, timeout=10, output_hook=output_hook)
+    return reply, outputs
+
+
+def test_fallback_kernel_info(fallback_kernel: BlockingKernelClient):
+    reply = fallback_kernel.kernel_info(reply=True, timeout=5)
+    assert reply["content"]["status"] == "ok"
+    assert reply["content"]["language_info"]["name"] == "python"
+    assert "Error: Something failed" in reply["content"]["banner"]
+
+
+def test_fallback_kernel_execute(fallback_kernel: BlockingKernelClient):
+    reply, outputs = _execute(fallback_kernel, "!echo hello\n!exit 3")
+    assert reply["content"]["status"] == "ok"
+    assert outputs["stdout"] == "hello\n"
+    assert "Error: Something failed" in outputs["stderr"]
+    assert "!uv add ipykernel" in outputs["stderr"]
+    assert "Command exited with status 3" in outputs["stderr"]
+
+    _, outputs = _execute(fallback_kernel, "import sys")
+    assert "only run shell commands" in outputs["stderr"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uses sleep command")
+def test_fallback_kernel_interrupt(fallback_kernel: BlockingKernelClient):
+    start = time.monotonic()
+    fallback_kernel.execute("!sleep 20")
+    time.sleep(0.5)
+    fallback_kernel.control_channel.send(fallback_kernel.session.msg("interrupt_request", {}))
+    reply = fallback_kernel.get_shell_msg(timeout=10)
+    assert reply["msg_type"] == "execute_reply"
+    assert time.monotonic() - start < 10
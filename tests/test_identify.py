@@ -2,10 +2,16 @@ import dataclasses
 from pathlib import Path
 import os
 import shutil
+import subprocess
 import typing
 
 import pytest
 
+try:
+    import tomllib as tomli
+except ImportError:
+    import tomli
+
 from pyproject_local_kernel._identify import ProjectKind, identify
 from pyproject_local_kernel._configdata import _type_name, Config
 import testlib
@@ -20,6 +26,7 @@ pytestmark = pytest.mark.unit
     ("tests/identify/pdm", ProjectKind.Pdm),
     ("tests/identify/hatch", ProjectKind.Hatch),
     ("tests/identify/uv", ProjectKind.Uv),
+    ("tests/identify/pixi", ProjectKind.Pixi),
     ("tests/identify/invalid_toml", ProjectKind.InvalidData),
     ("tests/identify/unknown", ProjectKind.Unknown),
     ("tests/identify/no_project_section", ProjectKind.InvalidData),
@@ -124,3 +131,230 @@ def test_config_type_name():
         assert _type_name(self_type_hints[field.name])
 
     assert _type_name(typing.Union[typing.List[str], None]) == "list[str] | None"
+
+
+def test_discovery_which(tmp_path: Path):
+    from pyproject_local_kernel import _discovery
+
+    if os.name == "nt":
+        pytest.skip("uses executable bit")
+    tool = tmp_path / "bin" / "mytool"
+    tool.parent.mkdir()
+    tool.write_text("#!/bin/sh\n")
+    tool.chmod(0o755)
+    path = str(tool.parent)
+
+    assert _discovery.which("mytool", path) == str(tool)
+    assert _discovery.resolve_command(["mytool", "arg"], {"PATH": path}) == [str(tool), "arg"]
+    assert _discovery.resolve_command(["notfound", "arg"], {"PATH": path}) == ["notfound", "arg"]
+
+    # revalidated when the file is gone
+    tool.unlink()
+    assert _discovery.which("mytool", path) is None
+
+
+def test_discovery_interpreter_facts(tmp_path: Path):
+    from pyproject_local_kernel import _discovery
+    import sys
+
+    facts = _discovery.interpreter_facts(sys.executable)
+    assert facts.version == tuple(sys.version_info[:3])
+    assert facts.implementation == sys.implementation.name
+    assert facts.is_venv == (sys.prefix != sys.base_prefix)
+
+    # cached
+    def fail(*args, **kwargs):
+        raise AssertionError("should be cached")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(subprocess, "run", fail)
+        assert _discovery.interpreter_facts(sys.executable) is facts
+
+
+def test_hatch_env_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    from pyproject_local_kernel._envlocate import hatch_env_dir
+    from pyproject_local_kernel._identify import get_hatch_venv, get_venv_bin_python
+
+    root = tmp_path / "project"
+    root.mkdir()
+    (root / "pyproject.toml").write_text('[project]\nname = "My_Project"\nversion = "1"\n[tool.hatch.envs.default]\n')
+    monkeypatch.setenv("HATCH_CONFIG", str(Path(__file__).parent / "hatch_config.toml"))
+    monkeypatch.delenv("HATCH_ENV_TYPE_VIRTUAL_PATH", raising=False)
+    assert hatch_env_dir(root) == root.resolve() / "the_virtualenv" / "my-project"
+
+    # data directory outside the project
+    (tmp_path / "config.toml").touch()
+    monkeypatch.setenv("HATCH_CONFIG", str(tmp_path / "config.toml"))
+    monkeypatch.setenv("HATCH_DATA_DIR", str(tmp_path / "data"))
+    env_dir = hatch_env_dir(root)
+    assert env_dir is not None
+    project_id = env_dir.parent.name
+    assert len(project_id) == 8
+    assert env_dir == tmp_path / "data" / "env" / "virtual" / "my-project" / project_id / "my-project"
+
+    # explicit path, used without asking hatch when the environment exists
+    with open(root / "pyproject.toml", "a") as f:
+        f.write('path = ".hatchenv"\n')
+    assert hatch_env_dir(root) == root.resolve() / ".hatchenv"
+    python = get_venv_bin_python(root / ".hatchenv")
+    python.parent.mkdir(parents=True)
+    python.touch()
+    monkeypatch.setenv("PATH", "")
+    assert get_hatch_venv(root / "pyproject.toml") == str(root.resolve() / ".hatchenv")
+
+
+@pytest.mark.parametrize("error", [
+    FileNotFoundError("hatch"),
+    subprocess.CalledProcessError(1, ["hatch"]),
+    subprocess.TimeoutExpired(["hatch"], 3),
+])
+def test_hatch_env_find_error(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, error: Exception):
+    from pyproject_local_kernel import _envlocate
+
+    def run(*args, **kwargs):
+        raise error
+    monkeypatch.setattr(subprocess, "run", run)
+    (tmp_path / "pyproject.toml").write_text('[project]\nname = "p"\nversion = "1"\n')
+    assert _envlocate.hatch_env_find(tmp_path) is None
+
+
+def test_poetry_env_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    from pyproject_local_kernel._envlocate import poetry_env_name
+    from pyproject_local_kernel._identify import get_venv_bin_python
+
+    root = tmp_path / "project"
+    root.mkdir()
+    shutil.copy("tests/identify/poetry/pyproject.toml", root)
+    monkeypatch.setenv("POETRY_CONFIG_DIR", str(tmp_path / "config"))
+    monkeypatch.setenv("POETRY_CACHE_DIR", str(tmp_path / "cache"))
+    for name in ["VIRTUAL_ENV", "CONDA_PREFIX", "POETRY_VIRTUALENVS_IN_PROJECT", "POETRY_VIRTUALENVS_PATH"]:
+        monkeypatch.delenv(name, raising=False)
+
+    # no environment yet: poetry run
+    pd = identify(root)
+    assert pd.resolve(locate_venv=True) == pd.resolve()
+    assert pd.get_python_cmd() == ["poetry", "run", "python"]
+
+    # environment in the cache dir, selected with `poetry env use`
+    env_name = poetry_env_name("poetry", root)
+    assert env_name.startswith("poetry-") and len(env_name) == len("poetry-") + 8
+    venvs = tmp_path / "cache" / "virtualenvs"
+    python = get_venv_bin_python(venvs / f"{env_name}-py3.10")
+    python.parent.mkdir(parents=True)
+    python.touch()
+    # not selected with `poetry env use`: leave the choice of python to poetry
+    assert pd.get_python_cmd(locate_venv=True) == ["poetry", "run", "python"]
+    (venvs / "envs.toml").write_text(f'[{env_name}]\nminor = "3.10"\npatch = "3.10.4"\n')
+    penv = pd.resolve(locate_venv=True)
+    assert penv is not None
+    assert penv.python_cmd == [python]
+    assert penv.extra_env == {"VIRTUAL_ENV": str(venvs / f"{env_name}-py3.10")}
+
+    # malformed or unknown envs.toml entries: poetry run
+    for entry in ['patch = "3.10.4"', "minor = [3, 10]", f"[{env_name}.minor]"]:
+        (venvs / "envs.toml").write_text(f"[{env_name}]\n{entry}\n")
+        assert pd.get_python_cmd(locate_venv=True) == ["poetry", "run", "python"]
+    (venvs / "envs.toml").write_text(f'[{env_name}]\nminor = "3.10"\npatch = "3.10.4"\n')
+
+    # in-project environment required but not created yet: poetry run, which creates it
+    (root / "poetry.toml").write_text("[virtualenvs]\nin-project = true\n")
+    assert pd.get_python_cmd(locate_venv=True) == ["poetry", "run", "python"]
+
+    # in-project environment, unless disabled
+    in_project = get_venv_bin_python(root / ".venv")
+    in_project.parent.mkdir(parents=True)
+    in_project.touch()
+    assert pd.get_python_cmd(locate_venv=True) == [in_project]
+    (root / "poetry.toml").write_text("[virtualenvs]\nin-project = false\n")
+    assert pd.get_python_cmd(locate_venv=True) == [python]
+
+
+
+@pytest.mark.skipif(os.name == "nt", reason="pixi is used directly only on posix")
+def test_pixi_environment(tmp_path: Path):
+    root = tmp_path / "project"
+    root.mkdir()
+    shutil.copy("tests/identify/pixi/pyproject.toml", root)
+
+    # not installed yet: pixi run
+    pd = identify(root)
+    assert pd.get_python_cmd(locate_venv=True) == ["pixi", "run", "python"]
+
+    env_dir = root / ".pixi" / "envs" / "default"
+    python = env_dir / "bin" / "python"
+    python.parent.mkdir(parents=True)
+    python.touch()
+    (env_dir / "conda-meta").mkdir()
+    (env_dir / "conda-meta" / "pixi").touch()
+    penv = pd.resolve(locate_venv=True)
+    assert penv is not None
+    assert penv.python_cmd == [python]
+    assert penv.venv_bin_dir == python.parent
+    assert penv.extra_env["CONDA_PREFIX"] == str(env_dir)
+    assert penv.extra_env["PIXI_PROJECT_NAME"] == "pixi-project"
+    assert penv.extra_env["PIXI_ENVIRONMENT_NAME"] == "default"
+
+    # lock file changed after the installation: pixi run installs it
+    (root / "pixi.lock").touch()
+    os.utime(root / "pixi.lock", (python.stat().st_mtime + 10,) * 2)
+    assert pd.get_python_cmd(locate_venv=True) == ["pixi", "run", "python"]
+
+    # configured environment
+    with open(root / "pyproject.toml", "a") as f:
+        f.write('\n[tool.pyproject-local-kernel]\npixi-environment = "dev"\n')
+    pd = identify(root)
+    assert pd.get_python_cmd(locate_venv=True) == ["pixi", "run", "--environment", "dev", "python"]
+    dev_python = root / ".pixi" / "envs" / "dev" / "bin" / "python"
+    dev_python.parent.mkdir(parents=True)
+    dev_python.touch()
+    (dev_python.parent.parent / "conda-meta").mkdir()
+    (dev_python.parent.parent / "conda-meta" / "pixi").touch()
+    os.utime(root / "pixi.lock", (0, 0))
+    penv = pd.resolve(locate_venv=True)
+    assert penv is not None and penv.python_cmd == [dev_python]
+    assert penv.extra_env["CONDA_DEFAULT_ENV"] == "pixi-project:dev"
+
+
+_TOML_FILLER = "".join(
+    f'[tool.other.t{i}]\nitems = [\n    "a]", \'[b\', {{ c = [1, {{ d = "}}" }}] }},\n]  # ] [\n'
+    f'text = """\n[tool.uv]\nx = \\"""\n"""\n\n'
+    for i in range(600))
+
+
+@pytest.mark.parametrize("text", [
+    # headers inside multi-line strings and arrays are not headers
+    '[project]\nname = "a"\nversion = "1"\n' + _TOML_FILLER + '[tool.uv]\nx = 1\n',
+    '[project]\nname = "a"\nversion = "1"\n' + _TOML_FILLER + "[tool.uv.sub]\nx = '''[\n[tool.pdm]\n'''\n",
+    # dotted keys in a parent table, and arrays of tables
+    '[tool]\nuv.x = 1\n' + _TOML_FILLER + '[[tool.uv.index]]\nname = "a"\n[[tool.uv.index]]\nname = "b"\n',
+    '[project]\nname = "a"\n' + _TOML_FILLER + '[ tool . "uv" ]  # quoted\nx = 1\n',
+])
+def test_tomlscan(text):
+    from pyproject_local_kernel import _tomlscan
+
+    assert len(text) > _tomlscan.MIN_SCAN_SIZE
+    data = _tomlscan.loads(text, ["project", "tool.uv"])
+    full = tomli.loads(text)
+    assert data.get("project") == full.get("project")
+    assert data["tool"]["uv"] == full["tool"]["uv"]
+    assert "other" not in data["tool"]
+
+
+@pytest.mark.parametrize("text", [
+    # unusual constructs make the scan ambiguous
+    '[project]\nname = "a"\n' + _TOML_FILLER + 'x = "unterminated\n[tool.uv]\nx = 1\n',
+    '[project]\nname = "a"\n' + _TOML_FILLER + '["tool".\n"uv"]\nx = 1\n',
+    '[project]\nname = "a"\n' + _TOML_FILLER + '[tool."u\\u0076"]\nx = 1\n',
+])
+def test_tomlscan_ambiguous(text):
+    from pyproject_local_kernel import _tomlscan
+
+    with pytest.raises(_tomlscan.Ambiguous):
+        _tomlscan.scan(text)
+    # falls back to parsing the whole file
+    try:
+        full = tomli.loads(text)
+    except tomli.TOMLDecodeError:
+        with pytest.raises(tomli.TOMLDecodeError):
+            _tomlscan.loads(text, ["tool.uv"])
+    else:
+        assert _tomlscan.loads(text, ["tool.uv"]) == full
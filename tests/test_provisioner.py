@@ -2,18 +2,30 @@ from __future__ import annotations
 
 import asyncio
 import enum
+import json
+import logging
 from pathlib import Path
+import os
 import shutil
+import signal
+import subprocess
+import sys
+import time
+import typing as t
+import weakref
 
 import pytest
 import jupyter_client.kernelspec
 from jupyter_client.kernelspec import KernelSpec
 from jupyter_client.provisioning import KernelProvisionerFactory as KPF  # type: ignore
+from traitlets import TraitError
 from traitlets.config import Config
 
 
 from pyproject_local_kernel.provisioner import PyprojectKernelProvisioner
-from pyproject_local_kernel._identify import KERNEL_SPECS, ProjectKind
+from pyproject_local_kernel._configdata import Config as ProjectConfig
+from pyproject_local_kernel import _metrics
+from pyproject_local_kernel._identify import KERNEL_SPECS, THREAD_BUDGET_VARIABLES, ProjectDetection, ProjectKind
 
 
 pytestmark = pytest.mark.unit
@@ -30,6 +42,8 @@ def test_instantiate(kernel_spec: KernelSpec):
     assert prov.python_kernel_args
     assert prov.sanity_check
     assert prov.use_venv
+    # opt-in
+    assert prov.thread_budget is False
 
 
 class Expected(enum.Enum):
@@ -43,6 +57,27 @@ KS_REGULAR = KERNEL_SPECS[0]
 KS_VENV = KERNEL_SPECS[1]
 
 
+@pytest.fixture
+def provisioner() -> t.Callable[..., PyprojectKernelProvisioner]:
+    "Make provisioners for the regular kernelspec, traits override its provisioner config"
+    def make(**traits: t.Any) -> PyprojectKernelProvisioner:
+        kernel_spec = jupyter_client.kernelspec.get_kernel_spec(KS_REGULAR)
+        config = kernel_spec.metadata['kernel_provisioner']['config']
+        return PyprojectKernelProvisioner(kernel_spec=kernel_spec, **{**config, **traits})
+    return make
+
+
+def write_pyproject(project_dir: Path, **config: t.Any) -> Path:
+    "Write a project that runs this python without sanity check, with more project config like import_profile=True"
+    settings = {"python-cmd": [sys.executable], "sanity-check": False}
+    settings.update((name.replace("_", "-"), value) for name, value in config.items())
+    project_dir.mkdir(parents=True, exist_ok=True)
+    pyproject = project_dir / "pyproject.toml"
+    pyproject.write_text('[project]\nname = "p"\nversion = "1"\n[tool.pyproject-local-kernel]\n' +
+                         "".join(f"{name} = {json.dumps(value)}\n" for name, value in settings.items()))
+    return pyproject
+
+
 @pytest.mark.parametrize("scenario,expected,sanity,kernel_spec", [
     ("", Expected.NoPyproject, False, KS_REGULAR),
     ("", Expected.NoPyproject, False, KS_VENV),
@@ -83,7 +118,8 @@ def test_pre_launch(scenario: str, expected, sanity: bool, kernel_spec: KernelSp
         assert cmd[0].startswith(str(cwd.absolute() / ".venv"))
     elif expected == Expected.Uv:
         uv_cmd = list(ProjectKind.Uv.python_cmd() or ["x"])
-        assert cmd[:len(uv_cmd)] == uv_cmd
+        # program is resolved on PATH
+        assert [Path(cmd[0]).stem, *cmd[1:len(uv_cmd)]] == uv_cmd
     elif expected == Expected.Fallback:
         assert cmd[3] == "--fallback-kernel=not sane"
     elif expected == Expected.NoPyproject:
@@ -112,3 +148,822 @@ def test_venv_config():
 
     prov = PyprojectKernelProvisioner(config=config)
     assert prov.use_venv == config_value
+
+
+@pytest.mark.parametrize("thread_budget,expected", [
+    (3, "3"),
+    (False, None),
+    # 8 CPUs shared with 3 other running kernels
+    (True, "2"),
+])
+def test_thread_budget(thread_budget, expected, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    from pyproject_local_kernel import provisioner as provisioner_module
+    prov = provisioner(sanity_check=False, thread_budget=thread_budget)
+    shutil.copy(Path("tests/server-client/client-venv/pyproject.toml"), tmp_path)
+    for name in THREAD_BUDGET_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(provisioner_module, "_available_cpus", lambda: 8)
+    others = [provisioner() for _ in range(3)]
+    monkeypatch.setattr(PyprojectKernelProvisioner, "_live_kernels", weakref.WeakSet([prov, *others]))
+
+    kwargs = asyncio.run(prov.pre_launch(cwd=tmp_path))
+    env = kwargs["env"]
+    if expected is None:
+        assert not any(name in env for name in THREAD_BUDGET_VARIABLES)
+    else:
+        assert all(env[name] == expected for name in THREAD_BUDGET_VARIABLES)
+
+
+def test_idle_cull(caplog: pytest.LogCaptureFixture):
+    prov = PyprojectKernelProvisioner()
+    prov._pplk_project = ProjectDetection(None, ProjectKind.Unknown, ProjectConfig(idle_timeout=0.02, idle_action="shutdown"))
+
+    async def launch_and_wait():
+        await prov.launch_kernel([sys.executable, "-c", "import time; time.sleep(30)"])
+        return await asyncio.wait_for(prov.wait(), timeout=10)
+
+    with caplog.at_level(logging.INFO):
+        assert asyncio.run(launch_and_wait()) is not None
+    assert any("culled idle kernel" in rec.getMessage() for rec in caplog.records)
+
+
+def test_telemetry():
+    pytest.importorskip("psutil")
+    prov = PyprojectKernelProvisioner(telemetry_interval=0.1)
+
+    async def launch_and_sample():
+        script = "import subprocess, sys; subprocess.run([sys.executable, '-c', 'import time; time.sleep(30)'])"
+        await prov.launch_kernel([sys.executable, "-c", script])
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.2)
+                snapshot = prov.resource_snapshot()
+                if snapshot and len(snapshot["processes"]) == 2:
+                    return snapshot
+        finally:
+            await prov.kill()
+            await prov.wait()
+            await prov.cleanup()
+
+    snapshot = asyncio.run(launch_and_sample())
+    assert snapshot is not None
+    assert snapshot["rss"] > 0 and snapshot["num_threads"] >= 2
+    assert {proc["pid"] for proc in snapshot["processes"]} >= {prov.pid}
+    assert PyprojectKernelProvisioner.resource_snapshots() == []
+
+
+def test_metrics_file(tmp_path: Path, provisioner):
+    metrics_file = tmp_path / "pplk.prom"
+    prov = provisioner(metrics_file=str(metrics_file), metrics_interval=0.05)
+    fallbacks = _metrics.fallback_kernels.get()
+    starts = _metrics.kernel_starts.get("NoProject")
+
+    async def launch():
+        # no pyproject.toml: launches the fallback kernel
+        kwargs = await prov.pre_launch(cwd=tmp_path)
+        kwargs.pop("cmd")
+        await prov.launch_kernel([sys.executable, "-c", "pass"], **kwargs)
+        await prov.wait()
+        await prov.cleanup(restart=True)
+        await asyncio.sleep(0.2)
+
+    asyncio.run(launch())
+    assert _metrics.fallback_kernels.get() == fallbacks + 1
+    assert _metrics.kernel_starts.get("NoProject") == starts + 1
+    text = metrics_file.read_text()
+    assert "# TYPE pyproject_local_kernel_start_duration_seconds histogram" in text
+    assert f'pyproject_local_kernel_kernel_starts_total{{kind="NoProject"}} {starts + 1:g}' in text
+    assert f'pyproject_local_kernel_start_duration_seconds_count {_metrics.start_seconds.count}' in text
+
+
+def test_metrics_threads():
+    import threading
+
+    counter = _metrics.Counter("test_total", "Test counter", ["kind"])
+    histogram = _metrics.Histogram("test_seconds", "Test histogram", [1.])
+
+    def update():
+        for i in range(2000):
+            counter.inc(str(i % 50))
+            histogram.observe(0.5)
+
+    threads = [threading.Thread(target=update) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # rendered while the metrics change, like Registry.render
+    while any(thread.is_alive() for thread in threads):
+        with _metrics.REGISTRY.lock:
+            list(counter.samples()) + list(histogram.samples())
+    for thread in threads:
+        thread.join()
+    assert sum(counter.get(str(i)) for i in range(50)) == 8000
+    assert histogram.count == 8000
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="posix signals")
+def test_signal_kernel_process(tmp_path: Path):
+    pytest.importorskip("psutil")
+    prov = PyprojectKernelProvisioner()
+    connection_file = str(tmp_path / "kernel-test.json")
+    # the "wrapper" starts the "kernel", which forks a worker with the same command line,
+    # and all record if they receive SIGINT
+    script = """if 1:
+    import os, pathlib, signal, subprocess, sys, time
+    name = sys.argv[1]
+    def handler(*args):
+        pathlib.Path(sys.argv[3] + "." + name).touch()
+    signal.signal(signal.SIGINT, handler)
+    if name == "wrapper":
+        subprocess.run([sys.executable, "-c", __script__, "kernel", *sys.argv[2:]])
+    else:
+        pathlib.Path(sys.argv[3] + ".pid").write_text(str(os.getpid()))
+        if os.fork() == 0:
+            name = "fork"
+            pathlib.Path(sys.argv[3] + ".forked").touch()
+        time.sleep(30)
+    """
+    script = script.replace("__script__", repr(script))
+
+    async def launch_and_interrupt():
+        await prov.launch_kernel([sys.executable, "-c", script, "wrapper", "-f", connection_file])
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if Path(connection_file + ".forked").exists():
+                    break
+            assert prov._find_kernel_process().pid == int(Path(connection_file + ".pid").read_text())
+            await prov.send_signal(signal.SIGINT)
+            await asyncio.sleep(0.5)
+        finally:
+            await prov.kill()
+            await prov.wait()
+            await prov.cleanup()
+
+    asyncio.run(launch_and_interrupt())
+    assert Path(connection_file + ".kernel").exists()
+    assert Path(connection_file + ".fork").exists()
+    assert not Path(connection_file + ".wrapper").exists()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="posix signals")
+def test_terminate_process_tree():
+    psutil = pytest.importorskip("psutil")
+    prov = PyprojectKernelProvisioner(shutdown_deadline=0.5)
+    # the child leaves the process group and ignores SIGTERM
+    child = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(30)"
+    script = f"import subprocess, sys; subprocess.run([sys.executable, '-c', {child!r}], start_new_session=True)"
+
+    async def launch_and_terminate():
+        await prov.launch_kernel([sys.executable, "-c", script])
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            if len(psutil.Process(prov.pid).children()) == 1:
+                break
+        child_process = psutil.Process(prov.pid).children()[0]
+        await prov.terminate()
+        await asyncio.wait_for(prov.wait(), timeout=5)
+        await prov.cleanup()
+        return child_process
+
+    child_process = asyncio.run(launch_and_terminate())
+    assert not child_process.is_running() or child_process.status() == psutil.STATUS_ZOMBIE
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uses symlink")
+def test_ipykernel_overlay(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    from pyproject_local_kernel import _envcache
+
+    monkeypatch.setenv(_envcache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    shutil.copy(Path("tests/server-client/client-uv/pyproject.toml"), project_dir)
+    python = _envcache.get_venv_bin_python(project_dir / ".venv")
+    python.parent.mkdir(parents=True)
+    python.symlink_to(sys.executable)
+
+    # a prebuilt fake overlay
+    overlay = _envcache.user_cache_dir() / "ipykernel-overlay" / _envcache.interpreter_key(_envcache.interpreter_info(python))
+    overlay.mkdir(parents=True)
+    (overlay / _envcache._COMPLETE_MARKER).write_text("{}")
+    (overlay / "ipykernel_launcher.py").write_text("import sys; print('overlay', sys.argv[1:])")
+
+    prov = provisioner(ipykernel_overlay=True)
+    kwargs = asyncio.run(prov.pre_launch(cwd=project_dir))
+    cmd = kwargs["cmd"]
+    assert [Path(cmd[0]).stem, *cmd[1:4]] == ["uv", "run", "python", "-c"]
+
+    proc = subprocess.run([str(python), *cmd[3:]], capture_output=True, encoding="utf-8", check=True)
+    assert proc.stdout.strip() == "overlay ['-f', '{connection_file}']"
+
+
+@pytest.mark.skipif(shutil.which("uv") is None, reason="needs uv")
+def test_scratch_env(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    from pyproject_local_kernel import _envcache
+
+    monkeypatch.setenv(_envcache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    empty = tmp_path / "empty"
+    empty.mkdir()
+
+    def launch_cmd() -> list[str]:
+        # no packages, which builds without network access
+        prov = provisioner(scratch_env=True, scratch_packages=[], sanity_check=False)
+        kwargs = asyncio.run(prov.pre_launch(cwd=empty))
+        assert prov._pplk_error is None
+        assert "scratch-env" in prov.launch_timings()
+        return kwargs["cmd"]
+
+    cmd = launch_cmd()
+    scratch_dir = _envcache.user_cache_dir() / "scratch"
+    [venv] = scratch_dir.iterdir()
+    assert Path(cmd[0]) == _envcache.get_venv_bin_python(venv)
+    assert cmd[1:] == provisioner().python_kernel_args
+    assert not (venv / "pyvenv.cfg").stat().st_mode & 0o222
+    # reused
+    assert launch_cmd() == cmd
+    assert len(list(scratch_dir.iterdir())) == 1
+    _envcache._make_writable(scratch_dir)
+
+
+
+def test_env_bytecode(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    from pyproject_local_kernel import _envcache
+
+    monkeypatch.setenv(_envcache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    commands = []
+    monkeypatch.setattr(_envcache.subprocess, "run", lambda cmd, **kwargs: commands.append(cmd))
+    monkeypatch.setattr(_envcache, "interpreter_info", lambda python: {"implementation": "cpython", "version": [3, 12]})
+    # read-only environments are installed with bytecode, the kernel can't write it later
+    assert _envcache.ipykernel_overlay(Path(sys.executable)) is not None
+    assert _envcache.scratch_env(Path(sys.executable), ["ipykernel"]) is not None
+    installs = [cmd for cmd in commands if cmd[1:3] == ["pip", "install"]]
+    assert len(installs) == 2 and all("--compile-bytecode" in cmd for cmd in installs)
+    _envcache._make_writable(tmp_path / "cache")
+
+
+def test_script_metadata(tmp_path: Path):
+    from pyproject_local_kernel import _scriptmeta
+
+    block = '# /// script\n# requires-python = ">=3.8"\n# dependencies = [\n#   "rich",\n# ]\n# ///\n'
+    notebook = tmp_path / "analysis.ipynb"
+    cells = [{"cell_type": "markdown", "source": "# /// script\n"},
+             {"cell_type": "code", "source": block.splitlines(keepends=True) + ["import rich"]}]
+    notebook.write_text(json.dumps({"cells": cells}))
+    assert _scriptmeta.notebook_path({"JPY_SESSION_NAME": "sub/analysis.ipynb"}, tmp_path) == notebook
+    assert _scriptmeta.notebook_path({}, tmp_path) is None
+    metadata = _scriptmeta.find(notebook)
+    assert metadata == _scriptmeta.ScriptMetadata(["rich"], ">=3.8", notebook)
+
+    # sidecar script
+    notebook.write_text(json.dumps({"cells": cells[:1]}))
+    assert _scriptmeta.find(notebook) is None
+    (tmp_path / "analysis.py").write_text(block.replace('"rich"', '"numpy"'))
+    metadata = _scriptmeta.find(notebook)
+    assert metadata is not None and metadata.dependencies == ["numpy"]
+    assert metadata.source == tmp_path / "analysis.py"
+
+    with pytest.raises(ValueError, match="multiple"):
+        _scriptmeta.parse(block + "import rich\n" + block, notebook)
+    with pytest.raises(ValueError, match="list of strings"):
+        _scriptmeta.parse("# /// script\n# dependencies = 'rich'\n# ///", notebook)
+
+
+def test_script_env_eviction(tmp_path: Path):
+    from pyproject_local_kernel import _envcache
+
+    now = time.time()
+    for name, size, age in [("a", 300, 7200), ("b", 300, 3 * 7200), ("c", 300, 60), ("d", 300, 5 * 7200)]:
+        marker = tmp_path / name / _envcache._COMPLETE_MARKER
+        marker.parent.mkdir()
+        marker.write_text(json.dumps({"size": size}))
+        os.utime(marker, (now - age, now - age))
+    (tmp_path / ".build-x").mkdir()
+
+    # least recently used first, except the one in use and recently used ones
+    assert _envcache.evict_envs(tmp_path, 700, keep=tmp_path / "b") == [tmp_path / "d", tmp_path / "a"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [".build-x", "b", "c"]
+    assert _envcache.evict_envs(tmp_path, 600) == []
+    # the environment of a running kernel's interpreter
+    python = _envcache.get_venv_bin_python(tmp_path / "b")
+    assert _envcache.evict_envs(tmp_path, 300, in_use=[python]) == []
+
+
+def test_script_env_in_use(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    from pyproject_local_kernel import _envcache
+
+    monkeypatch.setenv(_envcache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    monkeypatch.setattr(PyprojectKernelProvisioner, "_live_kernels", weakref.WeakSet())
+    notebooks = tmp_path / "notebooks"
+    notebooks.mkdir()
+    for name in "abc":
+        (notebooks / f"{name}.py").write_text(f'# /// script\n# dependencies = ["{name}"]\n# ///\n')
+
+    def build_env(venv: Path, *args, **kwargs) -> bool:
+        venv.mkdir(parents=True)
+        (venv / _envcache._COMPLETE_MARKER).write_text(json.dumps({"size": 300}))
+        return True
+    monkeypatch.setattr(_envcache, "_build_env", build_env)
+
+    def launch(notebook: str) -> PyprojectKernelProvisioner:
+        prov = provisioner(script_metadata=True, script_packages=[], script_env_max_size=500, sanity_check=False)
+        env = {**os.environ, "JPY_SESSION_NAME": str(notebooks / notebook)}
+        asyncio.run(prov.pre_launch(cwd=notebooks, env=env))
+        assert prov._pplk_error is None
+        return prov
+
+    # a kernel that has been running for longer than the eviction's minimum age
+    running = launch("a.py")
+    PyprojectKernelProvisioner._live_kernels.add(running)
+    venv = Path(running._pplk_python_cmd[0]).parent.parent
+    old = time.time() - 2 * _envcache._EVICT_MIN_AGE
+    os.utime(venv / _envcache._COMPLETE_MARKER, (old, old))
+    launch("b.py")
+    assert venv.is_dir()
+
+    # stopped
+    PyprojectKernelProvisioner._live_kernels.discard(running)
+    launch("c.py")
+    assert not venv.exists()
+
+
+@pytest.mark.skipif(shutil.which("uv") is None, reason="needs uv")
+def test_script_env(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    from pyproject_local_kernel import _envcache
+
+    monkeypatch.setenv(_envcache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    notebooks = tmp_path / "notebooks"
+    notebooks.mkdir()
+    # no dependencies, which builds without network access
+    (notebooks / "a.py").write_text("# /// script\n# dependencies = []\n# ///\n")
+    (notebooks / "b.py").write_text("# /// script\n# dependencies = [\n# ]\n# ///\n")
+
+    evictions = []
+    evict_envs = _envcache.evict_envs
+    monkeypatch.setattr(_envcache, "evict_envs", lambda *args, **kwargs: evictions.append(args) or evict_envs(*args, **kwargs))
+
+    def launch_cmd(notebook: str) -> list[str]:
+        prov = provisioner(script_metadata=True, script_packages=[], sanity_check=False)
+        env = {**os.environ, "JPY_SESSION_NAME": str(notebooks / notebook)}
+        kwargs = asyncio.run(prov.pre_launch(cwd=notebooks, env=env))
+        assert prov._pplk_error is None
+        assert "script-env" in prov.launch_timings()
+        return kwargs["cmd"]
+
+    cmd = launch_cmd("a.py")
+    [venv] = (_envcache.user_cache_dir() / "script").iterdir()
+    assert Path(cmd[0]) == _envcache.get_venv_bin_python(venv)
+    # same dependencies, same environment, which does not grow the cache
+    assert launch_cmd("b.py") == cmd
+    assert len(evictions) == 1
+    _envcache._make_writable(venv)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="uses symlink")
+def test_compiled_kernelspec(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    from pyproject_local_kernel import _kernelspec, provisioner as provisioner_module
+    from pyproject_local_kernel._identify import get_venv_bin_python
+
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    (project_dir / "pyproject.toml").write_text('[project]\nname = "p"\nversion = "1"\n'
+                                                '[tool.pyproject-local-kernel]\nuse-venv = ".venv"\n')
+    python = get_venv_bin_python(project_dir / ".venv")
+    python.parent.mkdir(parents=True)
+    python.symlink_to(sys.executable)
+    # a fake ipykernel for the environment query
+    (tmp_path / "site" / "ipykernel").mkdir(parents=True)
+    (tmp_path / "site" / "ipykernel" / "__init__.py").touch()
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path / "site"))
+
+    compiled = _kernelspec.compile_project(project_dir)
+    assert compiled["kind"] == "UseVenv"
+    assert compiled["python_cmd"] == [str(python)]
+
+    def launch_cmd():
+        prov = provisioner(compiled_project=compiled, sanity_check=False)
+        return asyncio.run(prov.pre_launch(cwd=tmp_path))["cmd"]
+
+    # fresh: the project is not identified again
+    with monkeypatch.context() as m:
+        m.setattr(provisioner_module, "identify_file", None)
+        assert launch_cmd()[0] == str(python)
+
+    # stale: resolved again from the project directory
+    with open(project_dir / "pyproject.toml", "a") as f:
+        f.write("# changed\n")
+    assert _kernelspec.load_compiled(compiled) is None
+    assert launch_cmd()[0] == str(python)
+
+    # command line install
+    prefix = tmp_path / "prefix"
+    monkeypatch.setattr(sys, "argv", ["pyproject_local_kernel", "kernelspec", "install",
+                                      "--project", str(project_dir), "--prefix", str(prefix)])
+    from pyproject_local_kernel.main import main
+    assert main() == 0
+    spec = jupyter_client.kernelspec.KernelSpec.from_resource_dir(str(prefix / "share/jupyter/kernels/pyproject_local_kernel_project"))
+    assert spec.argv[0] == str(python)
+    assert spec.metadata["kernel_provisioner"]["config"]["compiled_project"]["kind"] == "UseVenv"
+
+
+def test_port_pool(tmp_path: Path, provisioner):
+    import socket
+    from pyproject_local_kernel import _ports
+
+    pool = _ports.PortPool(61871, 61876)
+    # a port which is taken by someone else is skipped
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 61871))
+        ports = pool.acquire("127.0.0.1", 5)
+    assert ports == list(range(61872, 61877))
+
+    # exhausted: the rest are allocated outside the pool
+    exhausted = _metrics.port_pool_exhausted.get()
+    more = pool.acquire("127.0.0.1", 5)
+    assert more[0] == 61871
+    assert not set(more[1:]) & set(range(61871, 61877))
+    assert _metrics.port_pool_exhausted.get() == exhausted + 1
+    pool.release(more)
+    pool.release(ports)
+    assert pool.free == 6
+
+    # through the provisioner
+    km = jupyter_client.KernelManager(kernel_name=KS_REGULAR)
+    prov = provisioner(parent=km, port_range="61881-61890")
+    prov._reserve_ports()
+    assert set(prov._pool_ports) == {km.shell_port, km.iopub_port, km.stdin_port, km.hb_port, km.control_port}
+    assert all(61881 <= port <= 61890 for port in prov._pool_ports)
+    asyncio.run(prov.cleanup())
+    assert _ports.get_pool("61881-61890").free == 10
+
+    # invalid ranges fail with the configuration
+    for port_range in ["9000-8000", "abc", "0-10"]:
+        with pytest.raises(TraitError, match="port_range"):
+            provisioner(port_range=port_range)
+
+
+def test_doctor(tmp_path: Path, capsys: pytest.CaptureFixture):
+    import json
+    from pyproject_local_kernel import _doctor
+
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    (project_dir / "pyproject.toml").write_text('[project]\nname = "p"\nversion = "1"\n'
+                                                '[tool.pyproject-local-kernel]\npython-cmd = ["python"]\nsanity-check = false\n')
+    report = asyncio.run(_doctor.diagnose(project_dir))
+    assert report["ok"]
+    assert report["project"]["kind"] == "CustomConfiguration"
+    assert Path(report["command"][0]).name.startswith("python")
+    assert list(report["phases"])[:3] == ["discover", "parse", "config"]
+
+    # no project: the fallback kernel is started
+    empty = tmp_path / "empty"
+    empty.mkdir()
+    assert _doctor.main(["--profile", "--json", str(empty)]) == 1
+    report = json.loads(capsys.readouterr().out)
+    assert report["kernel_ready"]
+    assert "no pyproject.toml" in report["fallback_reason"]
+    assert {"failed", "spawn", "kernel-info"} <= set(report["phases"])
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="posix only")
+def test_adopt_running_kernel(tmp_path: Path):
+    pytest.importorskip("psutil")
+    from jupyter_client.manager import AsyncKernelManager
+
+    async def start_and_adopt():
+        # no pyproject.toml: the fallback kernel, which answers heartbeats
+        km = AsyncKernelManager(kernel_name=KS_REGULAR)
+        await km.start_kernel(cwd=str(tmp_path))
+        try:
+            info = await km.provisioner.get_provisioner_info()
+            assert info["pyproject_local_kernel"]["kind"] == "NoProject"
+            assert info["pyproject_local_kernel"]["project"] is None
+
+            # a wrong creation time means the pid now belongs to another process
+            stale = PyprojectKernelProvisioner(kernel_spec=km.kernel_spec, parent=AsyncKernelManager(kernel_name=KS_REGULAR))
+            await stale.load_provisioner_info({**info, "pyproject_local_kernel": {
+                **info["pyproject_local_kernel"], "create_time": info["pyproject_local_kernel"]["create_time"] - 10}})
+            assert not stale.has_process
+
+            adopted = PyprojectKernelProvisioner(kernel_spec=km.kernel_spec, parent=AsyncKernelManager(kernel_name=KS_REGULAR))
+            await adopted.load_provisioner_info(info)
+            assert adopted.has_process
+            assert adopted.pid == km.provisioner.pid
+            assert await adopted.poll() is None
+            assert adopted in PyprojectKernelProvisioner._live_kernels
+
+            await adopted.terminate()
+            # reap the process, as its (earlier) parent
+            await km.provisioner.wait()
+            await asyncio.wait_for(adopted.wait(), timeout=5)
+            await adopted.cleanup()
+            assert not adopted.has_process
+        finally:
+            await km.shutdown_kernel(now=True)
+
+    asyncio.run(start_and_adopt())
+
+
+def test_import_profile(tmp_path: Path):
+    from jupyter_client.manager import AsyncKernelManager
+    from pyproject_local_kernel import _importtime
+
+    records = _importtime.parse([
+        "import time: self [us] | cumulative | imported package\n",
+        "import time:       100 |        100 |     b.c\n",
+        "import time:        50 |        150 |   b\n",
+        "import time:        20 |        170 | a\n",
+        "some other output\n",
+    ])
+    assert [(r.name, r.level) for r in records] == [("b.c", 2), ("b", 1), ("a", 0)]
+    assert _importtime.package_times(records) == [("b", 150), ("a", 20)]
+    assert "Imported 3 modules in 0.2 ms" in _importtime.format_report(records)
+
+    # import time lines go to the log until it is stopped, other output is forwarded
+    read_fd, write_fd = os.pipe()
+    tee = _importtime.StderrTee(tmp_path / "tee.log", write_fd)
+    os.close(write_fd)
+    script = "import sys; print('import time: 1 | 1 | a', file=sys.stderr, flush=True); print('warning', file=sys.stderr)"
+    subprocess.run([sys.executable, "-c", script], stderr=tee.fd, check=True)
+    for _ in range(50):
+        if (tmp_path / "tee.log").read_bytes():
+            break
+        time.sleep(0.05)
+    tee.stop()
+    subprocess.run([sys.executable, "-c", script.replace("'warning'", "'more'")], stderr=tee.fd, check=True)
+    tee.close_writer()
+    with open(read_fd, encoding="utf-8") as forwarded:
+        assert forwarded.read() == "warning\nmore\n"
+    assert (tmp_path / "tee.log").read_text() == "import time: 1 | 1 | a\n"
+
+    write_pyproject(tmp_path, import_profile=True)
+
+    async def start():
+        km = AsyncKernelManager(kernel_name=KS_REGULAR)
+        await km.start_kernel(cwd=str(tmp_path))
+        try:
+            assert km.format_kernel_cmd()[1:3] == ["-X", "importtime"]
+            report_file = Path(km.connection_file).with_name(Path(km.connection_file).stem + "-importtime-report.txt")
+            for _ in range(100):
+                if report_file.exists():
+                    break
+                await asyncio.sleep(0.1)
+            report = report_file.read_text()
+            report_file.unlink()
+            log_file = report_file.with_name(report_file.name.replace("-report.txt", ".log"))
+            assert all(line.startswith("import time:") for line in log_file.read_text().splitlines())
+            log_file.unlink()
+            return report
+        finally:
+            await km.shutdown_kernel(now=True)
+
+    report = asyncio.run(start())
+    assert "Top 25 packages by import time" in report
+    # imported by python -m, whether or not the kernel starts
+    assert "runpy" in report
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="posix only")
+def test_standby_kernel(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    from pyproject_local_kernel import provisioner as provisioner_module
+    monkeypatch.setattr(provisioner_module, "_STANDBY_POLL_INTERVAL", 0.1)
+    pyproject = write_pyproject(tmp_path, standby_kernel=True)
+    # a "kernel" that records its pid and arguments
+    (tmp_path / "fake_kernel.py").write_text(
+        "import json, os, sys, time\n"
+        "open(sys.argv[-1] + '.' + str(os.getpid()), 'w').write(json.dumps(sys.argv[1:]))\n"
+        "time.sleep(30)\n")
+    prov = provisioner(python_kernel_args=["-m", "fake_kernel", "-f", str(tmp_path / "conn")])
+
+    async def launch():
+        kwargs = await prov.pre_launch(cwd=str(tmp_path))
+        await prov.launch_kernel(**kwargs)
+
+    async def restart():
+        await prov.kill(restart=True)
+        await prov.wait()
+        await prov.cleanup(restart=True)
+        await launch()
+
+    async def run():
+        await launch()
+        first_pid = prov.pid
+        try:
+            # no change: no standby kernel
+            await asyncio.sleep(0.3)
+            assert prov._standby is None
+            pyproject.write_text(pyproject.read_text() + "# changed\n")
+            for _ in range(100):
+                if prov._standby is not None:
+                    break
+                await asyncio.sleep(0.1)
+            standby = prov._standby
+            assert standby is not None and standby.is_alive()
+            # the kernel keeps running until it is restarted
+            assert await prov.poll() is None and prov.pid == first_pid
+
+            await restart()
+            assert prov.pid == standby.process.pid
+            assert "standby" in prov.launch_timings()
+            assert "resolve" not in prov.launch_timings()
+            for _ in range(50):
+                if (tmp_path / f"conn.{prov.pid}").exists():
+                    break
+                await asyncio.sleep(0.1)
+            assert json.loads((tmp_path / f"conn.{prov.pid}").read_text()) == ["-f", str(tmp_path / "conn")]
+        finally:
+            await prov.kill()
+            await prov.wait()
+            await prov.cleanup()
+        assert prov._standby is None
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="posix only")
+def test_output_buffer(tmp_path: Path, caplog: pytest.LogCaptureFixture, provisioner):
+    from pyproject_local_kernel import _outputbuffer
+
+    buffer = _outputbuffer.OutputBuffer.start(16)
+    subprocess.run([sys.executable, "-c", "print('a' * 10); print('b' * 10)"], stdout=buffer.stdout)
+    buffer.close_writers()
+    buffer.wait_idle()
+    # only the latest output is kept
+    assert [line.split("stdout: ")[1] for line in buffer.dump().splitlines()] == ["aaaa", "bbbbbbbbbb"]
+
+    write_pyproject(tmp_path)
+    (tmp_path / "failing_kernel.py").write_text("import sys, time\nprint('resolving environment', file=sys.stderr, flush=True)\n"
+                                                "time.sleep(float(sys.argv[1]))\nraise SystemExit('no ipykernel')\n")
+
+    async def launch(delay: str):
+        km = jupyter_client.AsyncKernelManager(kernel_name=KS_REGULAR)
+        prov = provisioner(parent=km, output_buffer_size=1024, slow_start_seconds=0.5,
+                           python_kernel_args=["-m", "failing_kernel", delay, "-f", "{connection_file}"])
+        km._kernel_spec = prov.kernel_spec
+        kwargs = await prov.pre_launch(cwd=str(tmp_path))
+        await prov.launch_kernel(**kwargs)
+        for _ in range(50):
+            if prov._start_watch_task is None:
+                break
+            await asyncio.sleep(0.1)
+        await prov.cleanup()
+
+    caplog.set_level(logging.INFO)
+    asyncio.run(launch("0"))
+    message, = [rec.message for rec in caplog.records if "Output of the launch" in rec.message]
+    assert "exited with status 1 before it started" in message
+    assert "stderr: resolving environment" in message and "stderr: no ipykernel" in message
+
+    caplog.clear()
+    asyncio.run(launch("2"))
+    slow, failed = [rec.message for rec in caplog.records if "Output of the launch" in rec.message]
+    assert "has not started after 0.5 s" in slow and "stderr: resolving environment" in slow
+    assert "exited with status 1" in failed
+
+
+@pytest.mark.skipif(not hasattr(os, "readv"), reason="output buffer is only supported on posix")
+def test_output_buffer_closed(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, provisioner):
+    write_pyproject(tmp_path)
+
+    def assert_closed(output):
+        output._thread.join(5)
+        assert not output._thread.is_alive()
+        assert not output._writers
+        for fd in output._readers:
+            with pytest.raises(OSError):
+                os.fstat(fd)
+
+    async def launch_failed():
+        prov = provisioner(output_buffer_size=1024)
+
+        async def fail(kwargs):
+            raise RuntimeError("no launch")
+        monkeypatch.setattr(prov, "_launch_command", fail)
+        with pytest.raises(RuntimeError, match="no launch"):
+            await prov.pre_launch(cwd=str(tmp_path))
+        return prov._output
+
+    async def not_launched():
+        prov = provisioner(output_buffer_size=1024)
+        await prov.pre_launch(cwd=str(tmp_path))
+        output = prov._output
+        await prov.cleanup()
+        return output
+
+    assert_closed(asyncio.run(launch_failed()))
+    assert_closed(asyncio.run(not_launched()))
+
+
+def test_warmup(tmp_path: Path):
+    from pyproject_local_kernel._warmup import PyprojectKernelWarmup
+
+    pyproject = write_pyproject(tmp_path)
+    (tmp_path / "sub").mkdir()
+    warmup = PyprojectKernelWarmup()
+
+    async def run():
+        # concurrent requests for the same project share the warm-up
+        first, second = await asyncio.gather(warmup.warm(tmp_path), warmup.warm(tmp_path / "sub"))
+        assert first is second
+        assert first["ok"] and not first["cached"], first
+        assert first["project"] == {"kind": "CustomConfiguration", "pyproject": str(pyproject)}
+        assert {"parse", "resolve", "warm-import"} <= set(first["phases"])
+        assert (await warmup.warm(tmp_path))["cached"]
+        # warmed again when the project changes
+        pyproject.write_text(pyproject.read_text() + "# changed\n")
+        assert not (await warmup.warm(tmp_path))["cached"]
+
+        broken = tmp_path / "broken"
+        broken.mkdir()
+        (broken / "pyproject.toml").write_text("[project\n")
+        failed = await warmup.warm(broken)
+        assert not failed["ok"] and "malformed pyproject.toml" in failed["error"]
+
+        # warm-ups older than min_interval are forgotten
+        warmup.min_interval = 0.
+        await warmup.warm(broken)
+        assert list(warmup._warmed) == [str(broken / "pyproject.toml")]
+
+    asyncio.run(run())
+
+
+def test_connection_file_ports(tmp_path: Path, provisioner):
+    write_pyproject(tmp_path)
+    km = jupyter_client.AsyncKernelManager(kernel_name=KS_REGULAR)
+    prov = provisioner(parent=km)
+    km._kernel_spec = prov.kernel_spec
+    asyncio.run(prov.pre_launch(cwd=str(tmp_path)))
+    try:
+        assert prov.launch_timings()["connection-file"] >= 0
+        # written early, with the ports that the kernel is started with
+        info = json.loads(Path(km.connection_file).read_text())
+        names = ["shell_port", "iopub_port", "stdin_port", "hb_port", "control_port"]
+        assert {name: info[name] for name in names} == {name: getattr(km, name) for name in names}
+    finally:
+        km.cleanup_connection_file()
+        asyncio.run(prov.cleanup())
+
+
+def test_task_graph():
+    import time
+    from pyproject_local_kernel import _taskgraph
+
+    graph = _taskgraph.TaskGraph()
+    graph.add("slow", lambda: time.sleep(0.3) or "resolved", blocking=True)
+    graph.add("fast", lambda: asyncio.sleep(0.1))
+    graph.add("after-fast", lambda: 1, deps=["fast"])
+    graph.add("join", lambda: (graph.result("slow"), graph.result("after-fast")), deps=["slow", "after-fast"])
+    with pytest.raises(ValueError):
+        graph.add("bad", lambda: None, deps=["missing"])
+
+    start = time.perf_counter()
+    assert asyncio.run(graph.run("join")) == ("resolved", 1)
+    # the blocking step overlapped with the others
+    assert time.perf_counter() - start < 0.38
+    assert [step.name for step in graph.critical_path("join")] == ["slow", "join"]
+    assert "overlapped: fast" in graph.format_critical_path("join")
+
+
+def test_readahead(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture, provisioner):
+    from pyproject_local_kernel import _readahead, _envcache, provisioner as provisioner_module
+    monkeypatch.setenv(_envcache.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    monkeypatch.setattr(provisioner_module, "_READAHEAD_LEARN_DELAY", 0.)
+
+    (tmp_path / "lib").mkdir()
+    for name in ("a.py", "b.py", "c.so"):
+        (tmp_path / "lib" / name).write_text("x = 1\n")
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(f"# comment\n{tmp_path}/lib/*.py\n{tmp_path}/lib/c.so\n{tmp_path}/missing\n")
+    files = _readahead.read_manifest(manifest)
+    assert sorted(Path(file).name for file in files) == ["a.py", "b.py", "c.so", "missing"]
+    assert _readahead.readahead(files) == (3, 18)
+
+    project_dir = tmp_path / "project"
+    write_pyproject(project_dir)
+    (project_dir / "fake_kernel.py").write_text("import time\ntime.sleep(30)\n")
+    prov = provisioner(readahead=True, readahead_manifest=str(manifest),
+                       python_kernel_args=["-m", "fake_kernel", "-f", str(tmp_path / "conn")])
+
+    async def launch():
+        kwargs = await prov.pre_launch(cwd=str(project_dir))
+        await prov.launch_kernel(**kwargs)
+        task = prov._readahead_learn_task
+        if task is not None:
+            await task
+        await prov.kill()
+        await prov.wait()
+        await prov.cleanup()
+
+    caplog.set_level(logging.DEBUG)
+    asyncio.run(launch())
+    learned = _readahead.load_learned(str(project_dir.resolve()))
+    assert learned is not None
+    # imported by the listing itself
+    assert any("json" in Path(file).parts for file in learned["files"])
+    assert str(project_dir / "pyproject.toml") in learned["fingerprints"]
+
+    # the next start reads the learned files and does not learn them again
+    caplog.clear()
+    asyncio.run(launch())
+    message, = [rec.message for rec in caplog.records if "readahead of" in rec.message]
+    assert int(message.split("readahead of ")[1].split()[0]) > 3
+    assert not any("learned" in rec.message for rec in caplog.records)
@@ -0,0 +1,74 @@
+import json
+from pathlib import Path
+import typing as t
+
+import pytest
+
+pytest.importorskip("pytest_jupyter")
+
+from pyproject_local_kernel._warmup import PyprojectKernelWarmup
+
+
+pytestmark = pytest.mark.unit
+pytest_plugins = ["pytest_jupyter.jupyter_server"]
+
+
+@pytest.fixture
+def jp_server_config():
+    return {"ServerApp": {"jpserver_extensions": {"pyproject_local_kernel": True}}}
+
+
+@pytest.fixture
+def warmups(monkeypatch: pytest.MonkeyPatch) -> t.List[Path]:
+    "Directories warmed by the server extension, without starting python"
+    warmed = []
+
+    def warm_blocking(self, directory: Path, kernel_name: str) -> t.Dict[str, t.Any]:
+        warmed.append(directory)
+        return {"directory": str(directory), "kernelspec": kernel_name, "ok": True, "cached": False, "seconds": 0.}
+    monkeypatch.setattr(PyprojectKernelWarmup, "_warm_blocking", warm_blocking)
+    return warmed
+
+
+async def test_warm_handler(jp_fetch, jp_root_dir: Path, warmups: t.List[Path]):
+    from tornado.httpclient import HTTPClientError
+
+    project = jp_root_dir / "project"
+    project.mkdir()
+    (project / "pyproject.toml").write_text('[project]\nname = "p"\nversion = "1"\n')
+
+    async def warm(path: str) -> t.Dict[str, t.Any]:
+        response = await jp_fetch("pyproject-local-kernel", "warm", method="POST", body=json.dumps({"path": path}))
+        return json.loads(response.body)
+
+    report = await warm("project/notebook.ipynb")
+    assert report["ok"] and not report["cached"]
+    assert warmups == [project]
+    # within min_interval
+    assert (await warm("project"))["cached"]
+    assert warmups == [project]
+
+    with pytest.raises(HTTPClientError) as exc_info:
+        await warm("../outside")
+    assert exc_info.value.code == 400
+    assert warmups == [project]
+
+
+async def test_warm_on_open(jp_root_dir: Path, warmups: t.List[Path]):
+    import asyncio
+    from pyproject_local_kernel._serverext import _warm_on_open
+
+    (jp_root_dir / "project").mkdir()
+    warmup = PyprojectKernelWarmup()
+    listener = _warm_on_open(warmup, str(jp_root_dir))
+    for data in [{"action": "get", "path": "project/notebook.ipynb"},
+                 {"action": "get", "path": "project/notebook.ipynb"},
+                 {"action": "save", "path": "other.ipynb"},
+                 {"action": "get", "path": "project/data.csv"},
+                 {"action": "get", "path": "../outside.ipynb"}]:
+        await listener(None, "", data)
+    # the warm-ups are started in the background
+    await asyncio.sleep(0)
+    while warmup._tasks:
+        await asyncio.sleep(0.01)
+    assert warmups == [jp_root_dir / "project"]
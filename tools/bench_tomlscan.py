@@ -0,0 +1,57 @@
+"""
+Benchmark reading the identification tables of a large pyproject.toml, with
+the scan (_tomlscan) and with a full parse (tomllib).
+
+Usage: python tools/bench_tomlscan.py [size in kB ...]
+"""
+
+import sys
+import timeit
+
+try:
+    import tomllib as tomli
+except ImportError:
+    import tomli
+
+from pyproject_local_kernel import _tomlscan
+from pyproject_local_kernel._identify import IDENTIFY_TABLES
+
+
+def big_pyproject(size: int) -> str:
+    "A pyproject.toml of about size characters, mostly in tool tables that are not used"
+    parts = [
+        '[project]\nname = "big"\nversion = "1.0"\ndependencies = [\n    "ipykernel",\n]\n\n'
+        '[tool.uv]\ndev-dependencies = ["pytest"]\n\n'
+        '[tool.pyproject-local-kernel]\nsanity-check = false\n\n'
+    ]
+    length = len(parts[0])
+    i = 0
+    while length < size:
+        fields = "".join(f'    {{ name = "f{j}", type = "int", doc = "field [{j}] # not a comment" }},\n'
+                         for j in range(20))
+        part = (f'[tool.codegen.model{i}]\nname = "model{i}"\nfields = [\n{fields}]\n'
+                f'template = """\nclass Model{i}:\n    [x] = "a"\n"""\n'
+                f"pattern = '^[a-z]+$'\nopts = {{ a = 1, b = [1, 2, {{ c = 3 }}] }}\n\n")
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [4, 16, 64, 256, 1024]
+    print(f"{'size':>8}  {'tomllib':>10}  {'scan':>10}  speedup")
+    for size_kb in sizes:
+        text = big_pyproject(size_kb * 1024)
+        assert _tomlscan.loads(text, IDENTIFY_TABLES)["tool"]["uv"] == tomli.loads(text)["tool"]["uv"]
+        results = []
+        for func in (lambda: tomli.loads(text), lambda: _tomlscan.loads(text, IDENTIFY_TABLES)):
+            timer = timeit.Timer(func)
+            number, _ = timer.autorange()
+            results.append(min(timer.repeat(5, number)) / number)
+        full, scan = results
+        print(f"{size_kb:>6}kB  {full * 1000:>7.2f} ms  {scan * 1000:>7.2f} ms  {full / scan:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()